@@ -1,4 +1,5 @@
-from flask import Flask, render_template, request, redirect, url_for, Response, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, Response, jsonify, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import os
 import re
 import urllib
@@ -9,12 +10,18 @@ import threading
 import time
 import shutil
 import json
+import hmac
 from datetime import datetime
 from PIL import Image
 import comfy_utils
 import obs_utils
 import ffmpeg_utils
 import extractor_utils
+import substitution_utils
+import workflow_utils
+import pipeline_utils
+import task_store
+import job_utils
 from email_utils import send_email
 
 # Add local bin directory to PATH for ffmpeg/ffprobe
@@ -29,10 +36,38 @@ except ImportError:
 
 print("App starting...")
 app = Flask(__name__)
+
+
+class TaskJSONProvider(DefaultJSONProvider):
+    """Lets jsonify() return slotted task records and log rings as plain JSON."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (task_store.Record, task_store.LogRing)):
+            return o.to_json()
+        return DefaultJSONProvider.default(o)
+
+
+app.json = TaskJSONProvider(app)
 print("Flask app created")
 
 # Global config and shared state (used across multiple routes and helpers)
-SUBSTITUTION_FILE = 'langchain/substitution.txt'  # Used in: index route text substitution logic
+SUBSTITUTION_FILE = 'langchain/substitution.txt'  # Used in: SUBSTITUTION_ENGINE (rule snapshot, edits journaled to <file>.journal)
+# Port rewrite rules {"old_port": "new_port"}, from each registered server's public_address (used in: SUBSTITUTION_ENGINE, core_replace)
+PORT_MAPPING = comfy_utils.server_registry.port_mapping()
+# Hard-coded regexes removed in order, multiline mode (used in: SUBSTITUTION_ENGINE, core_replace)
+HARD_ENCODED_PATTERNS = [
+    "登录领番茄.*",
+    "继续播放.*",
+    r"\d{2}:\d{2}.*",
+    r"[０-９\d]*[／/][０-９\d]{3,5}.*",
+    r"原进度.*从本页听",
+]
+SUBSTITUTION_ENGINE = substitution_utils.SubstitutionEngine(SUBSTITUTION_FILE, PORT_MAPPING, HARD_ENCODED_PATTERNS)  # Used in: core_replace, save_substitution, remove_substitution
+# Registry edits made through /admin/servers change the rewrite rules live
+comfy_utils.server_registry.add_listener(lambda registry: SUBSTITUTION_ENGINE.set_port_mapping(registry.port_mapping()))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")  # Used in: /admin/servers routes (X-Admin-Token must match when set; loopback only when unset)
+ADMIN_LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')  # Used in: _admin_denied (callers allowed without ADMIN_TOKEN)
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp')  # Used in: all upload, temp, ffmpeg operations
 
 VIDEO_WIDTH = 640  # Used in: generate_1s_video (ffmpeg image_to_video width)
@@ -52,29 +87,33 @@ COMFY_STATUS = {  # Used in: check_comfy_status, /comfy_status, ensure_comfy_con
     'ip': 'Unknown'
 }
 
+def _update_comfy_status():
+    """Mirrors the health table into COMFY_STATUS (no network access)."""
+    online = comfy_utils.client.ensure_connection()
+    COMFY_STATUS['status'] = 'online' if online else 'offline'
+    COMFY_STATUS['ip'] = comfy_utils.client.base_url if comfy_utils.client.base_url else "None"
+    return online
+
 def check_comfy_status():
-    """Background task to check ComfyUI status periodically"""
+    """
+    Background task: probes every ComfyUI server with a lightweight request,
+    feeds the health table, refreshes stale server capabilities and fails over
+    if the current server's circuit opened.
+    """
     while True:
         try:
-            # We assume comfy_utils has a way to check connection or we just check the server
-            # For now, let's just use comfy_utils.client.check_connection() if available
-            # Or just check if we can reach it
-            if comfy_utils.client.check_connection():
-                if COMFY_STATUS['status'] != 'online':
-                    print(f"ComfyUI is ONLINE at {comfy_utils.client.base_url}")
-                COMFY_STATUS['status'] = 'online'
-                COMFY_STATUS['ip'] = comfy_utils.client.base_url
-            else:
-                if COMFY_STATUS['status'] != 'offline':
-                    print(f"ComfyUI is OFFLINE at {comfy_utils.client.base_url}")
-                COMFY_STATUS['status'] = 'offline'
-                COMFY_STATUS['ip'] = comfy_utils.client.base_url if comfy_utils.client.base_url else "None"
+            was_online = COMFY_STATUS['status'] == 'online'
+            comfy_utils.client.health.probe_all()
+            # Node classes and model lists of reachable servers, re-read once the TTL passes
+            comfy_utils.client.capabilities.refresh_stale(comfy_utils.client.health.available())
+            if _update_comfy_status() != was_online:
+                print(f"ComfyUI is {COMFY_STATUS['status'].upper()} at {comfy_utils.client.base_url}")
         except Exception as e:
             print(f"Error checking ComfyUI status: {e}")
             COMFY_STATUS['status'] = 'offline'
             COMFY_STATUS['ip'] = "Error"
         COMFY_STATUS['last_checked'] = time.time()
-        time.sleep(30)
+        time.sleep(comfy_utils.HEALTH_PROBE_INTERVAL)
 
 # Start status checker
 status_thread = threading.Thread(target=check_comfy_status, daemon=True)
@@ -84,9 +123,24 @@ TASKS_STORE = {}  # Used in: upload_and_cut, generate_i2v_group, monitor_group_t
 SECTOR_TASKS = {} # Used in: sector17_submit, sector19_submit, check_sector_task
 AUDIO_TASKS = {}  # Used in: upload_audio, check_audio_status, process_audio_result
 AUDIO_LOCK = threading.Lock()  # Used in: concurrent audio task state protection
-WAIT_OVERTIME_SECONDS = 6 * 60 * 60  # Used in: monitor_group_task timeout control
-BACKEND_TASK_TIMEOUT_SECONDS = 6 * 60 * 60  # Used in: monitor_audio_task, monitor_i2v_group timeout control
-BACKEND_POLL_INTERVAL_SECONDS = 15  # Used in: monitor_group_task, monitor_audio_task, monitor_i2v_group polling interval
+GROUP_FINISH_LOCK = threading.Lock()  # Used in: _maybe_finish_group, _fail_group_on_timeout (finish each group once), _count_finished_task
+WAIT_OVERTIME_SECONDS = 6 * 60 * 60  # Used in: monitor_group_task deadline passed to the status service
+BACKEND_TASK_TIMEOUT_SECONDS = 6 * 60 * 60  # Used in: monitor_audio_task, monitor_i2v_group, process_digital_human_video deadlines
+SEGMENT_DURATION_SECONDS = 4  # Used in: process_i2v_upload_submission (length of each cut segment)
+UPLOAD_VIDEO_BYTES_PER_SECOND = 1024 * 1024  # Used in: upload_and_cut (assumed bitrate turning an upload's size into an admission cost)
+SEGMENT_CUT_WORKERS = 2  # Used in: process_i2v_upload_submission (ffmpeg-pool cuts one group runs at once)
+SEGMENT_SUBMIT_WORKERS = 3  # Used in: process_i2v_upload_submission (io-pool uploads + queueing one group runs at once; inline when already on io)
+SEGMENT_MAX_ATTEMPTS = 3  # Used in: _settle_task_attempt, _hedge_stragglers (first run + hedges + retries per segment)
+HEDGE_PERCENTILE = 0.95  # Used in: _hedge_stragglers (a segment running longer than this share of its family gets a duplicate)
+HEDGE_CHECK_INTERVAL_SECONDS = 30  # Used in: monitor_group_task (how often _hedge_stragglers runs)
+SECTOR19_FOLLOW_INTERVAL_SECONDS = 1  # Used in: run_sector19_task (how often _follow_sector19_i2v_group runs)
+TASK_ATTEMPT_LOCK = threading.Lock()  # Used in: _settle_task_attempt, _start_task_attempt, _hedge_stragglers
+JOB_EXECUTOR = job_utils.JobExecutor()  # Used in: every endpoint that starts background work (bounded pools per work class, see /jobs_status)
+ADMISSION = job_utils.AdmissionQueue(JOB_EXECUTOR, lambda: comfy_utils.scheduler.backlog_seconds())  # Used in: upload_and_cut, generate_i2v_group, check_group_status, release_admitted_jobs
+ADMISSION_CHECK_INTERVAL_SECONDS = 15  # Used in: release_admitted_jobs (held jobs are also released as prompts finish)
+TASK_STORE = None  # Used in: start_task_store (SQLite copy of the task dicts; set when app.py runs as a server)
+TASK_EVICT_INTERVAL_SECONDS = 10 * 60  # Used in: evict_expired_tasks (finished records expire task_store.TASK_RECORD_TTL_SECONDS after finishing)
+EVICTED_RECORDS = {'groups': 0, 'sector_tasks': 0, 'audio_tasks': 0}  # Used in: evict_expired_tasks, /memory_stats
 
 # Global UI State for Multi-Client Synchronization
 GLOBAL_STATE = {
@@ -200,22 +254,14 @@ def modify_extend_video_workflow(workflow, video_filename, audio_filename):
     """
     Modifies the extend video to audio length workflow.
     """
-    # 1. Update Video (Node 14 - VHS_LoadVideo)
-    if "14" in workflow and "inputs" in workflow["14"]:
-        workflow["14"]["inputs"]["video"] = video_filename
-        
-    # 2. Update Audio (Node 66 - LoadAudio)
-    if "66" in workflow and "inputs" in workflow["66"]:
-        workflow["66"]["inputs"]["audio"] = audio_filename
-    
-    return workflow
+    # Video -> Node 14 (VHS_LoadVideo), Audio -> Node 66 (LoadAudio)
+    return workflow_utils.registry.get("extend_video").bind(
+        workflow, video=video_filename, audio=audio_filename
+    )
 
 def modify_i2v_workflow(workflow, image_filename, prompt_text):
-    if "97" in workflow and "inputs" in workflow["97"]:
-        workflow["97"]["inputs"]["image"] = image_filename
-    if "93" in workflow and "inputs" in workflow["93"]:
-        workflow["93"]["inputs"]["text"] = prompt_text
-    return workflow
+    # Image -> Node 97, Text -> Node 93
+    return workflow_utils.registry.get("i2v").bind(workflow, image=image_filename, text=prompt_text)
 
 def generate_1s_video(image_path, output_path):
     """
@@ -236,65 +282,31 @@ def generate_1s_video(image_path, output_path):
         raise e
 
 def get_substitutions():
-    if not os.path.exists(SUBSTITUTION_FILE):
-        return ""
-    with open(SUBSTITUTION_FILE, 'r', encoding='utf-8') as f:
-        return f.read()
-
-def save_substitution(char):
-    with open(SUBSTITUTION_FILE, 'r', encoding='utf-8') as f:
-        strings = f.read()
-    with open(SUBSTITUTION_FILE, 'w', encoding='utf-8') as f:
-        stringset = set(strings)
-        stringset.add(char)
-        f.write(''.join(stringset))
-
-def remove_substitution(char):
-    if not os.path.exists(SUBSTITUTION_FILE):
-        return
-    content = ""
-    with open(SUBSTITUTION_FILE, 'r', encoding='utf-8') as f:
-        content = f.read()
-    # 删除所有匹配的字符
-    new_content = content.replace(char, '')
-    with open(SUBSTITUTION_FILE, 'w', encoding='utf-8') as f:
-        f.write(new_content)
+    # 有序的替换规则列表（每条规则为任意子串）
+    return SUBSTITUTION_ENGINE.rules
+
+def save_substitution(rule):
+    return SUBSTITUTION_ENGINE.add_rule(rule)
+
+def remove_substitution(rule):
+    return SUBSTITUTION_ENGINE.remove_rule(rule)
 
 def modify_audio_workflow(workflow, text, filename, emotions=None):
     """
     Modifies the audio workflow JSON based on inputs.
     """
-    # 1. Update Text (Node 27)
-    if "27" in workflow and "inputs" in workflow["27"]:
-        workflow["27"]["inputs"]["text"] = text
-
-    # 2. Update Audio File (Node 29)
-    if "29" in workflow and "inputs" in workflow["29"]:
-        workflow["29"]["inputs"]["audio"] = filename
-        
-    # 3. Randomize seed (Node 27)
     import random
-    if "27" in workflow and "inputs" in workflow["27"]:
-        # Max seed for 32-bit/safe integer in some contexts is 2^32 - 1 = 4294967295
-        # The error says "Value ... bigger than max of 4294967295"
-        workflow["27"]["inputs"]["seed"] = random.randint(1, 4294967295)
-
-    # 4. Update Emotions (Node 47)
-    # Emotions list: Happy, Angry, Sad, Fear, Hate, Low, Surprise, Neutral
-    all_emotions = ["Happy", "Angry", "Sad", "Fear", "Hate", "Low", "Surprise", "Neutral"]
-    if "47" in workflow and "inputs" in workflow["47"]:
-        if emotions:
-            for emo in all_emotions:
-                if emo in emotions:
-                    workflow["47"]["inputs"][emo] = 0.75
-                else:
-                    workflow["47"]["inputs"][emo] = 0
-        else:
-            # Reset all to 0 if no emotions provided
-            for emo in all_emotions:
-                workflow["47"]["inputs"][emo] = 0
-        
-    return workflow
+    # Text/seed -> Node 27, Audio file -> Node 29, Emotions -> Node 47.
+    # Max seed is 2^32 - 1 = 4294967295 ("Value ... bigger than max of 4294967295")
+    emotions = emotions or []
+    emotion_values = {emo: (0.75 if emo in emotions else 0) for emo in workflow_utils.AUDIO_EMOTIONS}
+    return workflow_utils.registry.get("audio").bind(
+        workflow,
+        text=text,
+        audio=filename,
+        seed=random.randint(1, 4294967295),
+        **emotion_values,
+    )
 
 
 
@@ -319,12 +331,12 @@ def index():
         
         # 如果有 text 参数，则是字符串替换请求
         if text:
-            # 取第一个字符用于 add/remove 替换规则
-            char = text[0]
+            # 取第一行作为 add/remove 的替换规则（任意子串）
+            rule = text.splitlines()[0] if text.splitlines() else ''
             if action == 'add':
-                save_substitution(char)
+                save_substitution(rule)
             elif action == 'remove':
-                remove_substitution(char)
+                remove_substitution(rule)
             
             # 执行字符串替换，只返回替换后的纯文本内容
             text = core_replace(text)
@@ -346,41 +358,68 @@ def index():
     return render_template('index.html', substitutions=substitutions)
 
 def core_replace(text):
-    # ========== 端口替换配置 ==========
-    # 格式: {"old_port": "new_port"}
-    port_mapping = {
-        "192.168.0.209:7860": "192.168.0.209:7890",
-        "192.168.0.210:7860": "192.168.0.210:7890",
-        "192.168.50.210:7860": "192.168.50.210:7890",
-    }
-    
-    # 替换端口
-    for old_port, new_port in port_mapping.items():
-        text = text.replace(old_port, new_port)
-    
-    # ========== 直接硬编码替换字符串，写在这里 ==========
-    hard_encoded = ["登录领番茄.*", 
-                    "继续播放.*",
-                    r"\d{2}:\d{2}.*", 
-                    r"[０-９\d]*[／/][０-９\d]{3,5}.*", 
-                    r"原进度.*从本页听"]
-    # 遍历所有替换规则
-    for pattern in hard_encoded:
-        # 用正则替换（re.sub 支持正则，且忽略换行/多行匹配）
-        text = re.sub(pattern, "", text, flags=re.MULTILINE)
-
-    # ========== 原有替换逻辑 ==========
-    substitutions = get_substitutions()
-    for char in substitutions:
-        text = text.replace(char, '')
-    return text
+    # 端口替换 + 硬编码正则 + 字符删除，均由预编译的引擎完成
+    return SUBSTITUTION_ENGINE.apply(text)
+
+def core_replace_many(texts):
+    # 批量替换：整批只检查一次规则文件，逐条惰性产出结果
+    return SUBSTITUTION_ENGINE.apply_many(texts)
+
+def _parse_ndjson_text(line):
+    item = json.loads(line)
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict) and isinstance(item.get('text', ''), str):
+        return item.get('text', '')
+    raise ValueError("each line must be a JSON string or an object with 'text'")
+
+def replace_ndjson_stream(lines):
+    """
+    Streams one output line per NDJSON input line as soon as it is processed.
+    Bad lines yield an error object without aborting the rest of the stream.
+    """
+    # 整个请求只检查一次规则文件
+    SUBSTITUTION_ENGINE.refresh()
+    for raw in lines:
+        try:
+            if isinstance(raw, bytes):
+                raw = raw.decode('utf-8')
+            raw = raw.strip()
+            if not raw:
+                continue
+            text = _parse_ndjson_text(raw)
+        except ValueError as e:
+            yield json.dumps({'error': str(e)}, ensure_ascii=False) + "\n"
+            continue
+        result = SUBSTITUTION_ENGINE.apply(text, refresh=False)
+        yield json.dumps({'text': result}, ensure_ascii=False) + "\n"
 
 @app.route('/replace', methods=['POST'])
 def replace():
+    # ========== NDJSON 流式模式：每行输入立即产出一行结果 ==========
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        return Response(
+            stream_with_context(replace_ndjson_stream(request.stream)),
+            status=200,
+            mimetype='application/x-ndjson; charset=utf-8'
+        )
+
     # ========== 核心修改：解析JSON数据 ==========
     try:
         # 直接解析JSON请求体，自动保留换行符/中文
         json_data = request.get_json(force=True)
+        # 批量模式：[...] -> [...]，{"texts": [...]} -> {"texts": [...]}
+        if isinstance(json_data, list):
+            if not all(isinstance(t, str) for t in json_data):
+                return jsonify({'error': 'a JSON array body must contain only strings'}), 400
+            return jsonify(list(core_replace_many(json_data)))
+        if not isinstance(json_data, dict):
+            return jsonify({'error': 'expected {"text": "..."}, {"texts": ["..."]} or a JSON array of strings'}), 400
+        texts = json_data.get('texts')
+        if texts is not None:
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                return jsonify({'error': 'texts must be a list of strings'}), 400
+            return jsonify({'texts': list(core_replace_many(texts))})
         # 获取text参数（默认空字符串）
         text = json_data.get('text', '')
     except Exception as e:
@@ -403,27 +442,166 @@ def replace():
 
 @app.route('/comfy_status')
 def comfy_status():
-    return jsonify(COMFY_STATUS)
+    return jsonify({
+        **COMFY_STATUS,
+        'http_stats': comfy_utils.client.connection_stats(),
+        'events': comfy_utils.client.completions.snapshot(),
+        'watched': comfy_utils.client.watched_prompts(),
+        'scheduler': comfy_utils.scheduler.snapshot(),
+        'upload_cache': comfy_utils.client.upload_cache.snapshot(),
+        'health': comfy_utils.client.health.snapshot(),
+        'capabilities': comfy_utils.client.capabilities.snapshot(),
+        'result_cache': comfy_utils.client.result_cache.snapshot(),
+        'downloads': comfy_utils.client.downloads.snapshot(),
+        'latency': comfy_utils.scheduler.latency_snapshot(),
+    })
+
+@app.route('/jobs_status')
+def jobs_status():
+    """Job pool queues and counters, admission control state and outstanding prompts per family."""
+    return jsonify({
+        'pools': JOB_EXECUTOR.stats(),
+        'scheduled': JOB_EXECUTOR.scheduled(),
+        'admission': ADMISSION.snapshot(),
+        'outstanding_prompts': comfy_utils.scheduler.outstanding(),
+        'task_store': TASK_STORE.snapshot() if TASK_STORE else None,
+    })
+
+def _evict_expired_tasks(now=None):
+    """
+    Drops finished group, sector and audio records once they are older than
+    task_store.TASK_RECORD_TTL_SECONDS. Groups a channel or sector still
+    points at stay. The task store deletes their rows on its next flush.
+    """
+    keep = {group_id for group_id in CHANNEL_TRANSITION_GROUPS.values() if group_id}
+    with GLOBAL_STATE_LOCK:
+        keep.update(state.get('latest_task_id') for state in GLOBAL_STATE.values() if state.get('latest_task_id'))
+    evicted = {
+        'groups': task_store.evict_expired(TASKS_STORE, now=now, keep=keep),
+        'sector_tasks': task_store.evict_expired(SECTOR_TASKS, now=now, keep=keep),
+    }
+    with AUDIO_LOCK:
+        evicted['audio_tasks'] = task_store.evict_expired(AUDIO_TASKS, now=now)
+    for name, keys in evicted.items():
+        EVICTED_RECORDS[name] += len(keys)
+    return evicted
+
+def evict_expired_tasks():
+    """Background task: expires finished task records (see _evict_expired_tasks)."""
+    while True:
+        time.sleep(TASK_EVICT_INTERVAL_SECONDS)
+        try:
+            evicted = _evict_expired_tasks()
+            if any(evicted.values()):
+                print(f"Evicted expired task records: { {name: len(keys) for name, keys in evicted.items()} }")
+        except Exception as e:
+            print(f"Error evicting task records: {e}")
+
+eviction_thread = threading.Thread(target=evict_expired_tasks, daemon=True)
+eviction_thread.start()
+
+def _process_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # No /proc (macOS): peak RSS, which the stdlib reports in bytes there
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+@app.route('/memory_stats')
+def memory_stats():
+    """Process RSS, size of the in-memory task records and how many expired."""
+    return jsonify({
+        'rss_bytes': _process_rss_bytes(),
+        'records': {
+            'groups': task_store.footprint(TASKS_STORE),
+            'sector_tasks': task_store.footprint(SECTOR_TASKS),
+            'audio_tasks': task_store.footprint(AUDIO_TASKS),
+        },
+        'evicted': EVICTED_RECORDS,
+        'record_ttl_seconds': task_store.TASK_RECORD_TTL_SECONDS,
+        'log_capacity': task_store.TASK_LOG_CAPACITY,
+    })
 
 @app.route('/retest_connection', methods=['POST'])
 def retest_connection():
     try:
-        success = comfy_utils.client.find_fastest_server()
-        status = 'online' if success else 'offline'
+        # Explicit user request: probe now instead of waiting for the next cycle
+        comfy_utils.client.health.probe_all()
+        success = _update_comfy_status()
         ip = comfy_utils.client.base_url
-        
-        # Update global status immediately
-        COMFY_STATUS['status'] = status
-        COMFY_STATUS['ip'] = ip
         COMFY_STATUS['last_checked'] = time.time()
         
         return jsonify({'status': 'success', 'connected': success, 'ip': ip})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+def _admin_denied():
+    """
+    403 unless X-Admin-Token matches ADMIN_TOKEN. Without a token only
+    requests from this machine are let in: the app listens on every
+    interface, and an added server receives user uploads and prompts.
+    """
+    if ADMIN_TOKEN:
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+            return jsonify({'error': 'Forbidden'}), 403
+    elif request.remote_addr not in ADMIN_LOOPBACK_ADDRESSES:
+        return jsonify({'error': 'Forbidden: set ADMIN_TOKEN to manage servers remotely'}), 403
+    return None
+
+def _admin_server_edit(edit, *args):
+    denied = _admin_denied()
+    if denied:
+        return denied
+    try:
+        server = edit(*args)
+    except KeyError as e:
+        return jsonify({'error': str(e).strip("'")}), 404
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'server': server, 'servers': comfy_utils.server_registry.snapshot()})
+
+@app.route('/admin/servers', methods=['GET', 'POST'])
+def admin_servers():
+    """Lists the ComfyUI server registry, or adds {address, weight, public_address}."""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if request.method == 'GET':
+        return jsonify({'servers': comfy_utils.server_registry.snapshot()})
+    data = request.get_json(force=True, silent=True) or {}
+    if not data.get('address'):
+        return jsonify({'error': 'address is required'}), 400
+    response = _admin_server_edit(
+        comfy_utils.server_registry.add, data['address'], data.get('weight', 1), data.get('public_address')
+    )
+    if not isinstance(response, tuple):
+        # Probe the new box now instead of at the next status cycle
+        JOB_EXECUTOR.submit('io', comfy_utils.client.health.probe, data['address'])
+    return response
+
+@app.route('/admin/servers/<address>', methods=['DELETE'])
+def admin_remove_server(address):
+    return _admin_server_edit(comfy_utils.server_registry.remove, address)
+
+@app.route('/admin/servers/<address>/drain', methods=['POST'])
+def admin_drain_server(address):
+    return _admin_server_edit(comfy_utils.server_registry.drain, address)
+
+@app.route('/admin/servers/<address>/activate', methods=['POST'])
+def admin_activate_server(address):
+    return _admin_server_edit(comfy_utils.server_registry.activate, address)
+
+@app.route('/admin/servers/<address>/weight', methods=['POST'])
+def admin_server_weight(address):
+    data = request.get_json(force=True, silent=True) or {}
+    return _admin_server_edit(comfy_utils.server_registry.set_weight, address, data.get('weight'))
+
 def ensure_comfy_connection():
     """
-    Checks connection to ComfyUI and updates global status.
+    Checks the ComfyUI health table and updates global status. Does no
+    network I/O; the background status thread keeps the table fresh.
     Raises exception if no server is available.
     """
     if app.config.get('TESTING'):
@@ -432,17 +610,11 @@ def ensure_comfy_connection():
         COMFY_STATUS['last_checked'] = time.time()
         return
 
-    # Force a check which will try to switch servers if current is down
-    if not comfy_utils.client.check_connection():
-        # If check_connection returns False, it means even after retries it failed
-        COMFY_STATUS['status'] = 'offline'
+    # Every circuit open means every server failed recently
+    if not _update_comfy_status():
         COMFY_STATUS['ip'] = "None"
         raise Exception("Could not connect to any ComfyUI server")
-    
-    # If we are here, we are connected
-    COMFY_STATUS['status'] = 'online'
-    COMFY_STATUS['ip'] = comfy_utils.client.base_url
-    COMFY_STATUS['last_checked'] = time.time()
+
     print(f"【网络检查】ComfyUI连接成功，当前服务器地址: {COMFY_STATUS['ip']}")
 
 @app.route('/upload_character', methods=['POST'])
@@ -480,6 +652,8 @@ def upload_character():
             img.save(png_path, "PNG")
 
             obs_url = obs_utils.upload_file(png_path, png_filename, mime_type='image/png')
+            # Push the new character to the GPU servers before the next job needs it
+            comfy_utils.prewarm_uploads([png_path])
 
             if os.path.exists(temp_path):
                 os.remove(temp_path)
@@ -494,12 +668,12 @@ def upload_character():
         temp_video_path = os.path.join(UPLOAD_FOLDER, f"temp_char_video_{uuid.uuid4()}.{ext}")
         file.save(temp_video_path)
 
-        info = ffmpeg_utils.get_video_info(temp_video_path)
+        info = JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.get_video_info, temp_video_path)
         duration = info.get('duration', 0) or 0
 
         mid_time = duration / 2.0 if duration and duration > 0 else 0
         character_path = os.path.join(UPLOAD_FOLDER, "character.png")
-        ffmpeg_utils.extract_frame(temp_video_path, character_path, mid_time)
+        JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.extract_frame, temp_video_path, character_path, mid_time)
 
         segment_duration = 10.0
         if duration and duration > segment_duration:
@@ -528,10 +702,11 @@ def upload_character():
             '2',
             tone_path,
         ]
-        ffmpeg_utils.run_command(cmd)
+        JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.run_command, cmd)
 
         character_url = obs_utils.upload_file(character_path, "character.png", mime_type='image/png')
         tone_url = obs_utils.upload_file(tone_path, "tone.wav", mime_type='audio/wav')
+        comfy_utils.prewarm_uploads([character_path, tone_path])
 
         if os.path.exists(temp_video_path):
             os.remove(temp_video_path)
@@ -608,7 +783,7 @@ def upload_audio():
                     # Verify it has video stream using ffmpeg
                     is_valid_video = False
                     try:
-                        info = ffmpeg_utils.get_video_info(input_video_path)
+                        info = JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.get_video_info, input_video_path)
                         if info.get('duration', 0) > 0 and info.get('width', 0) > 0 and info.get('height', 0) > 0:
                             is_valid_video = True
                             print(f"Video verification passed for {input_video_filename}: {info.get('width')}x{info.get('height')}, {info.get('duration')}s")
@@ -713,14 +888,12 @@ def upload_audio():
                     os.remove(wav_path)
                 return jsonify({'error': f'Failed to upload to ComfyUI: {str(e)}'}), 500
 
-        # Load Workflow
-        workflow_path = os.path.join(os.path.dirname(__file__), 'comfyapi', 'audio_workflow.json')
-        if not os.path.exists(workflow_path):
+        # Instantiate Workflow (parsed once, cached by the template registry)
+        try:
+            workflow = workflow_utils.registry.get('audio').instance()
+        except FileNotFoundError:
              return jsonify({"error": "Workflow file not found"}), 500
-             
-        with open(workflow_path, 'r', encoding='utf-8') as f:
-            workflow = json.load(f)
-            
+
         workflow = modify_audio_workflow(workflow, text, uploaded_filename, emotions)
         
         queue_result = comfy_utils.client.queue_prompt(workflow)
@@ -746,10 +919,8 @@ def upload_audio():
             with AUDIO_LOCK:
                 AUDIO_TASKS[prompt_id] = task_info
             
-            # Start background monitor for this task
-            monitor_thread = threading.Thread(target=monitor_audio_task, args=(prompt_id,))
-            monitor_thread.daemon = True
-            monitor_thread.start()
+            # Hand the task to the background status service
+            monitor_audio_task(prompt_id)
             
             # Clean up generated wav path if we created it
             if file and file.filename != '' and os.path.exists(wav_path):
@@ -799,14 +970,14 @@ def process_digital_human_video(audio_path, input_video_path=None):
             stage2_video_path = input_video_path
             trimmed_video_path = None
             try:
-                info = ffmpeg_utils.get_video_info(input_video_path)
+                info = JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.get_video_info, input_video_path)
                 duration = info.get('duration', 0)
                 end_time = min(3, duration) if duration > 0 else 3
                 
                 trimmed_video_filename = f"stage2_input_3s_{uuid.uuid4()}.mp4"
                 trimmed_video_path = os.path.join(UPLOAD_FOLDER, trimmed_video_filename)
                 
-                ffmpeg_utils.cut_video(input_video_path, trimmed_video_path, 0, end_time)
+                JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.cut_video, input_video_path, trimmed_video_path, 0, end_time)
                 
                 stage2_video_path = trimmed_video_path
                 print(f"Trimmed input video to first {end_time}s: {trimmed_video_path}")
@@ -882,7 +1053,7 @@ def process_digital_human_video(audio_path, input_video_path=None):
                 video_1s_filename = f"character_1s_{uuid.uuid4()}.mp4"
                 video_1s_path = os.path.join(UPLOAD_FOLDER, video_1s_filename)
                 try:
-                    generate_1s_video(character_path, video_1s_path)
+                    JOB_EXECUTOR.call('ffmpeg', generate_1s_video, character_path, video_1s_path)
                 except Exception as e:
                     print(f"Error generating 1s video: {e}")
                     return
@@ -905,15 +1076,13 @@ def process_digital_human_video(audio_path, input_video_path=None):
         # 4. Submit Task
         print("Submitting digital human task...")
         
-        # Load Workflow Template
-        workflow_path = os.path.join(os.path.dirname(__file__), 'comfyapi', '扩展视频到音频长度.json')
-        if not os.path.exists(workflow_path):
+        # Instantiate Workflow Template
+        try:
+            workflow_template = workflow_utils.registry.get('extend_video').instance()
+        except FileNotFoundError:
             print("Digital human workflow file not found")
             return
-            
-        with open(workflow_path, 'r', encoding='utf-8') as f:
-            workflow_template = json.load(f)
-            
+
         # Modify Workflow
         current_workflow = modify_extend_video_workflow(
             workflow_template, 
@@ -929,67 +1098,52 @@ def process_digital_human_video(audio_path, input_video_path=None):
             
         print(f"Task queued with ID: {prompt_id} on {server_address}")
         
+        # Inputs are on ComfyUI now; the result is handled by _on_digital_human_done
+        for temp_path in (character_path, video_1s_path):
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
         print("Monitoring digital human task...")
-        start_time = time.time()
-        
-        while True:
-            try:
-                if time.time() - start_time > BACKEND_TASK_TIMEOUT_SECONDS:
-                    print("Digital human task timed out after 6 hours")
-                    break
-                
-                status, result = comfy_utils.check_status(prompt_id, server_address)
-                
-                if status == 'SUCCEEDED':
-                    if isinstance(result, dict):
-                        print("Task succeeded, downloading...")
-                        local_path = comfy_utils.download_result(result, UPLOAD_FOLDER, server_address)
-                        
-                        if local_path:
-                            output_filename = datetime.now().strftime("%Y%m%d%H%M%Sall.mp4")
-                            output_path = os.path.join(UPLOAD_FOLDER, output_filename)
-                            
-                            shutil.move(local_path, output_path)
-                            
-                            print(f"Uploading result to OBS as {output_filename}...")
-                            obs_url = obs_utils.upload_file(output_path, output_filename, mime_type='video/mp4')
-                            
-                            if obs_url:
-                                print(f"Digital human video successfully uploaded: {obs_url}")
-                                # Send email notification
-                                send_email("Digital Human Video Completed", obs_url)
-                            else:
-                                print("Failed to upload digital human video to OBS")
-                        else:
-                            print("Failed to download result")
-                    else:
-                        print("Invalid result format")
-                    break
-                    
-                elif status == 'FAILED':
-                    print(f"Task failed: {result}")
-                    break
-                    
-            except Exception as e:
-                print(f"Error checking task: {e}")
-            
-            time.sleep(BACKEND_POLL_INTERVAL_SECONDS)
-            
-        # Cleanup
-        if os.path.exists(character_path):
-            os.remove(character_path)
-        if os.path.exists(video_1s_path):
-            os.remove(video_1s_path)
-        if os.path.exists(audio_path):
-            # Audio path is passed in, might be needed? 
-            # In previous logic we cleaned it up.
-            pass
+        comfy_utils.watch_prompt(
+            prompt_id, server_address,
+            lambda pid, status, result: JOB_EXECUTOR.submit('io', _on_digital_human_done, pid, server_address, status, result),
+            time.time() + BACKEND_TASK_TIMEOUT_SECONDS,
+        )
             
     except Exception as e:
         print(f"Process digital human video error: {e}")
         import traceback
         traceback.print_exc()
 
+def _on_digital_human_done(prompt_id, server_address, status, result):
+    """Downloads a finished digital human video and publishes it to OBS."""
+    if status == 'TIMEOUT':
+        print("Digital human task timed out after 6 hours")
+        return
+    if status == 'FAILED':
+        print(f"Task failed: {result}")
+        return
+    if not isinstance(result, dict):
+        print("Invalid result format")
+        return
+    print("Task succeeded, downloading...")
+    local_path = comfy_utils.download_result(result, UPLOAD_FOLDER, server_address, prompt_id)
+    if not local_path:
+        print("Failed to download result")
+        return
+    output_filename = datetime.now().strftime("%Y%m%d%H%M%Sall.mp4")
+    output_path = os.path.join(UPLOAD_FOLDER, output_filename)
+    shutil.move(local_path, output_path)
+
+    print(f"Uploading result to OBS as {output_filename}...")
+    obs_url = obs_utils.upload_file(output_path, output_filename, mime_type='video/mp4')
+    if obs_url:
+        comfy_utils.remember_result_url(prompt_id, obs_url)
+        print(f"Digital human video successfully uploaded: {obs_url}")
+        # Send email notification
+        send_email("Digital Human Video Completed", obs_url)
+    else:
+        print("Failed to upload digital human video to OBS")
+
 def process_audio_result(prompt_id, result):
     """
     Process the result of an audio task: download, convert, upload to OBS, and trigger Stage 2.
@@ -997,7 +1151,11 @@ def process_audio_result(prompt_id, result):
     """
     try:
         if isinstance(result, dict):
-            local_path = comfy_utils.download_result(result, UPLOAD_FOLDER)
+            # Download from the server that ran the prompt, not whatever base_url is now
+            with AUDIO_LOCK:
+                server_address = AUDIO_TASKS.get(prompt_id, {}).get('server')
+            server_address = server_address or comfy_utils.server_of(prompt_id)
+            local_path = comfy_utils.download_result(result, UPLOAD_FOLDER, server_address, prompt_id)
             if local_path:
                 # Upload to OBS
                 # Naming: YYYYMMDDHHMMSSaudio.wav
@@ -1022,7 +1180,13 @@ def process_audio_result(prompt_id, result):
                     # Fallback to original file but renamed
                     shutil.copy(local_path, wav_path)
 
-                obs_url = obs_utils.upload_file(wav_path, output_filename, mime_type='audio/wav')
+                # A result cache hit already carries the URL it was published under
+                obs_url = result.get('obs_url')
+                if obs_url:
+                    print(f"Reusing cached audio URL: {obs_url}")
+                else:
+                    obs_url = obs_utils.upload_file(wav_path, output_filename, mime_type='audio/wav')
+                    comfy_utils.remember_result_url(prompt_id, obs_url)
                 
                 # Rename local file to match so latest_audio can find it
                 # local_renamed_path is used for stage 2
@@ -1047,9 +1211,8 @@ def process_audio_result(prompt_id, result):
                         if prompt_id in AUDIO_TASKS and 'input_video_path' in AUDIO_TASKS[prompt_id]:
                             input_video_path = AUDIO_TASKS[prompt_id]['input_video_path']
                         
-                    thread = threading.Thread(target=process_digital_human_video, args=(local_renamed_path, input_video_path))
-                    thread.daemon = True
-                    thread.start()
+                    # Uploads and queues only; the prompt is then watched by the status service
+                    JOB_EXECUTOR.submit('io', process_digital_human_video, local_renamed_path, input_video_path)
                     
                     return True, obs_url
                 else:
@@ -1064,54 +1227,55 @@ def process_audio_result(prompt_id, result):
 
 def monitor_audio_task(prompt_id):
     """
-    Background thread to monitor audio task status.
+    Registers an audio task with the ComfyUI status service; the result is
+    handled by _on_audio_task_done once the prompt finishes.
     """
     print(f"Started monitoring audio task {prompt_id}")
-    while True:
-        with AUDIO_LOCK:
-            if prompt_id not in AUDIO_TASKS:
-                break
-            task_data = AUDIO_TASKS[prompt_id]
-            status = task_data['status']
-            created_at = task_data.get('created_at')
-            if created_at is not None and time.time() - created_at > BACKEND_TASK_TIMEOUT_SECONDS:
-                AUDIO_TASKS[prompt_id]['status'] = 'failed'
-                AUDIO_TASKS[prompt_id]['error'] = 'Timeout: audio task exceeded 6 hours'
-                print(f"Audio task {prompt_id} timed out after 6 hours")
-                break
-            if status in ['completed', 'failed']:
-                break
-        
-        try:
-            status, result = comfy_utils.check_status(prompt_id)
-            
-            if status == 'SUCCEEDED':
-                should_process = False
-                with AUDIO_LOCK:
-                    current_status = AUDIO_TASKS.get(prompt_id, {}).get('status')
-                    if current_status not in ['processing_result', 'completed', 'failed']:
-                        AUDIO_TASKS[prompt_id]['status'] = 'processing_result'
-                        should_process = True
-                
-                if should_process:
-                    print(f"Monitor: Task {prompt_id} succeeded. Processing result...")
-                    success, output = process_audio_result(prompt_id, result)
-                    if not success:
-                        with AUDIO_LOCK:
-                            if prompt_id in AUDIO_TASKS:
-                                AUDIO_TASKS[prompt_id]['status'] = 'failed'
-                break
-                
-            elif status == 'FAILED':
-                with AUDIO_LOCK:
-                    if prompt_id in AUDIO_TASKS:
-                        AUDIO_TASKS[prompt_id]['status'] = 'failed'
-                break
-                
-        except Exception as e:
-            print(f"Monitor error for {prompt_id}: {e}")
-            
-        time.sleep(BACKEND_POLL_INTERVAL_SECONDS)
+    with AUDIO_LOCK:
+        task_data = AUDIO_TASKS.get(prompt_id)
+        if not task_data:
+            return
+        server_address = task_data.get('server')
+        created_at = task_data.get('created_at')
+    deadline = created_at + BACKEND_TASK_TIMEOUT_SECONDS if created_at is not None else None
+    comfy_utils.watch_prompt(prompt_id, server_address, _on_audio_task_done, deadline)
+
+def _on_audio_task_done(prompt_id, status, result):
+    with AUDIO_LOCK:
+        if prompt_id not in AUDIO_TASKS:
+            return
+        if AUDIO_TASKS[prompt_id]['status'] in ['completed', 'failed']:
+            return
+        if status == 'TIMEOUT':
+            AUDIO_TASKS[prompt_id]['status'] = 'failed'
+            AUDIO_TASKS[prompt_id]['error'] = 'Timeout: audio task exceeded 6 hours'
+            print(f"Audio task {prompt_id} timed out after 6 hours")
+            return
+
+    try:
+        if status == 'SUCCEEDED':
+            should_process = False
+            with AUDIO_LOCK:
+                current_status = AUDIO_TASKS.get(prompt_id, {}).get('status')
+                if current_status not in ['processing_result', 'completed', 'failed']:
+                    AUDIO_TASKS[prompt_id]['status'] = 'processing_result'
+                    should_process = True
+
+            if should_process:
+                print(f"Monitor: Task {prompt_id} succeeded. Processing result...")
+                success, output = process_audio_result(prompt_id, result)
+                if not success:
+                    with AUDIO_LOCK:
+                        if prompt_id in AUDIO_TASKS:
+                            AUDIO_TASKS[prompt_id]['status'] = 'failed'
+
+        elif status == 'FAILED':
+            with AUDIO_LOCK:
+                if prompt_id in AUDIO_TASKS:
+                    AUDIO_TASKS[prompt_id]['status'] = 'failed'
+
+    except Exception as e:
+        print(f"Monitor error for {prompt_id}: {e}")
 
 @app.route('/check_audio_status/<prompt_id>', methods=['GET'])
 def check_audio_status(prompt_id):
@@ -1192,151 +1356,359 @@ def get_latest_audio():
         print(f"Error fetching latest audio: {e}")
         return jsonify({'error': str(e)}), 500
 
-def monitor_group_task(group_id):
-    """
-    Background thread to monitor task status.
-    """
+def _group_log_callback(group_id, label):
     def log_callback(msg):
         if group_id in TASKS_STORE:
             processed_msg = process_log_message(msg)
             TASKS_STORE[group_id].setdefault('logs', []).append(f"[{datetime.now().strftime('%H:%M:%S')}] {processed_msg}")
             # Also print for server logs
-            print(f"[Group {group_id}] {msg}")
+            print(f"[{label} {group_id}] {msg}")
+    return log_callback
 
-    log_callback(f"Starting monitor for group {group_id}")
+def _watch_group_tasks(group_id, on_task_done, on_all_done, timeout_seconds):
+    """
+    Registers every unfinished task of a group with the ComfyUI status
+    service. on_task_done(group_id, task, status, result) runs per finished
+    task and may return a Future (e.g. a result download) that the task's
+    outcome waits on; on_all_done(group_id) runs once all current tasks are
+    finished. Safe to call again after tasks were appended to the group.
+    Tasks that carry a job spec may have several attempts (see
+    _settle_task_attempt); each running one is watched.
+    """
+    group_data = TASKS_STORE.get(group_id)
+    if not group_data:
+        return False
+    # Submission is over once a monitor runs (see recover_tasks)
+    group_data['monitor_started'] = True
+    deadline = _group_deadline(group_data, timeout_seconds)
+
+    for task in list(group_data.get('tasks', [])):
+        if task['status'] in ['completed', 'failed'] or not task.get('task_id'):
+            continue
+        if 'job' in task:
+            for attempt in list(task['attempts']):
+                if attempt['status'] == 'running':
+                    _watch_task_attempt(group_id, task, attempt, on_task_done, on_all_done, deadline)
+        else:
+            _watch_task_attempt(group_id, task, None, on_task_done, on_all_done, deadline)
+
+    _maybe_finish_group(group_id, on_all_done)
+    return True
+
+def _group_deadline(group_data, timeout_seconds):
+    created_at = group_data.get('created_at')
+    return created_at + timeout_seconds if created_at is not None else None
+
+def _watch_task_attempt(group_id, task, attempt, on_task_done, on_all_done, deadline):
+    prompt_id = attempt['task_id'] if attempt else task['task_id']
+    server = attempt['server'] if attempt else task.get('server')
+
+    def settled():
+        _count_finished_task(group_id, task)
+        _maybe_finish_group(group_id, on_all_done)
+
+    def callback(prompt_id, status, result):
+        if attempt is not None and not _settle_task_attempt(group_id, task, attempt, status, on_task_done, on_all_done, deadline):
+            return
+        pending = on_task_done(group_id, task, status, result)
+        if pending is not None:
+            pending.add_done_callback(lambda _: settled())
+            return
+        settled()
+
+    comfy_utils.watch_prompt(prompt_id, server, callback, deadline)
+
+def _start_task_attempt(group_id, task, on_task_done, on_all_done, deadline, exclude=(), hedge=False):
+    """
+    Queues the task's job spec again, on a server outside exclude, and
+    watches the new attempt. Returns the attempt, or None if nothing accepted it.
+    """
+    log_callback = _group_log_callback(group_id, "Group")
+    job = task['job']
+    prompt_id, server_address, error = comfy_utils.submit_workflow_template(
+        job['character'],
+        job['video'],
+        workflow_type=job['workflow_type'],
+        segment_duration=job['segment_duration'],
+        log_callback=log_callback,
+        exclude=exclude,
+    )
+    if not prompt_id:
+        log_callback(f"Could not queue segment {task['segment_index']+1} again: {error}")
+        return None
+    attempt = {'task_id': prompt_id, 'server': server_address, 'status': 'running', 'queued_at': time.time(), 'hedge': hedge}
+    with TASK_ATTEMPT_LOCK:
+        task['attempts'].append(attempt)
+    _watch_task_attempt(group_id, task, attempt, on_task_done, on_all_done, deadline)
+    return attempt
+
+def _settle_task_attempt(group_id, task, attempt, status, on_task_done, on_all_done, deadline):
+    """
+    Folds one attempt's outcome into its task. The first attempt to succeed
+    (or time out) decides the task: it becomes task_id/server and the other
+    running attempts are cancelled. A failure waits for attempts still
+    running, then is retried on a server not tried yet while fewer than
+    SEGMENT_MAX_ATTEMPTS exist. Returns True when the outcome should be
+    handed to on_task_done.
+    """
+    log_callback = _group_log_callback(group_id, "Group")
+    with TASK_ATTEMPT_LOCK:
+        if task.get('settled'):
+            return False
+        attempt['status'] = status
+        running = [a for a in task['attempts'] if a['status'] == 'running']
+        if status == 'FAILED' and running:
+            return False
+        retry = status == 'FAILED' and len(task['attempts']) < SEGMENT_MAX_ATTEMPTS
+        if not retry:
+            task['settled'] = True
+            task['task_id'] = attempt['task_id']
+            task['server'] = attempt['server']
+        tried = [a['server'] for a in task['attempts'] if a['server']]
+
+    if retry:
+        log_callback(f"Segment {task['segment_index']+1} failed on {attempt['server']}, retrying on another server")
+        if _start_task_attempt(group_id, task, on_task_done, on_all_done, deadline, exclude=tried):
+            return False
+        with TASK_ATTEMPT_LOCK:
+            task['settled'] = True
+            task['task_id'] = attempt['task_id']
+            task['server'] = attempt['server']
+    elif status == 'SUCCEEDED' and len(task['attempts']) > 1:
+        log_callback(f"Segment {task['segment_index']+1} finished first on {attempt['server']}")
+    for loser in running:
+        comfy_utils.cancel_job(loser['task_id'], loser['server'])
+        log_callback(f"Cancelled duplicate {loser['task_id']} on {loser['server']}")
+    # The job's inputs are no longer needed once the task is decided
+    if os.path.exists(task['job']['video']):
+        os.remove(task['job']['video'])
+    return True
+
+def _hedge_stragglers(group_id, on_task_done, on_all_done, deadline):
+    """
+    One hedging pass: a segment running longer than its workflow family's
+    p95 while another server is idle gets a duplicate on that server.
+    Returns False once the group has no undecided job tasks left.
+    """
+    group_data = TASKS_STORE.get(group_id)
+    if not group_data or group_data.get('status') in ['completed', 'failed']:
+        return False
+    log_callback = _group_log_callback(group_id, "Group")
+    pending = False
+    for task in list(group_data.get('tasks', [])):
+        if 'job' not in task or task.get('settled'):
+            continue
+        pending = True
+        with TASK_ATTEMPT_LOCK:
+            running = [a for a in task['attempts'] if a['status'] == 'running']
+            if len(running) != 1 or len(task['attempts']) >= SEGMENT_MAX_ATTEMPTS:
+                continue
+            attempt = running[0]
+            tried = [a['server'] for a in task['attempts'] if a['server']]
+        p95 = comfy_utils.scheduler.latency_percentile(task['job']['family'], HEDGE_PERCENTILE)
+        if p95 is None:
+            continue
+        started_at = comfy_utils.client.completions.started_at(attempt['task_id']) or attempt['queued_at']
+        if time.time() - started_at <= p95:
+            continue
+        idle = comfy_utils.scheduler.idle_servers(exclude=tried)
+        if not idle:
+            continue
+        log_callback(f"Segment {task['segment_index']+1} is past p95 ({p95:.0f}s) on {attempt['server']}, duplicating on {idle[0]}")
+        busy = [s for s in comfy_utils.scheduler.servers if s not in idle]
+        _start_task_attempt(group_id, task, on_task_done, on_all_done, deadline, exclude=busy, hedge=True)
+    return pending
+
+def _count_finished_task(group_id, task):
+    """
+    Adds a task that just finished to its group's completed_count or
+    failed_count, once, so status polls read progress without scanning
+    every task.
+    """
+    group_data = TASKS_STORE.get(group_id)
+    if group_data is None or task['status'] not in ['completed', 'failed']:
+        return
+    with GROUP_FINISH_LOCK:
+        if task.get('counted'):
+            return
+        task['counted'] = True
+        key = 'completed_count' if task['status'] == 'completed' else 'failed_count'
+        group_data[key] = group_data.get(key, 0) + 1
+
+def _maybe_finish_group(group_id, on_all_done):
+    """
+    Queues on_all_done once per set of tasks, when every task has finished.
+    It concatenates and uploads, so it runs on the ffmpeg pool rather than
+    on the download worker or status thread that settled the last task.
+    """
     group_data = TASKS_STORE.get(group_id)
     if not group_data:
+        return
+    with GROUP_FINISH_LOCK:
+        tasks = group_data.get('tasks', [])
+        if any(t['status'] not in ['completed', 'failed'] for t in tasks):
+            return
+        if group_data.get('finished_task_count') == len(tasks):
+            return
+        group_data['finished_task_count'] = len(tasks)
+    JOB_EXECUTOR.submit('ffmpeg', on_all_done, group_id)
+
+def _fail_group_on_timeout(group_id, group_data, message):
+    with GROUP_FINISH_LOCK:
+        if group_data.get('finished_task_count') == len(group_data.get('tasks', [])):
+            return False
+        group_data['finished_task_count'] = len(group_data.get('tasks', []))
+    group_data['status'] = 'failed'
+    group_data['error'] = message
+    return True
+
+def _download_task_result(task, result, record):
+    """
+    Downloads a finished task's output on the download pool, so a group whose
+    segments finish together fetches them in parallel. record(local_path,
+    error) runs when the download ends; returns the Future.
+    """
+    future = comfy_utils.download_result_async(result, UPLOAD_FOLDER, task.get('server'), task['task_id'])
+
+    def done(f):
+        error = f.exception()
+        record(None if error else f.result(), error)
+
+    future.add_done_callback(done)
+    return future
+
+def monitor_group_task(group_id):
+    """
+    Hands a group's ComfyUI tasks to the status service. Results are
+    downloaded by _on_group_task_done and the group is concatenated by
+    _finish_group once every task is done. Segments with a job spec are
+    also hedged and retried (see _hedge_stragglers, _settle_task_attempt).
+    """
+    log_callback = _group_log_callback(group_id, "Group")
+    log_callback(f"Starting monitor for group {group_id}")
+    if not _watch_group_tasks(group_id, _on_group_task_done, _finish_group, WAIT_OVERTIME_SECONDS):
         print(f"Group {group_id} not found")
         return
+    group_data = TASKS_STORE[group_id]
+    if any('job' in t for t in group_data.get('tasks', [])):
+        deadline = _group_deadline(group_data, WAIT_OVERTIME_SECONDS)
+        JOB_EXECUTOR.schedule('monitor', HEDGE_CHECK_INTERVAL_SECONDS, _hedge_stragglers, group_id, _on_group_task_done, _finish_group, deadline)
 
-    while True:
-        now = time.time()
-        created_at = group_data.get('created_at')
-        if created_at is not None and now - created_at > WAIT_OVERTIME_SECONDS:
-            group_data['status'] = 'failed'
-            group_data['error'] = 'Timeout: group exceeded 6 hours'
+def _on_group_task_done(group_id, task, status, result):
+    log_callback = _group_log_callback(group_id, "Group")
+    group_data = TASKS_STORE.get(group_id)
+    if not group_data or task['status'] in ['completed', 'failed']:
+        return
+    if status == 'TIMEOUT':
+        task['status'] = 'failed'
+        task['error'] = 'Timeout'
+        if _fail_group_on_timeout(group_id, group_data, 'Timeout: group exceeded 6 hours'):
             log_callback(f"Group {group_id} timed out after 6 hours")
-            break
-
-        all_done = True
-        
-        # Check each task
-        for task in group_data['tasks']:
-            if task['status'] in ['completed', 'failed']:
-                continue
-                
-            # Check status from ComfyUI
-            try:
-                status, result = comfy_utils.check_status(task['task_id'], task.get('server'))
-                # print(f"DEBUG: Task {task['task_id']} status={status}")
-                
-                if status == 'SUCCEEDED':
-                    # Download result
-                    if isinstance(result, dict):
-                        try:
-                            local_path = comfy_utils.download_result(result, UPLOAD_FOLDER, task.get('server'))
-                            if local_path:
-                                task['result_path'] = local_path
-                                task['status'] = 'completed'
-                                log_callback(f"【转场】步骤4/6: 转场视频下载与定位完成，task_id={task['task_id']}")
-                            else:
-                                task['status'] = 'failed'
-                                task['error'] = 'Download failed (None returned)'
-                                log_callback(f"DEBUG: Download returned None for {task['task_id']}")
-                        except Exception as e:
-                            task['status'] = 'failed'
-                            task['error'] = f'Download exception: {e}'
-                            log_callback(f"DEBUG: Download exception for {task['task_id']}: {e}")
+        return
+    try:
+        if status == 'SUCCEEDED':
+            # Download result
+            if isinstance(result, dict):
+                def record(local_path, error):
+                    if error is not None:
+                        task['status'] = 'failed'
+                        task['error'] = f'Download exception: {error}'
+                        log_callback(f"DEBUG: Download exception for {task['task_id']}: {error}")
+                    elif local_path:
+                        task['result_path'] = local_path
+                        task['status'] = 'completed'
+                        log_callback(f"【转场】步骤4/6: 转场视频下载与定位完成，task_id={task['task_id']}")
                     else:
                         task['status'] = 'failed'
-                        task['error'] = 'Invalid result format'
-                        log_callback(f"DEBUG: Invalid result format for {task['task_id']}")
-                        
-                elif status == 'FAILED':
-                    task['status'] = 'failed'
-                    task['error'] = str(result)
-                    log_callback(f"【转场】任务失败 task_id={task['task_id']}, error={task['error']}")
-                else:
-                    # PENDING or RUNNING
-                    all_done = False
-            except Exception as e:
-                log_callback(f"Error checking task {task['task_id']}: {e}")
-                # Don't mark as failed immediately, maybe network glitch?
-                # But for now let's not block forever
-                all_done = False
+                        task['error'] = 'Download failed (None returned)'
+                        log_callback(f"DEBUG: Download returned None for {task['task_id']}")
+
+                return _download_task_result(task, result, record)
+            else:
+                task['status'] = 'failed'
+                task['error'] = 'Invalid result format'
+                log_callback(f"DEBUG: Invalid result format for {task['task_id']}")
             
-        if all_done:
-            log_callback(f"【转场】检测到组{group_id}所有ComfyUI子任务结束，开始拼接+上传OBS")
-            log_callback(f"Group {group_id} all tasks done. Concatenating...")
-            # Concatenate videos
-            try:
-                # Sort by segment index
-                sorted_tasks = sorted(group_data['tasks'], key=lambda x: x['segment_index'])
-                video_paths = []
-                for t in sorted_tasks:
-                    if t['result_path'] and os.path.exists(t['result_path']):
-                        video_paths.append(t['result_path'])
-                
-                if video_paths:
-                    output_filename = datetime.now().strftime("%Y%m%d%H%M%Sall.mp4")
-                    output_path = os.path.join(UPLOAD_FOLDER, output_filename)
-                    
-                    # Temp concatenated video (silent)
-                    temp_concat_path = os.path.join(UPLOAD_FOLDER, f"temp_concat_{group_id}.mp4")
-                    ffmpeg_utils.concatenate_videos(video_paths, temp_concat_path)
-                    
-                    # Merge audio back
-                    audio_path = group_data.get('audio_path')
-                    if audio_path and os.path.exists(audio_path):
-                        try:
-                            # Merge audio with loop enabled if needed
-                            # Our merge_audio_video with loop_audio=True will loop it
-                            ffmpeg_utils.merge_audio_video(temp_concat_path, audio_path, output_path, loop_audio=True)
-                            log_callback(f"Merged audio from {audio_path}")
-                            
-                            # Remove temp concat
-                            if os.path.exists(temp_concat_path):
-                                os.remove(temp_concat_path)
-                        except Exception as e:
-                            log_callback(f"Failed to merge audio: {e}")
-                            # If merge fails, just use the silent video? 
-                            # Or maybe move temp to output
-                            if os.path.exists(temp_concat_path):
-                                shutil.move(temp_concat_path, output_path)
-                    else:
-                        # No audio, just move temp to output
-                        if os.path.exists(temp_concat_path):
-                            shutil.move(temp_concat_path, output_path)
-                    
-                    # Upload to OBS
-                    log_callback(f"Uploading {output_path} to OBS...")
-                    obs_url = obs_utils.upload_file(output_path, output_filename, mime_type='video/mp4')
-                    
-                    if obs_url:
-                        group_data['final_url'] = obs_url
-                        group_data['status'] = 'completed'
-                        log_callback(f"【转场】步骤6/6: 视频合并、重命名与上传完成，生成并上传all.mp4: {output_filename}")
-                        
-                        # Send email notification
-                        task_type = group_data.get('workflow_type', 'Group Task')
-                        email_subject = f"{task_type} Completed"
-                        send_email(email_subject, obs_url)
-                    else:
-                        group_data['status'] = 'failed'
-                        group_data['error'] = 'OBS upload failed'
-                else:
-                    group_data['status'] = 'failed'
-                    group_data['error'] = 'No clips to concatenate'
+        elif status == 'FAILED':
+            task['status'] = 'failed'
+            task['error'] = str(result)
+            log_callback(f"【转场】任务失败 task_id={task['task_id']}, error={task['error']}")
+    except Exception as e:
+        log_callback(f"Error checking task {task['task_id']}: {e}")
+
+def _finish_group(group_id):
+    log_callback = _group_log_callback(group_id, "Group")
+    group_data = TASKS_STORE.get(group_id)
+    if not group_data:
+        return
+    log_callback(f"【转场】检测到组{group_id}所有ComfyUI子任务结束，开始拼接+上传OBS")
+    log_callback(f"Group {group_id} all tasks done. Concatenating...")
+    # Concatenate videos
+    try:
+        # Sort by segment index
+        sorted_tasks = sorted(group_data['tasks'], key=lambda x: x['segment_index'])
+        video_paths = []
+        for t in sorted_tasks:
+            if t['result_path'] and os.path.exists(t['result_path']):
+                video_paths.append(t['result_path'])
+        
+        if video_paths:
+            output_filename = datetime.now().strftime("%Y%m%d%H%M%Sall.mp4")
+            output_path = os.path.join(UPLOAD_FOLDER, output_filename)
+            
+            # Temp concatenated video (silent)
+            temp_concat_path = os.path.join(UPLOAD_FOLDER, f"temp_concat_{group_id}.mp4")
+            ffmpeg_utils.concatenate_videos(video_paths, temp_concat_path)
+            
+            # Merge audio back
+            audio_path = group_data.get('audio_path')
+            if audio_path and os.path.exists(audio_path):
+                try:
+                    # Merge audio with loop enabled if needed
+                    # Our merge_audio_video with loop_audio=True will loop it
+                    ffmpeg_utils.merge_audio_video(temp_concat_path, audio_path, output_path, loop_audio=True)
+                    log_callback(f"Merged audio from {audio_path}")
                     
-            except Exception as e:
-                log_callback(f"Concatenation error: {e}")
-                group_data['status'] = 'failed'
-                group_data['error'] = str(e)
+                    # Remove temp concat
+                    if os.path.exists(temp_concat_path):
+                        os.remove(temp_concat_path)
+                except Exception as e:
+                    log_callback(f"Failed to merge audio: {e}")
+                    # If merge fails, just use the silent video? 
+                    # Or maybe move temp to output
+                    if os.path.exists(temp_concat_path):
+                        shutil.move(temp_concat_path, output_path)
+            else:
+                # No audio, just move temp to output
+                if os.path.exists(temp_concat_path):
+                    shutil.move(temp_concat_path, output_path)
             
-            log_callback(f"Group {group_id} finished with status {group_data['status']}")
-            break
+            # Upload to OBS
+            log_callback(f"Uploading {output_path} to OBS...")
+            obs_url = obs_utils.upload_file(output_path, output_filename, mime_type='video/mp4')
             
-        time.sleep(BACKEND_POLL_INTERVAL_SECONDS)
+            if obs_url:
+                group_data['final_url'] = obs_url
+                group_data['status'] = 'completed'
+                log_callback(f"【转场】步骤6/6: 视频合并、重命名与上传完成，生成并上传all.mp4: {output_filename}")
+                
+                # Send email notification
+                task_type = group_data.get('workflow_type', 'Group Task')
+                email_subject = f"{task_type} Completed"
+                send_email(email_subject, obs_url)
+            else:
+                group_data['status'] = 'failed'
+                group_data['error'] = 'OBS upload failed'
+        else:
+            group_data['status'] = 'failed'
+            group_data['error'] = 'No clips to concatenate'
+            
+    except Exception as e:
+        log_callback(f"Concatenation error: {e}")
+        group_data['status'] = 'failed'
+        group_data['error'] = str(e)
+    
+    log_callback(f"Group {group_id} finished with status {group_data['status']}")
 
 
 CHANNEL_TRANSITION_GROUPS = {
@@ -1360,7 +1732,7 @@ def add_video_to_transition_group_core(file_path, original_filename, group_id=No
         print(f"【转场】创建新的转场任务组，group_id={group_id}")
         # Initialize group data with a consistent switch prompt
         switch_prompt = comfy_utils._load_switch_prompt()
-        group_data = {
+        group_data = task_store.GroupRecord({
             "status": "processing",
             "tasks": [],
             "created_at": time.time(),
@@ -1369,7 +1741,7 @@ def add_video_to_transition_group_core(file_path, original_filename, group_id=No
             "transition_videos": [],
             "monitor_started": False,
             "switch_prompt": switch_prompt,
-        }
+        })
         TASKS_STORE[group_id] = group_data
 
     index = len(group_data.get("transition_videos", []))
@@ -1384,12 +1756,12 @@ def add_video_to_transition_group_core(file_path, original_filename, group_id=No
     if not os.path.exists(raw_path):
         raise Exception(f"Video file not found: {raw_path}")
 
-    ffmpeg_utils.resize_video(raw_path, preprocessed_path, 640, 16)
+    JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.resize_video, raw_path, preprocessed_path, 640, 16)
     print(
         f"【转场】已预处理转场视频为640x640,16fps，原始文件={raw_path}，输出文件={preprocessed_path}"
     )
 
-    info = ffmpeg_utils.get_video_info(preprocessed_path)
+    info = JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.get_video_info, preprocessed_path)
     duration = info.get("duration", 0) if isinstance(info, dict) else 0
     if duration is None:
         duration = 0
@@ -1403,13 +1775,13 @@ def add_video_to_transition_group_core(file_path, original_filename, group_id=No
 
     if index == 0:
         group_data["tasks"].append(
-            {
+            task_store.SegmentRecord({
                 "task_id": None,
                 "server": None,
                 "status": "completed",
                 "segment_index": 0,
                 "result_path": preprocessed_path,
-            }
+            })
         )
     else:
         prev_video = group_data["transition_videos"][index - 1]
@@ -1426,25 +1798,15 @@ def add_video_to_transition_group_core(file_path, original_filename, group_id=No
             UPLOAD_FOLDER, f"transition_{group_id}_{index}_start.png"
         )
 
-        ffmpeg_utils.extract_frame(prev_video["path"], start_image_path, offset)
-        ffmpeg_utils.extract_frame(preprocessed_path, end_image_path, 0)
+        JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.extract_frame, prev_video["path"], start_image_path, offset)
+        JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.extract_frame, preprocessed_path, end_image_path, 0)
         print(
             f"【转场】步骤2/6: 首尾帧提取完成，路径: {start_image_path}, {end_image_path}"
         )
 
-        start_upload = comfy_utils.client.upload_file(start_image_path)
-        end_upload = comfy_utils.client.upload_file(end_image_path)
-
-        if not start_upload or not end_upload:
-            raise Exception("Failed to upload transition frames to ComfyUI")
-
-        start_image_name = start_upload.get("name")
-        end_image_name = end_upload.get("name")
-        if not start_image_name or not end_image_name:
-            raise Exception("Invalid frame upload response from ComfyUI")
-
+        # The scheduler uploads both frames to whichever server it picks
         prompt_id, server_address, error = comfy_utils.queue_transition_workflow(
-            start_image_name, end_image_name, prompt_text=group_data.get("switch_prompt")
+            start_image_path, end_image_path, prompt_text=group_data.get("switch_prompt")
         )
         if not prompt_id:
             raise Exception(error or "Failed to queue transition workflow")
@@ -1453,34 +1815,30 @@ def add_video_to_transition_group_core(file_path, original_filename, group_id=No
         )
 
         group_data["tasks"].append(
-            {
+            task_store.SegmentRecord({
                 "task_id": prompt_id,
                 "server": server_address,
                 "status": "pending",
                 "segment_index": 2 * index - 1,
                 "result_path": None,
-            }
+            })
         )
         group_data["tasks"].append(
-            {
+            task_store.SegmentRecord({
                 "task_id": None,
                 "server": None,
                 "status": "completed",
                 "segment_index": 2 * index,
                 "result_path": preprocessed_path,
-            }
+            })
         )
 
     # Reset status to processing if we are adding more videos
     group_data["status"] = "processing"
 
-    if not group_data.get("monitor_started") or (group_data.get("monitor_thread") and not group_data["monitor_thread"].is_alive()):
-        thread = threading.Thread(target=monitor_group_task, args=(group_id,))
-        thread.daemon = True
-        thread.start()
-        group_data["monitor_started"] = True
-        group_data["monitor_thread"] = thread
-        print(f"Started/Restarted monitor thread for group {group_id}")
+    # Registers only the newly appended tasks; already watched ones are skipped
+    monitor_group_task(group_id)
+    group_data["monitor_started"] = True
 
     if index > 0:
         print(f"【转场】步骤5/6: 滑动窗口递推执行完成，已为第{index}段转场任务完成初始化")
@@ -1496,6 +1854,7 @@ def _add_transition_video_to_group(file_storage, group_id=None):
     file_storage.save(raw_path)
     
     try:
+        # Only the resize and frame extraction inside take an ffmpeg slot
         return add_video_to_transition_group_core(raw_path, file_storage.filename, group_id)
     finally:
         if os.path.exists(raw_path):
@@ -1507,157 +1866,156 @@ def _add_transition_video_to_group(file_storage, group_id=None):
 
 
 def monitor_i2v_group(group_id):
-    def log_callback(msg):
-        if group_id in TASKS_STORE:
-            processed_msg = process_log_message(msg)
-            TASKS_STORE[group_id].setdefault('logs', []).append(f"[{datetime.now().strftime('%H:%M:%S')}] {processed_msg}")
-            print(f"[I2V Group {group_id}] {msg}")
-
-    group_data = TASKS_STORE.get(group_id)
-    if not group_data:
+    """
+    Hands an I2V group's ComfyUI tasks to the status service; see
+    _on_i2v_task_done and _finish_i2v_group.
+    """
+    log_callback = _group_log_callback(group_id, "I2V Group")
+    if group_id not in TASKS_STORE:
         return
-
     log_callback(f"Starting I2V monitor for group {group_id}")
+    _watch_group_tasks(group_id, _on_i2v_task_done, _finish_i2v_group, BACKEND_TASK_TIMEOUT_SECONDS)
 
-    while True:
-        now = time.time()
-        created_at = group_data.get('created_at')
-        if created_at is not None and now - created_at > BACKEND_TASK_TIMEOUT_SECONDS:
-            group_data['status'] = 'failed'
+def _on_i2v_task_done(group_id, task, status, result):
+    log_callback = _group_log_callback(group_id, "I2V Group")
+    group_data = TASKS_STORE.get(group_id)
+    if not group_data or task['status'] in ['completed', 'failed']:
+        return
+    if status == 'TIMEOUT':
+        task['status'] = 'failed'
+        if _fail_group_on_timeout(group_id, group_data, 'Timeout'):
             log_callback(f"Timeout: group exceeded {BACKEND_TASK_TIMEOUT_SECONDS} seconds")
-            break
-        tasks = group_data.get('tasks', [])
-        all_done = True
-        for task in tasks:
-            if task['status'] in ['completed', 'failed']:
-                continue
-            all_done = False
-            try:
-                status, result = comfy_utils.check_status(task['task_id'], task.get('server'))
-                if status == 'SUCCEEDED':
-                    if isinstance(result, dict):
-                        local_path = comfy_utils.download_result(result, UPLOAD_FOLDER, task.get('server'))
-                        if local_path:
-                            task['result_path'] = local_path
-                            task['status'] = 'completed'
-                            log_callback(f"Task {task['task_id']} completed. Path: {local_path}")
-                        else:
-                            task['status'] = 'failed'
-                            log_callback(f"Task {task['task_id']} download failed.")
+        return
+    try:
+        if status == 'SUCCEEDED':
+            if isinstance(result, dict):
+                def record(local_path, error):
+                    if local_path:
+                        task['result_path'] = local_path
+                        task['status'] = 'completed'
+                        log_callback(f"Task {task['task_id']} completed. Path: {local_path}")
                     else:
                         task['status'] = 'failed'
-                        log_callback(f"Task {task['task_id']} result invalid format.")
-                elif status == 'FAILED':
-                    task['status'] = 'failed'
-                    log_callback(f"Task {task['task_id']} failed in ComfyUI.")
-            except Exception as e:
-                log_callback(f"Error checking task {task['task_id']}: {e}")
-                pass
-        if all_done:
-            log_callback("All tasks done. Concatenating...")
-            video_paths = []
-            for t in sorted(tasks, key=lambda x: x['segment_index']):
-                if t.get('result_path') and os.path.exists(t['result_path']):
-                    video_paths.append(t['result_path'])
-            if video_paths:
-                output_filename = datetime.now().strftime("%Y%m%d%H%M%Sall.mp4")
-                output_path = os.path.join(UPLOAD_FOLDER, output_filename)
-                temp_concat_path = os.path.join(UPLOAD_FOLDER, f"temp_i2v_{group_id}.mp4")
+                        log_callback(f"Task {task['task_id']} download failed.")
+
+                return _download_task_result(task, result, record)
+            else:
+                task['status'] = 'failed'
+                log_callback(f"Task {task['task_id']} result invalid format.")
+        elif status == 'FAILED':
+            task['status'] = 'failed'
+            log_callback(f"Task {task['task_id']} failed in ComfyUI.")
+    except Exception as e:
+        log_callback(f"Error checking task {task['task_id']}: {e}")
+
+def _finish_i2v_group(group_id):
+    log_callback = _group_log_callback(group_id, "I2V Group")
+    group_data = TASKS_STORE.get(group_id)
+    if not group_data:
+        return
+    tasks = group_data.get('tasks', [])
+    log_callback("All tasks done. Concatenating...")
+    video_paths = []
+    for t in sorted(tasks, key=lambda x: x['segment_index']):
+        if t.get('result_path') and os.path.exists(t['result_path']):
+            video_paths.append(t['result_path'])
+    if video_paths:
+        output_filename = datetime.now().strftime("%Y%m%d%H%M%Sall.mp4")
+        output_path = os.path.join(UPLOAD_FOLDER, output_filename)
+        temp_concat_path = os.path.join(UPLOAD_FOLDER, f"temp_i2v_{group_id}.mp4")
+        try:
+            log_callback(f"Concatenating {len(video_paths)} videos...")
+            ffmpeg_utils.concatenate_videos(video_paths, temp_concat_path)
+            if os.path.exists(temp_concat_path):
+                shutil.move(temp_concat_path, output_path)
+            
+            log_callback(f"Uploading result to OBS: {output_filename}")
+            obs_url = obs_utils.upload_file(output_path, output_filename, mime_type='video/mp4')
+            if obs_url:
+                group_data['final_url'] = obs_url
+                group_data['status'] = 'completed'
+                log_callback(f"【I2V】步骤6/6: 视频合并、重命名与上传完成，生成并上传all.mp4: {output_filename}")
+                
+                # Extract last frame and upload as character.png
                 try:
-                    log_callback(f"Concatenating {len(video_paths)} videos...")
-                    ffmpeg_utils.concatenate_videos(video_paths, temp_concat_path)
-                    if os.path.exists(temp_concat_path):
-                        shutil.move(temp_concat_path, output_path)
+                    log_callback(f"【I2V】中间步骤: 提取视频最后一帧并上传为 character.png...")
+                    frame_output_path = os.path.join(UPLOAD_FOLDER, f"last_frame_{group_id}.png")
                     
-                    log_callback(f"Uploading result to OBS: {output_filename}")
-                    obs_url = obs_utils.upload_file(output_path, output_filename, mime_type='video/mp4')
-                    if obs_url:
-                        group_data['final_url'] = obs_url
-                        group_data['status'] = 'completed'
-                        log_callback(f"【I2V】步骤6/6: 视频合并、重命名与上传完成，生成并上传all.mp4: {output_filename}")
-                        
-                        # Extract last frame and upload as character.png
-                        try:
-                            log_callback(f"【I2V】中间步骤: 提取视频最后一帧并上传为 character.png...")
-                            frame_output_path = os.path.join(UPLOAD_FOLDER, f"last_frame_{group_id}.png")
-                            
-                            # Get duration
-                            video_info = ffmpeg_utils.get_video_info(output_path)
-                            duration = video_info.get('duration', 0)
-                            
-                            if duration > 0:
-                                # Extract last frame (offset slightly from end)
-                                extract_time = max(0, duration - 0.1)
-                                ffmpeg_utils.extract_frame(output_path, frame_output_path, extract_time)
-                                
-                                if os.path.exists(frame_output_path):
-                                    # Upload to OBS
-                                    obs_utils.upload_file(frame_output_path, "character.png", mime_type="image/png")
-                                    log_callback(f"【I2V】character.png 更新成功")
-                                    
-                                    # Clean up frame
-                                    try:
-                                        os.remove(frame_output_path)
-                                    except:
-                                        pass
-                                else:
-                                    log_callback(f"【I2V】警告: 最后一帧提取失败，未找到文件")
-                            else:
-                                log_callback(f"【I2V】警告: 视频时长无效，跳过 character.png 更新")
-                                
-                        except Exception as e:
-                            log_callback(f"【I2V】character.png 更新失败: {e}")
-                        
-                        # Send email notification
-                        send_email("Image-to-Video (I2V) Task Completed", obs_url)
+                    # Get duration
+                    video_info = ffmpeg_utils.get_video_info(output_path)
+                    duration = video_info.get('duration', 0)
+                    
+                    if duration > 0:
+                        # Extract last frame (offset slightly from end)
+                        extract_time = max(0, duration - 0.1)
+                        ffmpeg_utils.extract_frame(output_path, frame_output_path, extract_time)
                         
-                        # Trigger automatic flow for Sectors 9, 10, 11, 12 -> 13, 14, 15, 16
-                        # Iterate through ALL tasks to trigger corresponding channels
-                        for task in tasks:
-                            idx = task.get('segment_index')
-                            local_res_path = task.get('result_path')
+                        if os.path.exists(frame_output_path):
+                            # Upload to OBS
+                            obs_utils.upload_file(frame_output_path, "character.png", mime_type="image/png")
+                            log_callback(f"【I2V】character.png 更新成功")
                             
-                            if not local_res_path or not os.path.exists(local_res_path):
-                                continue
-
-                            target_channel = None
-                            if idx == 0: target_channel = '13'
-                            elif idx == 1: target_channel = '14'
-                            elif idx == 2: target_channel = '15'
-                            elif idx == 3: target_channel = '16'
-                            
-                            if target_channel:
-                                log_callback(f"【自动触发】Task idx={idx}完成，触发Sector{target_channel}流程")
-                                try:
-                                    channel_group_id = CHANNEL_TRANSITION_GROUPS.get(target_channel)
-                                    if channel_group_id and channel_group_id not in TASKS_STORE:
-                                        channel_group_id = None
-                                    
-                                    # Use the individual task video path
-                                    new_group_id = add_video_to_transition_group_core(
-                                        local_res_path, 
-                                        os.path.basename(local_res_path), 
-                                        channel_group_id
-                                    )
-                                    CHANNEL_TRANSITION_GROUPS[target_channel] = new_group_id
-                                    log_callback(f"【自动触发】已将视频添加到Sector{target_channel}转场组: {new_group_id}")
-                                except Exception as e:
-                                    log_callback(f"【自动触发】Sector{target_channel}失败: {e}")
-                        
+                            # Clean up frame
+                            try:
+                                os.remove(frame_output_path)
+                            except:
+                                pass
+                        else:
+                            log_callback(f"【I2V】警告: 最后一帧提取失败，未找到文件")
                     else:
-                        group_data['status'] = 'failed'
-                        group_data['error'] = 'OBS upload failed'
-                        log_callback("OBS upload failed.")
+                        log_callback(f"【I2V】警告: 视频时长无效，跳过 character.png 更新")
+                        
                 except Exception as e:
-                    group_data['status'] = 'failed'
-                    group_data['error'] = str(e)
-                    log_callback(f"Error during concatenation/upload: {e}")
+                    log_callback(f"【I2V】character.png 更新失败: {e}")
+                
+                # Send email notification
+                send_email("Image-to-Video (I2V) Task Completed", obs_url)
+                
+                # Trigger automatic flow for Sectors 9, 10, 11, 12 -> 13, 14, 15, 16
+                # Iterate through ALL tasks to trigger corresponding channels
+                for task in tasks:
+                    idx = task.get('segment_index')
+                    local_res_path = task.get('result_path')
+                    
+                    if not local_res_path or not os.path.exists(local_res_path):
+                        continue
+
+                    target_channel = None
+                    if idx == 0: target_channel = '13'
+                    elif idx == 1: target_channel = '14'
+                    elif idx == 2: target_channel = '15'
+                    elif idx == 3: target_channel = '16'
+                    
+                    if target_channel:
+                        log_callback(f"【自动触发】Task idx={idx}完成，触发Sector{target_channel}流程")
+                        try:
+                            channel_group_id = CHANNEL_TRANSITION_GROUPS.get(target_channel)
+                            if channel_group_id and channel_group_id not in TASKS_STORE:
+                                channel_group_id = None
+                            
+                            # Use the individual task video path
+                            new_group_id = add_video_to_transition_group_core(
+                                local_res_path, 
+                                os.path.basename(local_res_path), 
+                                channel_group_id
+                            )
+                            CHANNEL_TRANSITION_GROUPS[target_channel] = new_group_id
+                            log_callback(f"【自动触发】已将视频添加到Sector{target_channel}转场组: {new_group_id}")
+                        except Exception as e:
+                            log_callback(f"【自动触发】Sector{target_channel}失败: {e}")
+                
             else:
                 group_data['status'] = 'failed'
-                group_data['error'] = 'No videos generated'
-                log_callback("No videos generated.")
-            break
-        time.sleep(BACKEND_POLL_INTERVAL_SECONDS)
+                group_data['error'] = 'OBS upload failed'
+                log_callback("OBS upload failed.")
+        except Exception as e:
+            group_data['status'] = 'failed'
+            group_data['error'] = str(e)
+            log_callback(f"Error during concatenation/upload: {e}")
+    else:
+        group_data['status'] = 'failed'
+        group_data['error'] = 'No videos generated'
+        log_callback("No videos generated.")
 
 def process_i2v_upload_submission(group_id, file_path, workflow_type):
     """
@@ -1673,19 +2031,25 @@ def process_i2v_upload_submission(group_id, file_path, workflow_type):
     
     filename = os.path.basename(file_path)
     
-    # 1. Audio Extraction
+    # 1. Audio Extraction (only needed when the group is concatenated, so it
+    # runs alongside cutting instead of delaying the first segment)
     audio_path = os.path.join(UPLOAD_FOLDER, f"original_audio_{group_id}.mp3")
-    try:
-        log_callback("Checking/Extracting audio...")
-        info = ffmpeg_utils.get_video_info(file_path)
-        if info.get('has_audio'):
-            ffmpeg_utils.extract_audio(file_path, audio_path)
-            TASKS_STORE[group_id]['audio_path'] = audio_path
-            log_callback(f"Audio extracted to {audio_path}")
-        else:
-            log_callback("No audio found in video.")
-    except Exception as e:
-        log_callback(f"Failed to extract audio: {e}")
+
+    def extract_audio():
+        try:
+            log_callback("Checking/Extracting audio...")
+            info = ffmpeg_utils.get_video_info(file_path)
+            if info.get('has_audio'):
+                ffmpeg_utils.extract_audio(file_path, audio_path)
+                TASKS_STORE[group_id]['audio_path'] = audio_path
+                log_callback(f"Audio extracted to {audio_path}")
+            else:
+                log_callback("No audio found in video.")
+        except Exception as e:
+            log_callback(f"Failed to extract audio: {e}")
+
+    # Probing and extracting take an ffmpeg slot like the cuts
+    audio_job = JOB_EXECUTOR.submit('ffmpeg', extract_audio)
 
     # 2. Download Character
     character_url = "http://obs.dimond.top/character.png"
@@ -1709,89 +2073,91 @@ def process_i2v_upload_submission(group_id, file_path, workflow_type):
         TASKS_STORE[group_id]['error'] = str(e)
         return
 
-    # 3. Cut Video
+    # 3. Cut, upload and queue segments as a pipeline: segment 0 is queued as
+    # soon as it is cut, while later segments are still being cut/uploaded.
     try:
-        resized_video_path = None
-        segment_source_path = file_path
-        if workflow_type == 'anime':
-            resized_video_path = os.path.join(UPLOAD_FOLDER, f"resized_{group_id}.mp4")
-            try:
-                log_callback("Resizing video for anime workflow...")
-                ffmpeg_utils.resize_video(file_path, resized_video_path)
-            except Exception as e:
-                log_callback(f"FFmpeg resize failed: {e}. Falling back to original size.")
-                shutil.copy(file_path, resized_video_path)
-            segment_source_path = resized_video_path
-        
-        info = ffmpeg_utils.get_video_info(segment_source_path)
+        info = JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.get_video_info, file_path)
         duration = info.get('duration', 0)
-        
-        segment_duration = 4
+
+        segment_duration = SEGMENT_DURATION_SECONDS
         num_segments = math.ceil(duration / segment_duration)
-        
+
         log_callback(f"Video duration: {duration}s, segments: {num_segments}")
-        
-        log_callback("Uploading character to ComfyUI...")
-        comfy_char = comfy_utils.client.upload_file(character_path, log_callback=log_callback)
-        if not comfy_char:
-             TASKS_STORE[group_id]['status'] = 'failed'
-             TASKS_STORE[group_id]['error'] = "Failed to upload character"
-             return
-             
-        for i in range(num_segments):
+
+        def cut_segment(i):
             start_time = i * segment_duration
             end_time = min((i + 1) * segment_duration, duration)
-            current_seg_len = end_time - start_time
-            
-            segment_filename = f"segment_{group_id}_{i}.mp4"
-            segment_path = os.path.join(UPLOAD_FOLDER, segment_filename)
-            
+            segment_path = os.path.join(UPLOAD_FOLDER, f"segment_{group_id}_{i}.mp4")
+
             log_callback(f"Cutting segment {i+1}/{num_segments} ({start_time}-{end_time}s)...")
-            ffmpeg_utils.cut_video(segment_source_path, segment_path, start_time, end_time)
-            
-            log_callback(f"Uploading segment {i+1}...")
-            comfy_seg = comfy_utils.client.upload_file(segment_path, log_callback=log_callback)
-            if not comfy_seg:
-                log_callback(f"Failed to upload segment {i+1}")
-                TASKS_STORE[group_id]['status'] = 'failed'
-                TASKS_STORE[group_id]['error'] = "Failed to upload segment"
-                return
-            
-            log_callback(f"Queueing segment {i+1}...")
-            prompt_id, server_address, error = comfy_utils.queue_workflow_template(
-                comfy_char['name'], 
-                comfy_seg['name'], 
-                workflow_type=workflow_type,
-                segment_duration=current_seg_len,
-                log_callback=log_callback
-            )
-            
-            if prompt_id:
-                TASKS_STORE[group_id]['tasks'].append({
-                    'task_id': prompt_id,
-                    'server': server_address,
-                    'status': 'pending',
-                    'segment_index': i,
-                    'result_path': None
-                })
-                log_callback(f"Segment {i+1} queued: {prompt_id}")
+            if workflow_type == 'anime':
+                # Anime workflow wants a downscaled video; resize per segment
+                # rather than the whole file up front
+                try:
+                    ffmpeg_utils.cut_and_resize_video(file_path, segment_path, start_time, end_time)
+                except Exception as e:
+                    log_callback(f"FFmpeg resize failed: {e}. Falling back to original size.")
+                    ffmpeg_utils.cut_video(file_path, segment_path, start_time, end_time)
             else:
-                log_callback(f"Failed to submit segment {i}: {error}")
-                TASKS_STORE[group_id]['status'] = 'failed'
-                TASKS_STORE[group_id]['error'] = f"Failed to submit segment {i}: {error}"
-                return
-            
-            # Clean up segment file
-            if os.path.exists(segment_path):
-                os.remove(segment_path)
+                ffmpeg_utils.cut_video(file_path, segment_path, start_time, end_time)
+            return i, segment_path, end_time - start_time
+
+        def submit_segment(segment):
+            i, segment_path, current_seg_len = segment
+            try:
+                # Character and segment are uploaded to the server the scheduler picks
+                log_callback(f"Uploading and queueing segment {i+1}...")
+                prompt_id, server_address, error = comfy_utils.submit_workflow_template(
+                    character_path,
+                    segment_path,
+                    workflow_type=workflow_type,
+                    segment_duration=current_seg_len,
+                    log_callback=log_callback
+                )
+                if not prompt_id:
+                    raise RuntimeError(f"Failed to submit segment {i}: {error}")
+            except Exception:
+                if os.path.exists(segment_path):
+                    os.remove(segment_path)
+                raise
+            # The segment file stays until the task is decided, so it can be
+            # hedged or retried on another server
+            TASKS_STORE[group_id]['tasks'].append(task_store.SegmentRecord({
+                'task_id': prompt_id,
+                'server': server_address,
+                'status': 'pending',
+                'segment_index': i,
+                'result_path': None,
+                'job': {
+                    'character': character_path,
+                    'video': segment_path,
+                    'workflow_type': workflow_type,
+                    'segment_duration': current_seg_len,
+                    'family': comfy_utils.workflow_family(workflow_type),
+                },
+                'attempts': [{'task_id': prompt_id, 'server': server_address, 'status': 'running', 'queued_at': time.time(), 'hedge': False}],
+            }))
+            log_callback(f"Segment {i+1} queued: {prompt_id}")
+
+        pipeline = pipeline_utils.Pipeline([
+            ('cut', cut_segment, SEGMENT_CUT_WORKERS, 'ffmpeg'),
+            ('submit', submit_segment, SEGMENT_SUBMIT_WORKERS, 'io'),
+        ], JOB_EXECUTOR)
+        try:
+            pipeline.run(range(num_segments))
+        except Exception as e:
+            log_callback(str(e))
+            _abandon_segments(group_id, [segment for _, segment in pipeline.dropped], log_callback)
+            TASKS_STORE[group_id]['status'] = 'failed'
+            TASKS_STORE[group_id]['error'] = str(e)
+            return
+        finally:
+            audio_job.result()
 
-        if resized_video_path and os.path.exists(resized_video_path):
-            os.remove(resized_video_path)
-            
         # Clean up original file
         if os.path.exists(file_path):
             os.remove(file_path)
-        
+
         # Clean up character file? Keep for log.
 
         log_callback("Submission complete. Starting monitor...")
@@ -1804,6 +2170,91 @@ def process_i2v_upload_submission(group_id, file_path, workflow_type):
         if 'file_path' in locals() and os.path.exists(file_path):
             os.remove(file_path)
 
+def _abandon_segments(group_id, unsubmitted, log_callback):
+    """
+    Undoes a failed upload submission: cancels the segments already queued
+    on ComfyUI and deletes their files and those of segments cut but never
+    queued (unsubmitted: cut_segment outputs).
+    """
+    for task in TASKS_STORE[group_id].get('tasks', []):
+        if task['status'] in ['completed', 'failed']:
+            continue
+        comfy_utils.cancel_job(task['task_id'], task.get('server'))
+        task['status'] = 'failed'
+        _count_finished_task(group_id, task)
+        log_callback(f"Cancelled segment {task['segment_index']+1} ({task['task_id']})")
+    paths = [task['job']['video'] for task in TASKS_STORE[group_id].get('tasks', []) if 'job' in task]
+    paths += [segment_path for _, segment_path, _ in unsubmitted]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def _run_admitted_group_job(group_id, func, *args):
+    group_data = TASKS_STORE.get(group_id)
+    if group_data is not None:
+        if group_data.get('status') == 'queued':
+            group_data['status'] = 'processing'
+            _group_log_callback(group_id, "Group")("Admitted, starting submission")
+        group_data.pop('admission', None)
+    return func(group_id, *args)
+
+def _admit_group_job(group_id, cost, work_class, func, *args):
+    """
+    Hands a group's submission job, func(group_id, *args), to admission
+    control. While held the group reads 'queued' and keeps the job spec, so
+    a restart can offer it again (see recover_tasks). Returns a 429 response
+    (and drops the group) when the hold queue is full, else None.
+    """
+    group_data = TASKS_STORE[group_id]
+    group_data['admission'] = {'job': func.__name__, 'args': list(args), 'cost': cost, 'work_class': work_class}
+    # Set before the offer: a job released at once flips it back to processing
+    group_data['status'] = 'queued'
+    outcome, info = ADMISSION.offer(group_id, cost, work_class, _run_admitted_group_job, group_id, func, *args)
+    if outcome == ADMISSION.REJECTED:
+        TASKS_STORE.pop(group_id, None)
+        return _admission_rejected(info['retry_after'])
+    if outcome == ADMISSION.HELD and info:
+        _group_log_callback(group_id, "Group")(
+            f"GPU fleet busy: waiting at position {info['position']}, about {info['eta_seconds']}s before submission"
+        )
+    return None
+
+def _admission_accepted(group_id, message=None):
+    """200 for a group job that is submitting, 202 with its place in the hold queue otherwise."""
+    position = ADMISSION.position(group_id)
+    if position is None:
+        body = {'status': 'processing', 'group_id': group_id}
+        if message:
+            body['message'] = message
+        return jsonify(body)
+    return jsonify({
+        'status': 'queued',
+        'group_id': group_id,
+        'queue_position': position['position'],
+        'eta_seconds': position['eta_seconds'],
+        'message': 'GPU fleet is busy; the job is submitted once the backlog drains',
+    }), 202
+
+def _admission_rejected(retry_after):
+    response = jsonify({'error': 'GPU fleet is saturated, try again later', 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def release_admitted_jobs():
+    """Background task: submits held group jobs as the fleet backlog drains."""
+    while True:
+        time.sleep(ADMISSION_CHECK_INTERVAL_SECONDS)
+        try:
+            ADMISSION.poll()
+        except Exception as e:
+            print(f"Error releasing admitted jobs: {e}")
+
+admission_thread = threading.Thread(target=release_admitted_jobs, daemon=True)
+admission_thread.start()
+# A finished prompt frees backlog at once; poll off the tracker's lock
+comfy_utils.client.completions.add_finish_listener(lambda *args: JOB_EXECUTOR.submit('io', ADMISSION.poll))
+
 @app.route('/upload_and_cut', methods=['POST'])
 def upload_and_cut():
     # Ensure ComfyUI connection before starting
@@ -1822,31 +2273,39 @@ def upload_and_cut():
     # Get workflow type
     workflow_type = request.form.get('workflow_type', 'real') # 'real' or 'anime'
 
+    # A saturated fleet with a full hold queue is refused before the upload is stored
+    retry_after = ADMISSION.retry_after()
+    if retry_after is not None:
+        return _admission_rejected(retry_after)
+
     # Save uploaded file
     filename = file.filename
     file_path = os.path.join(UPLOAD_FOLDER, filename)
     file.save(file_path)
     
     group_id = str(uuid.uuid4())
-    TASKS_STORE[group_id] = {
+    TASKS_STORE[group_id] = task_store.GroupRecord({
         'status': 'processing',
         'tasks': [],
         'created_at': time.time(),
         'workflow_type': workflow_type,
         'audio_path': None,
         'logs': [f"[{datetime.now().strftime('%H:%M:%S')}] Task group created. Waiting for submission..."]
-    }
-    
-    thread = threading.Thread(target=process_i2v_upload_submission, args=(group_id, file_path, workflow_type))
-    thread.daemon = True
-    thread.start()
-            
-    return jsonify({
-        'status': 'processing', 
-        'group_id': group_id, 
-        'message': 'Started processing video'
     })
 
+    # Sized from the upload rather than probed, so no ffprobe runs in the request
+    duration = os.path.getsize(file_path) / UPLOAD_VIDEO_BYTES_PER_SECOND
+    segments = max(1, math.ceil(duration / SEGMENT_DURATION_SECONDS))
+    cost = comfy_utils.scheduler.estimate_seconds(comfy_utils.workflow_family(workflow_type), segments)
+    # Mostly uploads and queueing; its cuts take ffmpeg slots one at a time
+    rejected = _admit_group_job(group_id, cost, 'io', process_i2v_upload_submission, file_path, workflow_type)
+    if rejected:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return rejected
+
+    return _admission_accepted(group_id, 'Started processing video')
+
 
 @app.route('/upload_transition_video', methods=['POST'])
 def upload_transition_video():
@@ -1872,6 +2331,32 @@ def upload_transition_video():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _status_poll_response(body, logs):
+    """
+    Answers a status poll. Without ?since= the whole log is sent as before;
+    with ?since=<log_cursor>&epoch=<log_epoch> only lines appended after
+    that cursor, fields that are None are left out, and logs_reset tells the
+    client to drop its copy (the cursor is from before a restart: another
+    epoch, or past the end). Either way log_cursor and log_epoch are the
+    values to send next, and an ETag turns an unchanged poll into a 304.
+    """
+    since = request.args.get('since', type=int)
+    epoch = task_store.log_epoch(logs)
+    lines, total = task_store.log_since(logs, since or 0)
+    if since is not None:
+        if since > total or request.args.get('epoch', epoch) != epoch:
+            lines, total = task_store.log_since(logs, 0)
+            body['logs_reset'] = True
+        body = {key: value for key, value in body.items() if value is not None}
+    body['logs'], body['log_cursor'] = lines, total
+    if epoch is not None:
+        body['log_epoch'] = epoch
+    response = jsonify(body)
+    response.add_etag()
+    # Browsers revalidate every poll instead of reusing the cached body blindly
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/check_group_status/<group_id>', methods=['GET'])
 def check_group_status(group_id):
     group_data = TASKS_STORE.get(group_id)
@@ -1882,10 +2367,13 @@ def check_group_status(group_id):
         'status': group_data.get('status'),
         'final_url': group_data.get('final_url'),
         'error': group_data.get('error'),
-        'progress': f"{len([t for t in group_data['tasks'] if t['status'] == 'completed'])}/{len(group_data['tasks'])}",
-        'logs': group_data.get('logs', [])
+        'progress': f"{group_data.get('completed_count', 0)}/{len(group_data['tasks'])}",
     }
-    return jsonify(response)
+    position = ADMISSION.position(group_id) if group_data.get('status') == 'queued' else None
+    if position:
+        response['queue_position'] = position['position']
+        response['eta_seconds'] = position['eta_seconds']
+    return _status_poll_response(response, group_data.get('logs'))
 
 def process_i2v_group_submission(group_id, texts, character_url):
     """
@@ -1901,7 +2389,6 @@ def process_i2v_group_submission(group_id, texts, character_url):
     
     # Download character
     character_path = os.path.join(UPLOAD_FOLDER, f"i2v_character_{group_id}.png")
-    image_name = None
     
     try:
         log_callback(f"Downloading character from {character_url}...")
@@ -1922,26 +2409,10 @@ def process_i2v_group_submission(group_id, texts, character_url):
         TASKS_STORE[group_id]['error'] = str(e)
         return
 
-    # Upload to ComfyUI
-    try:
-        log_callback("Uploading character to ComfyUI...")
-        upload_res = comfy_utils.client.upload_file(character_path, log_callback=log_callback)
-        if not upload_res or 'name' not in upload_res:
-            log_callback("Failed to upload character to ComfyUI")
-            TASKS_STORE[group_id]['status'] = 'failed'
-            TASKS_STORE[group_id]['error'] = "Failed to upload character"
-            return
-        image_name = upload_res['name']
-        log_callback(f"Character uploaded as {image_name}")
-    except Exception as e:
-        log_callback(f"Error uploading character: {e}")
-        TASKS_STORE[group_id]['status'] = 'failed'
-        TASKS_STORE[group_id]['error'] = str(e)
-        return
-
     # Workflow
-    workflow_path = os.path.join(os.path.dirname(__file__), 'comfyapi', '图生视频video_wan2_2_14B_i2v.json')
-    if not os.path.exists(workflow_path):
+    try:
+        i2v_template = workflow_utils.registry.get('i2v')
+    except FileNotFoundError:
         log_callback("Workflow file not found")
         TASKS_STORE[group_id]['status'] = 'failed'
         TASKS_STORE[group_id]['error'] = "Workflow file not found"
@@ -1959,21 +2430,24 @@ def process_i2v_group_submission(group_id, texts, character_url):
         log_callback(f"Submitting prompt {idx+1}/{len(texts)}: {prompt_text[:20]}...")
         
         try:
-            with open(workflow_path, 'r', encoding='utf-8') as f:
-                workflow = json.load(f)
-            
-            workflow = modify_i2v_workflow(workflow, image_name, prompt_text)
-            
-            prompt_id, server_address = comfy_utils.client.queue_prompt(workflow, log_callback=log_callback)
+            workflow = i2v_template.instance()
+
+            # The scheduler uploads the character to the server it picks for this prompt
+            prompt_id, server_address = comfy_utils.scheduler.submit(
+                lambda names, workflow=workflow, prompt_text=prompt_text: modify_i2v_workflow(workflow, names['image'], prompt_text),
+                {'image': character_path},
+                log_callback=log_callback,
+                family=i2v_template.family,
+            )
             
             if prompt_id:
-                TASKS_STORE[group_id]['tasks'].append({
+                TASKS_STORE[group_id]['tasks'].append(task_store.SegmentRecord({
                     'task_id': prompt_id,
                     'server': server_address,
                     'status': 'pending',
                     'segment_index': idx,
                     'result_path': None,
-                })
+                }))
                 tasks_created = True
                 log_callback(f"Prompt queued successfully: {prompt_id}")
             else:
@@ -2005,6 +2479,9 @@ def generate_i2v_group():
     texts = data.get('texts') or []
     if not isinstance(texts, list) or len(texts) < 4:
         return jsonify({'error': 'texts must be a list of length 4'}), 400
+    retry_after = ADMISSION.retry_after()
+    if retry_after is not None:
+        return _admission_rejected(retry_after)
     
     character_url = "http://obs.dimond.top/character.png"
     
@@ -2016,18 +2493,19 @@ def generate_i2v_group():
     else:
         group_id = str(uuid.uuid4())
 
-    TASKS_STORE[group_id] = {
+    TASKS_STORE[group_id] = task_store.GroupRecord({
         'status': 'processing',
         'tasks': [],
         'created_at': time.time(),
         'workflow_type': 'i2v',
         'audio_path': None,
         'logs': [f"[{datetime.now().strftime('%H:%M:%S')}] Task group created. Group ID: {group_id}"]
-    }
-    
-    thread = threading.Thread(target=process_i2v_group_submission, args=(group_id, texts, character_url))
-    thread.daemon = True
-    thread.start()
+    })
+
+    cost = comfy_utils.scheduler.estimate_seconds(workflow_utils.registry.family('i2v'), len(texts))
+    rejected = _admit_group_job(group_id, cost, 'io', process_i2v_group_submission, texts, character_url)
+    if rejected:
+        return rejected
     
     # Update Global State for Sectors 9-12
     with GLOBAL_STATE_LOCK:
@@ -2044,7 +2522,7 @@ def generate_i2v_group():
             GLOBAL_STATE['sector12']['text'] = texts[3] if len(texts) > 3 else ''
             GLOBAL_STATE['sector12']['latest_task_id'] = group_id
 
-    return jsonify({'status': 'processing', 'group_id': group_id})
+    return _admission_accepted(group_id)
 
 def get_latest_file_from_obs(suffix):
     """
@@ -2132,11 +2610,11 @@ def save_character_from_current():
             with open(character_temp, 'wb') as f:
                 for chunk in r.iter_content(chunk_size=8192):
                     f.write(chunk)
-        info = ffmpeg_utils.get_video_info(character_temp)
+        info = JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.get_video_info, character_temp)
         duration = info.get('duration', 0)
         end_time = min(10, duration) if duration and duration > 0 else 10
         character_clip = os.path.join(UPLOAD_FOLDER, 'character.mp4')
-        ffmpeg_utils.cut_video(character_temp, character_clip, 0, end_time)
+        JOB_EXECUTOR.call('ffmpeg', ffmpeg_utils.cut_video, character_temp, character_clip, 0, end_time)
         obs_url = obs_utils.upload_file(character_clip, 'character.mp4', mime_type='video/mp4')
         try:
             if os.path.exists(character_temp):
@@ -2203,15 +2681,13 @@ def trigger_i2v_for_sector(prompt, image_path, log_callback=None):
         image_name = upload_res['name']
         if log_callback: log_callback(f"Uploaded to ComfyUI as: {image_name} (Type: {upload_res.get('type', 'input')})")
         
-        # Load workflow
-        workflow_path = os.path.join(os.path.dirname(__file__), 'comfyapi', '图生视频video_wan2_2_14B_i2v.json')
-        if not os.path.exists(workflow_path):
+        # Instantiate workflow
+        try:
+            workflow = workflow_utils.registry.get('i2v').instance()
+        except FileNotFoundError:
              if log_callback: log_callback("I2V Workflow file not found")
              return None
-             
-        with open(workflow_path, 'r', encoding='utf-8') as f:
-            workflow = json.load(f)
-            
+
         # Modify workflow
         workflow = modify_i2v_workflow(workflow, image_name, prompt)
         
@@ -2227,7 +2703,7 @@ def trigger_i2v_for_sector(prompt, image_path, log_callback=None):
         if prompt_id:
             # Create a new group for monitoring
             group_id = str(uuid.uuid4())
-            TASKS_STORE[group_id] = {
+            TASKS_STORE[group_id] = task_store.GroupRecord({
                 'status': 'processing',
                 'tasks': [{
                     'task_id': prompt_id,
@@ -2239,12 +2715,10 @@ def trigger_i2v_for_sector(prompt, image_path, log_callback=None):
                 'created_at': time.time(),
                 'workflow_type': 'i2v_auto', 
                 'audio_path': None,
-            }
+            })
             
             # Start monitor
-            thread = threading.Thread(target=monitor_i2v_group, args=(group_id,))
-            thread.daemon = True
-            thread.start()
+            monitor_i2v_group(group_id)
             
             if log_callback: log_callback(f"I2V Task started successfully! Group ID: {group_id}")
             return group_id
@@ -2335,6 +2809,44 @@ def run_sector17_task(task_id, text, output_dir):
         except:
             pass
 
+def _follow_sector19_i2v_group(task_id, i2v_group_id, obs_url, prompt, cursor):
+    """
+    One pass forwarding an I2V group's new logs into a sector 19 task;
+    cursor['logs'] carries the log position between passes. Returns False
+    once the group has finished or is gone.
+    """
+    def log_callback(msg):
+        if task_id in SECTOR_TASKS:
+            processed_msg = process_log_message(msg)
+            SECTOR_TASKS[task_id]['logs'].append(f"[{datetime.now().strftime('%H:%M:%S')}] {processed_msg}")
+
+    try:
+        group_data = TASKS_STORE.get(i2v_group_id)
+        if not group_data:
+            log_callback("I2V Group lost.")
+        else:
+            # Forward logs; the cursor counts lines the group's ring already dropped
+            new_logs, cursor['logs'] = task_store.log_since(group_data.get('logs'), cursor['logs'])
+            SECTOR_TASKS[task_id]['logs'].extend(new_logs)
+
+            if group_data.get('status') not in ['completed', 'failed']:
+                return True
+            if group_data['status'] == 'completed':
+                SECTOR_TASKS[task_id]['result'] = {'url': obs_url, 'content': prompt, 'i2v_result': group_data.get('final_url')}
+                SECTOR_TASKS[task_id]['status'] = 'completed'
+                log_callback("I2V Task Completed.")
+            else:
+                SECTOR_TASKS[task_id]['status'] = 'failed'
+                SECTOR_TASKS[task_id]['error'] = f"I2V Failed: {group_data.get('error')}"
+                log_callback(f"I2V Task Failed: {group_data.get('error')}")
+
+        # Send email notification
+        send_email("Video Analysis (Sector 19) Task Completed", obs_url)
+    except Exception as e:
+        SECTOR_TASKS[task_id]['status'] = 'failed'
+        SECTOR_TASKS[task_id]['error'] = str(e)
+    return False
+
 def run_sector19_task(task_id, video_path, output_dir):
     try:
         def log_callback(msg):
@@ -2372,33 +2884,10 @@ def run_sector19_task(task_id, video_path, output_dir):
                 if i2v_group_id:
                     log_callback(f"I2V Task Triggered. Monitoring Group: {i2v_group_id}")
                     
-                    # Monitor I2V group and forward logs
-                    last_log_index = 0
-                    while True:
-                        group_data = TASKS_STORE.get(i2v_group_id)
-                        if not group_data:
-                            log_callback("I2V Group lost.")
-                            break
-                            
-                        # Forward logs
-                        current_logs = group_data.get('logs', [])
-                        if len(current_logs) > last_log_index:
-                            for log in current_logs[last_log_index:]:
-                                SECTOR_TASKS[task_id]['logs'].append(log)
-                            last_log_index = len(current_logs)
-                            
-                        if group_data.get('status') in ['completed', 'failed']:
-                            if group_data['status'] == 'completed':
-                                SECTOR_TASKS[task_id]['result'] = {'url': obs_url, 'content': prompt, 'i2v_result': group_data.get('final_url')}
-                                SECTOR_TASKS[task_id]['status'] = 'completed'
-                                log_callback("I2V Task Completed.")
-                            else:
-                                SECTOR_TASKS[task_id]['status'] = 'failed'
-                                SECTOR_TASKS[task_id]['error'] = f"I2V Failed: {group_data.get('error')}"
-                                log_callback(f"I2V Task Failed: {group_data.get('error')}")
-                            break
-                        
-                        time.sleep(1)
+                    # Checked periodically on the monitor pool instead of holding an LLM slot
+                    JOB_EXECUTOR.schedule('monitor', SECTOR19_FOLLOW_INTERVAL_SECONDS, _follow_sector19_i2v_group,
+                                          task_id, i2v_group_id, obs_url, prompt, {'logs': 0})
+                    return
                 else:
                     SECTOR_TASKS[task_id]['result'] = {'url': obs_url, 'content': prompt}
                     SECTOR_TASKS[task_id]['status'] = 'completed'
@@ -2438,14 +2927,14 @@ def sector17_submit():
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         
-    SECTOR_TASKS[task_id] = {
+    SECTOR_TASKS[task_id] = task_store.SectorRecord({
         'status': 'processing',
         'logs': [],
         'created_at': time.time(),
         'type': 'sector17'
-    }
+    })
     
-    threading.Thread(target=run_sector17_task, args=(task_id, text, output_dir)).start()
+    JOB_EXECUTOR.submit('llm', run_sector17_task, task_id, text, output_dir)
     
     # Update Global State for Sector 17
     if 'sector17' in GLOBAL_STATE:
@@ -2491,14 +2980,14 @@ def sector19_submit():
         video_path = os.path.join(output_dir, video_file.filename)
         video_file.save(video_path)
     
-    SECTOR_TASKS[task_id] = {
+    SECTOR_TASKS[task_id] = task_store.SectorRecord({
         'status': 'processing',
         'logs': [],
         'created_at': time.time(),
         'type': 'sector19'
-    }
+    })
     
-    threading.Thread(target=run_sector19_task, args=(task_id, video_path, output_dir)).start()
+    JOB_EXECUTOR.submit('llm', run_sector19_task, task_id, video_path, output_dir)
     
     # Update Global State for Sector 19
     if 'sector19' in GLOBAL_STATE:
@@ -2573,14 +3062,14 @@ def video_analyzing():
     video_path = os.path.join(output_dir, video_file.filename)
     video_file.save(video_path)
     
-    SECTOR_TASKS[task_id] = {
+    SECTOR_TASKS[task_id] = task_store.SectorRecord({
         'status': 'processing',
         'logs': [],
         'created_at': time.time(),
         'type': 'sector19'
-    }
+    })
     
-    threading.Thread(target=run_sector19_task, args=(task_id, video_path, output_dir)).start()
+    JOB_EXECUTOR.submit('llm', run_sector19_task, task_id, video_path, output_dir)
     
     # Update Global State for Sector 19
     if 'sector19' in GLOBAL_STATE:
@@ -2599,7 +3088,8 @@ def check_sector_task(task_id):
     if not task:
         return jsonify({'error': 'Task not found'}), 404
     
-    return jsonify(task)
+    body = {key: value for key, value in task.items() if key != 'logs'}
+    return _status_poll_response(body, task.get('logs'))
 
 @app.route('/sector18_get_prompt', methods=['GET'])
 def sector18_get_prompt():
@@ -2617,6 +3107,113 @@ def sector18_get_prompt():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+ADMISSION_JOBS = {func.__name__: func for func in (process_i2v_upload_submission, process_i2v_group_submission)}  # Used in: recover_tasks (group jobs admission control may hold)
+
+def _track_recovered_prompts(group_data):
+    """Counts a recovered group's unfinished prompts toward the scheduler backlog again."""
+    if group_data.get('workflow_type') in ['i2v', 'i2v_auto']:
+        family = workflow_utils.registry.family('i2v')
+    elif group_data.get('transition_videos'):
+        family = workflow_utils.registry.family('transition')
+    else:
+        family = workflow_utils.registry.family('vace' if group_data.get('workflow_type') == 'anime' else 'animate')
+    for task in group_data.get('tasks', []):
+        if not task.get('task_id') or task['status'] in ['completed', 'failed']:
+            continue
+        if 'job' not in task:
+            comfy_utils.scheduler.track(task['task_id'], family, group_data.get('created_at'))
+            continue
+        for attempt in task['attempts']:
+            if attempt['status'] == 'running':
+                comfy_utils.scheduler.track(attempt['task_id'], task['job']['family'], attempt.get('queued_at'))
+
+def recover_tasks():
+    """
+    Re-attaches work restored from the task store after a restart. ComfyUI
+    kept running the prompts meanwhile, so unfinished group and audio tasks
+    are watched again (prompts that finished while down are read from
+    /history) and count toward the scheduler backlog again, and a group
+    whose tasks all finished is concatenated and uploaded again. Jobs held by admission control are offered again. Groups
+    cut off mid-submission and sector tasks (their steps ran inside this
+    process) are marked failed.
+    """
+    for group_id, group_data in list(TASKS_STORE.items()):
+        # Records saved before groups kept completed/failed counters
+        for task in group_data.get('tasks', []):
+            _count_finished_task(group_id, task)
+        if group_data.get('status') != 'processing':
+            continue
+        log_callback = _group_log_callback(group_id, "Recovery")
+        if not group_data.get('monitor_started'):
+            for task in group_data.get('tasks', []):
+                if task.get('task_id') and task['status'] not in ['completed', 'failed']:
+                    comfy_utils.cancel_job(task['task_id'], task.get('server'))
+            group_data['status'] = 'failed'
+            group_data['error'] = 'Interrupted by a restart during submission'
+            log_callback(f"Group {group_id} was still submitting when the app stopped; marked failed")
+            continue
+        for task in group_data.get('tasks', []):
+            if 'job' in task and task.get('settled') and task['status'] not in ['completed', 'failed']:
+                # Decided but not downloaded yet: watch the winning attempt again
+                task['settled'] = False
+                for attempt in task['attempts']:
+                    if attempt['task_id'] == task['task_id']:
+                        attempt['status'] = 'running'
+        # Lets _maybe_finish_group run the concatenation/upload the restart cut short
+        group_data.pop('finished_task_count', None)
+        _track_recovered_prompts(group_data)
+        log_callback(f"Recovered group {group_id} after a restart")
+        if group_data.get('workflow_type') in ['i2v', 'i2v_auto']:
+            monitor_i2v_group(group_id)
+        else:
+            monitor_group_task(group_id)
+
+    # Held jobs go back into the hold queue in their original order
+    queued = sorted(
+        (item for item in TASKS_STORE.items() if item[1].get('status') == 'queued'),
+        key=lambda item: item[1].get('created_at') or 0,
+    )
+    for group_id, group_data in queued:
+        spec = group_data.get('admission') or {}
+        func = ADMISSION_JOBS.get(spec.get('job'))
+        if func is None or _admit_group_job(group_id, spec['cost'], spec['work_class'], func, *spec['args']) is not None:
+            TASKS_STORE[group_id] = group_data
+            group_data['status'] = 'failed'
+            group_data['error'] = 'Could not be queued again after a restart'
+
+    with AUDIO_LOCK:
+        pending_audio = [pid for pid, t in AUDIO_TASKS.items() if t.get('status') in ['pending', 'processing_result']]
+        for prompt_id in pending_audio:
+            AUDIO_TASKS[prompt_id]['status'] = 'pending'
+    for prompt_id in pending_audio:
+        comfy_utils.scheduler.track(prompt_id, workflow_utils.registry.family('audio'), AUDIO_TASKS[prompt_id].get('created_at'))
+        monitor_audio_task(prompt_id)
+
+    for task_id, task in SECTOR_TASKS.items():
+        if task.get('status') == 'processing':
+            task['status'] = 'failed'
+            task['error'] = 'Interrupted by a restart'
+
+def start_task_store(path=task_store.TASK_STORE_FILE):
+    """
+    Fills the task dicts from the SQLite task store, starts its batched
+    flusher and re-attaches unfinished work (see recover_tasks).
+    """
+    global TASK_STORE
+    TASK_STORE = task_store.TaskStore(path)
+    TASK_STORE.restore('groups', TASKS_STORE, task_store.GroupRecord)
+    TASK_STORE.restore('sector_tasks', SECTOR_TASKS, task_store.SectorRecord)
+    TASK_STORE.restore('audio_tasks', AUDIO_TASKS)
+    TASK_STORE.restore('channel_transition_groups', CHANNEL_TRANSITION_GROUPS)
+    # Sector by sector, so keys added to the defaults since the last run survive
+    for sector, state in TASK_STORE.load('global_state').items():
+        GLOBAL_STATE.setdefault(sector, {}).update(state)
+    TASK_STORE.track('global_state', GLOBAL_STATE)
+    TASK_STORE.start()
+    recover_tasks()
+    return TASK_STORE
+
 if __name__ == '__main__':
+    start_task_store()
     print("Starting Flask server on port 5015...")
     app.run(host='0.0.0.0', debug=False, port=5015, use_reloader=False)
@@ -0,0 +1,114 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import comfy_utils
+import workflow_utils
+from fake_comfy_server import FakeComfyServer
+
+# Benchmark parameters (used in: run_benchmark)
+SERVERS = 3
+WORKERS_PER_SERVER = 4
+GROUPS = 200
+SEGMENTS_PER_GROUP = 3
+SUBMIT_THREADS = 32
+TIME_SCALE = 0.05  # fake execution times are EXEC_TIMES scaled by this
+FAILURE_RATE = 0.02
+WORKFLOW = "animate"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_benchmark():
+    servers = [
+        FakeComfyServer(workers=WORKERS_PER_SERVER, time_scale=TIME_SCALE, failure_rate=FAILURE_RATE, seed=n).start()
+        for n in range(SERVERS)
+    ]
+    work_dir = tempfile.mkdtemp(prefix="bench_orchestration_")
+    addresses = [s.address for s in servers]
+    client = comfy_utils.ComfyUIClient(
+        addresses[0],
+        prompt_index=comfy_utils.PromptIndex(os.path.join(work_dir, "prompt_index.jsonl")),
+        servers=addresses,
+    )
+    comfy_utils.client = client
+    scheduler = comfy_utils.ServerScheduler(client, addresses)
+    template = workflow_utils.registry.get(WORKFLOW)
+
+    image = os.path.join(work_dir, "character.png")
+    with open(image, "wb") as f:
+        f.write(os.urandom(64 * 1024))
+    videos = []
+    for n in range(SEGMENTS_PER_GROUP):
+        videos.append(os.path.join(work_dir, f"segment_{n}.mp4"))
+        with open(videos[-1], "wb") as f:
+            f.write(os.urandom(256 * 1024))
+
+    submit_latency = []
+    completion_latency = []
+    outcomes = {"SUCCEEDED": 0, "FAILED": 0, "TIMEOUT": 0, "SUBMIT_ERROR": 0}
+    lock = threading.Lock()
+    remaining = threading.Semaphore(0)
+
+    def run_segment(group, segment):
+        queued_at = time.perf_counter()
+        try:
+            prompt_id, server = scheduler.submit(
+                lambda names: template.instantiate(image=names["image"], video=names["video"], text=f"group {group}"),
+                {"image": image, "video": videos[segment]}, family=template.family,
+            )
+        except Exception:
+            with lock:
+                outcomes["SUBMIT_ERROR"] += 1
+            remaining.release()
+            return
+        submitted_at = time.perf_counter()
+
+        def on_done(pid, status, result):
+            if status == "SUCCEEDED":
+                out_dir = os.path.join(work_dir, "out", str(group))
+                comfy_utils.download_result_async(result, out_dir, server, pid).result()
+            with lock:
+                submit_latency.append(submitted_at - queued_at)
+                completion_latency.append(time.perf_counter() - queued_at)
+                outcomes[status] = outcomes.get(status, 0) + 1
+            remaining.release()
+
+        client.watch(prompt_id, server, on_done)
+
+    total = GROUPS * SEGMENTS_PER_GROUP
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=SUBMIT_THREADS) as pool:
+        for group in range(GROUPS):
+            for segment in range(SEGMENTS_PER_GROUP):
+                pool.submit(run_segment, group, segment)
+    for _ in range(total):
+        remaining.acquire()
+    elapsed = time.perf_counter() - start
+
+    print(f"{SERVERS} fake servers x {WORKERS_PER_SERVER} workers, {GROUPS} groups x {SEGMENTS_PER_GROUP} segments ({WORKFLOW})")
+    print(f"  total        {elapsed:8.2f} s   {total / elapsed:8.1f} prompts/s")
+    print(f"  outcomes     {outcomes}")
+    print(f"  submit       p50 {percentile(submit_latency, 0.5) * 1000:8.1f} ms   p95 {percentile(submit_latency, 0.95) * 1000:8.1f} ms")
+    print(f"  completion   p50 {percentile(completion_latency, 0.5):8.2f} s    p95 {percentile(completion_latency, 0.95):8.2f} s")
+    print(f"  per server   {[(s.address, s.stats['queued'], s.stats['uploads']) for s in servers]}")
+    print(f"  model swaps  {[(a, v['model_swaps']) for a, v in scheduler.snapshot().items()]}")
+
+    client.close_listeners()
+    for s in servers:
+        s.stop()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    logging.getLogger("comfy_utils").setLevel(logging.WARNING)
+    run_benchmark()
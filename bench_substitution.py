@@ -0,0 +1,87 @@
+import os
+import re
+import tempfile
+import time
+
+import substitution_utils
+
+# Benchmark parameters (used in: run_benchmark)
+INPUT_SIZES_KB = [2, 8, 32]
+ITERATIONS = 300
+RULE_SETS = {
+    "30 rules": "的了是在我有他这中大来上个国到说们为子和你地出道也时年得就那",
+    "300 rules": "".join(chr(0x4E00 + i * 7) for i in range(300)),
+}
+
+PORT_MAPPING = {
+    "192.168.0.209:7860": "192.168.0.209:7890",
+    "192.168.0.210:7860": "192.168.0.210:7890",
+    "192.168.50.210:7860": "192.168.50.210:7890",
+}
+HARD_ENCODED_PATTERNS = [
+    "登录领番茄.*",
+    "继续播放.*",
+    r"\d{2}:\d{2}.*",
+    r"[０-９\d]*[／/][０-９\d]{3,5}.*",
+    r"原进度.*从本页听",
+]
+
+
+def legacy_core_replace(text, rules_path):
+    """Reference copy of the original per-call implementation."""
+    for old_port, new_port in PORT_MAPPING.items():
+        text = text.replace(old_port, new_port)
+    for pattern in HARD_ENCODED_PATTERNS:
+        text = re.sub(pattern, "", text, flags=re.MULTILINE)
+    with open(rules_path, 'r', encoding='utf-8') as f:
+        substitutions = f.read()
+    for char in substitutions:
+        text = text.replace(char, '')
+    return text
+
+
+def make_input(size_kb):
+    lines = [
+        "他在这个国家里说了很多年的话，我们为他来到这里。",
+        "服务器 192.168.0.209:7860 正在运行，第 12/3456 页",
+        "继续播放下一章",
+        "10:24 电量 80%",
+        "原进度第三章从本页听",
+        "普通正文内容，没有任何需要替换的东西。",
+    ]
+    text = []
+    size = 0
+    i = 0
+    while size < size_kb * 1024:
+        line = lines[i % len(lines)]
+        text.append(line)
+        size += len(line.encode('utf-8')) + 1
+        i += 1
+    return "\n".join(text)
+
+
+def time_calls(fn, text, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(text)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def run_benchmark():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        rules_path = os.path.join(temp_dir, "substitution.txt")
+        print(f"{'rules':>10} {'input':>8} {'legacy us/call':>16} {'engine us/call':>16} {'speedup':>8}")
+        for label, rule_chars in RULE_SETS.items():
+            with open(rules_path, 'w', encoding='utf-8') as f:
+                f.write(rule_chars)
+            engine = substitution_utils.SubstitutionEngine(rules_path, PORT_MAPPING, HARD_ENCODED_PATTERNS)
+            for size_kb in INPUT_SIZES_KB:
+                text = make_input(size_kb)
+                assert engine.apply(text) == legacy_core_replace(text, rules_path)
+                legacy_us = time_calls(lambda t: legacy_core_replace(t, rules_path), text, ITERATIONS)
+                engine_us = time_calls(engine.apply, text, ITERATIONS)
+                print(f"{label:>10} {size_kb:>6}KB {legacy_us:>16.1f} {engine_us:>16.1f} {legacy_us / engine_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -3,31 +3,1089 @@ import json
 import requests
 import logging
 import uuid
-import urllib.parse
-import urllib.request
 import shutil
 import tempfile
 import random
 import threading
 import math
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+import completion_utils
+import workflow_utils
 
 # Configure logging (used throughout comfy_utils for diagnostics)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Server list for dual-try mechanism (used in: ComfyUIClient.find_fastest_server, check_status fallbacks)
+# Default servers when no registry config exists (used in: ServerRegistry, ComfyUIClient.find_fastest_server)
 SERVER_LIST = [
     "192.168.0.209:7860",
     "192.168.0.210:7860",
     "192.168.50.210:7860"
 ]
+# Server registry: checked-in defaults, and the untracked copy admin edits are written to (used in: ServerRegistry)
+SERVER_CONFIG_FILE = os.environ.get("COMFY_SERVER_CONFIG") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'comfy_servers.json'
+)
+SERVER_STATE_FILE = os.environ.get("COMFY_SERVER_STATE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'tmp', 'comfy_servers.json'
+)
+
+# Pooled HTTP settings per ComfyUI server (used in: ComfyUIClient._session, ComfyUIClient._request)
+HTTP_POOL_CONNECTIONS = 4  # distinct host pools kept per session
+HTTP_POOL_MAXSIZE = 16  # keep-alive connections kept per host (monitors + submitters + downloads)
+HTTP_RETRY_TOTAL = 3  # retries for connect errors and idempotent requests
+HTTP_RETRY_BACKOFF = 0.5  # seconds, doubled per retry
+HTTP_CONNECT_TIMEOUT = 5  # seconds to establish a TCP connection
+HTTP_READ_TIMEOUT = 60  # default seconds to wait for a response
+HTTP_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+# Threads running status callbacks (downloads, concatenation) (used in: ComfyUIClient.watch)
+STATUS_CALLBACK_WORKERS = 8
+# Multi-server scheduling (used in: ServerScheduler)
+SCHEDULER_QUEUE_TTL = 2  # seconds a fetched /queue depth is reused between picks
+SCHEDULER_QUEUE_TIMEOUT = 5  # seconds to wait for /queue while picking a server
+SCHEDULER_DEFAULT_EXEC_SECONDS = 120  # assumed prompt run time before any sample exists
+SCHEDULER_EWMA_ALPHA = 0.3  # weight of the newest execution time sample
+SCHEDULER_LATENCY_SAMPLES = 200  # newest execution times kept per workflow family for percentiles
+SCHEDULER_LATENCY_MIN_SAMPLES = 10  # samples needed before a family's percentiles are reported
+SCHEDULER_AFFINITY_MAX_EXTRA_WAIT = 120  # seconds of extra expected wait accepted to avoid a model swap
+SCHEDULER_OUTSTANDING_MAX_AGE = 6 * 60 * 60  # seconds after which an unfinished prompt no longer counts toward the backlog
+# Content-hash upload cache (used in: UploadCache, ComfyUIClient.upload_file, prewarm_uploads)
+UPLOAD_CACHE_VERIFY_SECONDS = 60  # cached names older than this are re-checked with HEAD /view
+UPLOAD_HASH_CHUNK = 1024 * 1024  # bytes read per hashing step
+# Result downloads from /view (used in: DownloadManager)
+DOWNLOAD_WORKERS = 4  # concurrent downloads across all groups
+DOWNLOAD_READ_TIMEOUT = 60  # seconds without a byte before a stream counts as stalled
+DOWNLOAD_MAX_RESUMES = 5  # Range resumes after a drop before giving up
+DOWNLOAD_DEADLINE_SECONDS = 1800  # wall-clock cap for one file, resumes included
+DOWNLOAD_CHUNK = 64 * 1024  # bytes per streamed chunk; a drop loses at most one chunk
+# Per-server health and circuit breaker (used in: HealthTracker, ComfyUIClient.check_connection)
+HEALTH_PROBE_PATH = "/system_stats"  # small JSON answered without touching the node registry
+HEALTH_PROBE_TIMEOUT = 3  # seconds a liveness probe may take
+HEALTH_PROBE_INTERVAL = 30  # seconds between background probes of every server
+HEALTH_EWMA_ALPHA = 0.3  # weight of the newest latency / error sample
+HEALTH_FAILURE_THRESHOLD = 3  # consecutive failures that open the circuit
+HEALTH_OPEN_SECONDS = 60  # seconds an open circuit rejects traffic before a half-open trial
+CAPABILITY_TTL_SECONDS = 600  # seconds a server's cached /object_info is trusted before a background refresh
+CAPABILITY_FETCH_TIMEOUT = 60  # seconds allowed for the full (multi-MB) /object_info
+# Persistent prompt_id -> server index (used in: PromptIndex, module-level client)
+PROMPT_INDEX_FILE = os.environ.get(
+    "COMFY_PROMPT_INDEX", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'prompt_index.jsonl')
+)
+PROMPT_INDEX_MAX_ENTRIES = 5000  # newest prompts remembered; the journal is compacted at twice this
+# Opt-in workflow result cache (used in: ResultCache, workflow_cache_key, module-level client)
+RESULT_CACHE_ENABLED = os.environ.get("COMFY_RESULT_CACHE", "0") == "1"
+RESULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'result_cache')
+RESULT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # stored outputs beyond this are evicted, least recently used first
+RESULT_CACHE_SEED_INPUTS = ("seed", "noise_seed")  # inputs left out of the key (randomized per run)
+RESULT_CACHE_PENDING_LIMIT = 4096  # queued prompts remembered until their output is downloaded
+
+
+class HTTPStats:
+    """
+    Counts TCP connections opened versus requests sent for one server, so
+    connection reuse can be confirmed (requests_sent >> connections_opened).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+    def record_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def record_request(self):
+        with self._lock:
+            self.requests_sent += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'connections_opened': self.connections_opened,
+                'requests_sent': self.requests_sent,
+            }
+
+
+class _CountingPoolAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools report every new connection to an HTTPStats."""
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.stats
+
+        def counting(pool_cls):
+            def _new_conn(pool):
+                stats.record_connection()
+                return pool_cls._new_conn(pool)
+            return type(f"Counting{pool_cls.__name__}", (pool_cls,), {'_new_conn': _new_conn})
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': counting(HTTPConnectionPool),
+            'https': counting(HTTPSConnectionPool),
+        }
+
+class ComfyHTTPError(requests.HTTPError):
+    """Non-200 answer from ComfyUI; keeps the response body for error hints."""
+
+    def __init__(self, response):
+        self.body = response.text
+        super().__init__(f"HTTP {response.status_code} {response.reason}", response=response)
+
+
+class IncompatibleWorkflowError(RuntimeError):
+    """The workflow needs node classes or models the server does not have."""
+
+    def __init__(self, problems):
+        self.problems = problems  # {server: [problem, ...]}
+        details = "; ".join(f"{server}: {', '.join(items[:3])}" for server, items in problems.items())
+        super().__init__(f"No compatible ComfyUI server for workflow ({details})")
+
+
+class PromptIndex:
+    """
+    prompt_id -> server map, filled when a prompt is queued, so status,
+    download and cancel calls go to the one server that owns the prompt
+    instead of fanning out over SERVER_LIST. Backed by an append-only
+    JSON-lines journal (path=None keeps it in memory only), so the mapping
+    survives restarts. Only the newest max_entries are kept; the journal is
+    rewritten once it holds twice that many lines.
+    """
+
+    def __init__(self, path=None, max_entries=PROMPT_INDEX_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._journal_lines = 0
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        torn = False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    prompt_id, server = record["prompt_id"], record["server"]
+                except (ValueError, KeyError, TypeError):
+                    # A torn final line from a crash mid-append is skipped here
+                    torn = True
+                    continue
+                self._journal_lines += 1
+                self._entries[prompt_id] = server
+                self._entries.move_to_end(prompt_id)
+        self._trim()
+        if torn:
+            # The next append would land on the fragment and be lost with it
+            try:
+                self._compact()
+            except OSError as e:
+                logger.warning(f"Prompt index rewrite failed: {e}")
+
+    def _trim(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _append(self, prompt_id, server):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        line = json.dumps({"prompt_id": prompt_id, "server": server}) + "\n"
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_lines += 1
+
+    def _compact(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for prompt_id, server in self._entries.items():
+                f.write(json.dumps({"prompt_id": prompt_id, "server": server}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._journal_lines = len(self._entries)
+
+    def record(self, prompt_id, server):
+        if not prompt_id or not server:
+            return
+        with self._lock:
+            if self._entries.get(prompt_id) == server:
+                return
+            self._entries[prompt_id] = server
+            self._entries.move_to_end(prompt_id)
+            self._trim()
+            if self.path:
+                try:
+                    self._append(prompt_id, server)
+                    if self._journal_lines >= 2 * self.max_entries:
+                        self._compact()
+                except OSError as e:
+                    logger.warning(f"Prompt index write failed: {e}")
+
+    def get(self, prompt_id):
+        with self._lock:
+            return self._entries.get(prompt_id)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class UploadCache:
+    """
+    Per-server map of file content hash -> uploaded input name, so unchanged
+    bytes are never uploaded to the same server twice.
+
+    An entry is dropped when the same name is later uploaded with different
+    content (ComfyUI overwrites it), when the server's WebSocket reconnects
+    (it may have restarted and lost its input folder), and when the periodic
+    HEAD /view probe no longer finds the file.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # (server, sha256, subfolder) -> [response dict, verified_at]
+        self._names = {}  # (server, subfolder, name) -> sha256
+        self._hashes = {}  # (path, size, mtime_ns) -> sha256
+        self.hits = 0
+        self.misses = 0
+
+    def file_hash(self, file_path):
+        stat = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._hashes.get(memo_key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(UPLOAD_HASH_CHUNK), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            with self._lock:
+                self._hashes[memo_key] = digest
+        return digest
+
+    def get(self, server, digest, subfolder):
+        """Returns (response, needs_verify) or None."""
+        with self._lock:
+            entry = self._entries.get((server, digest, subfolder))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entry[0]), time.time() - entry[1] > UPLOAD_CACHE_VERIFY_SECONDS
+
+    def put(self, server, digest, subfolder, response):
+        name = response.get('name')
+        with self._lock:
+            previous = self._names.get((server, subfolder, name))
+            if previous is not None and previous != digest:
+                # The name now holds different bytes on the server
+                self._entries.pop((server, previous, subfolder), None)
+            self._names[(server, subfolder, name)] = digest
+            self._entries[(server, digest, subfolder)] = [dict(response), time.time()]
+
+    def mark_verified(self, server, digest, subfolder):
+        with self._lock:
+            entry = self._entries.get((server, digest, subfolder))
+            if entry is not None:
+                entry[1] = time.time()
+
+    def evict(self, server, digest, subfolder):
+        with self._lock:
+            entry = self._entries.pop((server, digest, subfolder), None)
+            if entry is not None:
+                self._names.pop((server, subfolder, entry[0].get('name')), None)
+
+    def invalidate(self, server):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == server]:
+                del self._entries[key]
+            for key in [k for k in self._names if k[0] == server]:
+                del self._names[key]
+
+    def names(self, server):
+        """Uploaded name -> content hash for everything known on server."""
+        with self._lock:
+            return {name: digest for (srv, _, name), digest in self._names.items() if srv == server}
+
+    def snapshot(self):
+        with self._lock:
+            per_server = {}
+            for server, _, _ in self._entries:
+                per_server[server] = per_server.get(server, 0) + 1
+            return {'hits': self.hits, 'misses': self.misses, 'entries': per_server}
+
+
+class DownloadManager:
+    """
+    Streams ComfyUI /view outputs to a unique local path, so two groups that
+    produce the same output filename never overwrite each other. Bytes go to
+    a .part file that is resumed with an HTTP Range request after a dropped or
+    stalled connection; the file is renamed into place only once its size
+    matches the length the server announced. fetch() blocks; submit() runs
+    fetch() on a bounded pool and returns a Future.
+    """
+
+    _TRANSIENT = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, client, workers=DOWNLOAD_WORKERS):
+        self.client = client
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {'active': 0, 'completed': 0, 'failed': 0, 'resumed': 0, 'bytes': 0}
+
+    @staticmethod
+    def unique_path(output_dir, filename):
+        stem, ext = os.path.splitext(os.path.basename(filename))
+        return os.path.join(output_dir, f"{stem}_{uuid.uuid4().hex[:8]}{ext}")
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _stream(self, params, server_address, part_path, progress, deadline):
+        """
+        One GET /view continuing from the part file's size. progress['expected']
+        is updated as soon as the server reports the total length. Returns
+        False when the part file was dropped and the download must start over.
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with self.client._request(
+            "GET", "/view", server_address, params=params, headers=headers,
+            stream=True, timeout=DOWNLOAD_READ_TIMEOUT,
+        ) as response:
+            if response.status_code == 416:
+                # Nothing left past offset: complete if the size matches the
+                # total ("bytes */N"), otherwise the part is bogus
+                total = response.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+                if total.isdigit():
+                    progress['expected'] = int(total)
+                if progress['expected'] is not None and offset == progress['expected']:
+                    return True
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                return False
+            response.raise_for_status()
+            mode = 'wb'
+            if response.status_code == 206:
+                content_range = response.headers.get('Content-Range', '')
+                start = content_range.split(' ', 1)[-1].split('-', 1)[0]
+                total = content_range.rsplit('/', 1)[-1]
+                if total.isdigit():
+                    progress['expected'] = int(total)
+                if not (start.isdigit() and int(start) == offset):
+                    # Unexpected range: drop the part file and start over
+                    os.remove(part_path)
+                    return False
+                mode = 'ab'
+            else:
+                # Range ignored: the body is the whole file again
+                length = response.headers.get('Content-Length')
+                progress['expected'] = int(length) if length and length.isdigit() else None
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                    f.write(chunk)
+                    self._count('bytes', len(chunk))
+                    if time.time() > deadline:
+                        raise IOError(f"Download exceeded {DOWNLOAD_DEADLINE_SECONDS}s")
+        return True
+
+    def fetch(self, filename, subfolder="", file_type="output", output_dir=".", server_address=None):
+        """Downloads one output file; returns its local path or raises."""
+        os.makedirs(output_dir, exist_ok=True)
+        local_path = self.unique_path(output_dir, filename)
+        part_path = f"{local_path}.part"
+        params = {"filename": filename, "subfolder": subfolder, "type": file_type}
+        deadline = time.time() + DOWNLOAD_DEADLINE_SECONDS
+        progress = {'expected': None}
+        resumes = 0
+        logger.info(f"Downloading {filename} from {self.client._resolve_base_url(server_address)} to {local_path}...")
+        self._count('active')
+        try:
+            while True:
+                error = None
+                complete = False
+                try:
+                    complete = self._stream(params, server_address, part_path, progress, deadline)
+                except self._TRANSIENT as e:
+                    error = e
+                size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                expected = progress['expected']
+                if complete and (expected is None or size == expected):
+                    break
+                if expected is not None and size > expected:
+                    raise IOError(f"Download of {filename} overran: {size}/{expected} bytes")
+                resumes += 1
+                if resumes > DOWNLOAD_MAX_RESUMES or time.time() > deadline:
+                    raise error or IOError(f"Download of {filename} incomplete: {size}/{expected} bytes")
+                self._count('resumed')
+                logger.warning(f"Download of {filename} interrupted at {size}/{expected} bytes ({error}), resuming")
+            os.replace(part_path, local_path)
+        except Exception:
+            self._count('failed')
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        finally:
+            self._count('active', -1)
+        self._count('completed')
+        return local_path
+
+    def submit(self, filename, subfolder="", file_type="output", output_dir=".", server_address=None):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="comfy-download")
+        return self._executor.submit(self.fetch, filename, subfolder, file_type, output_dir, server_address)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._stats, workers=self.workers)
+
+
+def workflow_cache_key(workflow, input_digests=None):
+    """
+    Hash of a workflow for the result cache: seed inputs are dropped and
+    uploaded input names (keys of input_digests) are replaced by the content
+    hash of their bytes, so the same inputs give the same key on any server.
+    """
+    input_digests = input_digests or {}
+    normalized = {}
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict):
+            continue
+        inputs = {}
+        for key, value in (node.get('inputs') or {}).items():
+            if key in RESULT_CACHE_SEED_INPUTS:
+                continue
+            if isinstance(value, str) and value in input_digests:
+                value = f"sha256:{input_digests[value]}"
+            inputs[key] = value
+        normalized[node_id] = {'class_type': node.get('class_type'), 'inputs': inputs}
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Opt-in cache of finished workflow outputs (COMFY_RESULT_CACHE=1), keyed
+    by workflow_cache_key. A hit is handed out as the pseudo prompt id
+    "cache:<key>", which check_status, watch and download_result answer
+    locally, so callers need no special case. Outputs of queued prompts are
+    copied in when download_result fetches them; an OBS URL can be attached
+    later. Entries live in directory with an index.json and are evicted
+    least recently used first once they exceed max_bytes.
+    """
+
+    PREFIX = "cache:"
+
+    def __init__(self, directory=None, max_bytes=RESULT_CACHE_MAX_BYTES, enabled=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = bool(enabled and directory)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> {'file', 'filename', 'size', 'obs_url'}
+        self._keys = OrderedDict()  # queued prompt_id -> key
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            self._load()
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _load(self):
+        if not os.path.exists(self._index_path):
+            return
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Result cache index unreadable, starting empty: {e}")
+            return
+        for key, entry in entries:
+            if os.path.exists(os.path.join(self.directory, entry['file'])):
+                self._entries[key] = entry
+
+    def _save(self):
+        temp_path = f"{self._index_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(self._entries.items()), f, ensure_ascii=False)
+        os.replace(temp_path, self._index_path)
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self._entries.values())
+        while total > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            total -= entry['size']
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except OSError:
+                pass
+
+    @classmethod
+    def is_cached_prompt(cls, prompt_id):
+        return isinstance(prompt_id, str) and prompt_id.startswith(cls.PREFIX)
+
+    def _key_of(self, prompt_id):
+        if self.is_cached_prompt(prompt_id):
+            return prompt_id[len(self.PREFIX):]
+        return self._keys.get(prompt_id)
+
+    def lookup(self, key, log_callback=None):
+        """Returns the pseudo prompt id for key on a hit, else None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        if log_callback: log_callback(f"Result cache hit: reusing output of an identical workflow ({key[:12]})")
+        return f"{self.PREFIX}{key}"
+
+    def expect(self, prompt_id, key):
+        """Remembers that prompt_id's output belongs under key."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._keys[prompt_id] = key
+            while len(self._keys) > RESULT_CACHE_PENDING_LIMIT:
+                self._keys.popitem(last=False)
+
+    def result(self, prompt_id):
+        """check_status answer for a pseudo prompt id."""
+        key = self._key_of(prompt_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return "FAILED", "Cached result was evicted"
+            return "SUCCEEDED", {
+                "filename": entry['filename'],
+                "subfolder": "",
+                "type": "cache",
+                "cache_key": key,
+                "obs_url": entry.get('obs_url'),
+            }
+
+    def store(self, prompt_id, local_path):
+        """Copies a downloaded output into the cache if prompt_id was expected."""
+        if not self.enabled:
+            return
+        with self._lock:
+            key = self._keys.get(prompt_id)
+            if key is None or key in self._entries:
+                return
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.basename(local_path)
+        stored = f"{key}{os.path.splitext(filename)[1]}"
+        shutil.copyfile(local_path, os.path.join(self.directory, stored))
+        with self._lock:
+            self._entries[key] = {
+                'file': stored,
+                'filename': filename,
+                'size': os.path.getsize(os.path.join(self.directory, stored)),
+                'obs_url': None,
+            }
+            self._evict()
+            self._save()
+
+    def fetch(self, key, output_dir):
+        """Copies a cached output to a unique path in output_dir."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                raise FileNotFoundError(f"Result cache entry {key} was evicted")
+            self._entries.move_to_end(key)
+        os.makedirs(output_dir, exist_ok=True)
+        local_path = DownloadManager.unique_path(output_dir, entry['filename'])
+        shutil.copyfile(os.path.join(self.directory, entry['file']), local_path)
+        return local_path
+
+    def set_url(self, prompt_id, url):
+        """Attaches the OBS URL the caller published the output under."""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entries.get(self._key_of(prompt_id))
+            if entry is not None and url:
+                entry['obs_url'] = url
+                self._save()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': sum(entry['size'] for entry in self._entries.values()),
+                'max_bytes': self.max_bytes,
+            }
+
+
+class HealthTracker:
+    """
+    Health table for the ComfyUI servers: EWMA probe latency, EWMA error rate
+    and a circuit breaker per server.
+
+    Every request made through ComfyUIClient._request reports its outcome.
+    HEALTH_FAILURE_THRESHOLD consecutive failures (or one refused connection)
+    open a server's circuit: it gets no traffic for HEALTH_OPEN_SECONDS, then
+    turns half-open and the next request or probe closes or re-opens it.
+    Reads never touch the network; probe()/probe_all() are the only calls
+    that do, and the app runs them from its background status thread.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, client, servers=()):
+        self.client = client
+        self._lock = threading.Lock()
+        self._servers = {}
+        for server in servers:
+            self.add_server(server)
+
+    @staticmethod
+    def _key(server):
+        return ComfyUIClient._normalize_base_url(server).replace("http://", "")
+
+    def _new_record(self):
+        return {
+            'latency_ewma': None,
+            'error_rate': 0.0,
+            'consecutive_failures': 0,
+            'opened_at': None,
+            'last_ok': None,
+            'last_error': None,
+            'requests': 0,
+            'failures': 0,
+        }
+
+    def add_server(self, server):
+        key = self._key(server)
+        with self._lock:
+            self._servers.setdefault(key, self._new_record())
+        return key
+
+    def remove_server(self, server):
+        with self._lock:
+            self._servers.pop(self._key(server), None)
+
+    def servers(self):
+        with self._lock:
+            return list(self._servers)
+
+    def _record(self, server):
+        return self._servers.setdefault(self._key(server), self._new_record())
+
+    def _state(self, record, now):
+        if record['opened_at'] is None:
+            return self.CLOSED
+        if now - record['opened_at'] < HEALTH_OPEN_SECONDS:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def record_success(self, server, latency=None):
+        with self._lock:
+            record = self._record(server)
+            record['requests'] += 1
+            record['error_rate'] *= (1 - HEALTH_EWMA_ALPHA)
+            record['consecutive_failures'] = 0
+            record['opened_at'] = None
+            record['last_ok'] = time.time()
+            if latency is not None:
+                previous = record['latency_ewma']
+                record['latency_ewma'] = latency if previous is None else (
+                    HEALTH_EWMA_ALPHA * latency + (1 - HEALTH_EWMA_ALPHA) * previous
+                )
+
+    def record_failure(self, server, error=None):
+        # A refused/unreachable connection is unambiguous; timeouts and 5xx
+        # have to repeat before the circuit opens
+        refused = isinstance(error, requests.ConnectionError) and not isinstance(error, requests.Timeout)
+        now = time.time()
+        with self._lock:
+            record = self._record(server)
+            state = self._state(record, now)
+            record['requests'] += 1
+            record['failures'] += 1
+            record['error_rate'] = HEALTH_EWMA_ALPHA + (1 - HEALTH_EWMA_ALPHA) * record['error_rate']
+            record['consecutive_failures'] += 1
+            record['last_error'] = str(error) if error is not None else None
+            if state == self.HALF_OPEN or (state == self.CLOSED and (
+                refused or record['consecutive_failures'] >= HEALTH_FAILURE_THRESHOLD
+            )):
+                record['opened_at'] = now
+                logger.warning(f"Circuit opened for ComfyUI server {self._key(server)}: {error}")
+
+    def trip(self, server, error=None):
+        """Opens the circuit at once (a failed upload or submit)."""
+        with self._lock:
+            record = self._record(server)
+            record['opened_at'] = time.time()
+            if error is not None:
+                record['last_error'] = str(error)
+
+    def state(self, server):
+        with self._lock:
+            return self._state(self._record(server), time.time())
+
+    def allows(self, server):
+        return self.state(server) != self.OPEN
+
+    def available(self):
+        """Servers whose circuit is closed or half-open, fastest first."""
+        now = time.time()
+        with self._lock:
+            ranked = [
+                (self._state(record, now) != self.CLOSED,
+                 record['latency_ewma'] if record['latency_ewma'] is not None else float('inf'),
+                 server)
+                for server, record in self._servers.items()
+                if self._state(record, now) != self.OPEN
+            ]
+        return [server for _, _, server in sorted(ranked)]
+
+    def probe(self, server, timeout=HEALTH_PROBE_TIMEOUT):
+        """One lightweight liveness request; _request records the outcome and its latency."""
+        self.add_server(server)
+        try:
+            response = self.client._request("GET", HEALTH_PROBE_PATH, server, timeout=timeout, retry=False)
+        except Exception:
+            return False
+        return response.status_code == 200
+
+    def probe_all(self, timeout=HEALTH_PROBE_TIMEOUT):
+        """Probes every known server concurrently; returns {server: ok}."""
+        with self._lock:
+            servers = list(self._servers)
+        if not servers:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+            results = executor.map(lambda server: self.probe(server, timeout), servers)
+            return dict(zip(servers, results))
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {
+                server: dict(record, state=self._state(record, now))
+                for server, record in self._servers.items()
+            }
+
+
+class CapabilityCache:
+    """
+    What each ComfyUI server can run: its node classes and, for every combo
+    input (model, LoRA, VAE lists...), the allowed values. Built from the full
+    /object_info, fetched in the background and trusted for
+    CAPABILITY_TTL_SECONDS. Inputs fed by uploads (image/video/audio_upload)
+    are not checked, since their lists change with every upload. A server
+    that was never fetched is assumed compatible.
+    """
+
+    def __init__(self, client, ttl=CAPABILITY_TTL_SECONDS):
+        self.client = client
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._servers = {}  # server -> (fetched_at, {class_type: {input: frozenset(options)}})
+        self._refreshing = set()
+
+    @staticmethod
+    def _options(spec):
+        """Allowed values of a combo input spec, None for other inputs."""
+        if not isinstance(spec, (list, tuple)) or not spec:
+            return None
+        extra = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+        if any(key.endswith("_upload") for key in extra):
+            return None
+        if isinstance(spec[0], list):
+            return frozenset(v for v in spec[0] if isinstance(v, str))
+        if spec[0] == "COMBO" and isinstance(extra.get("options"), list):
+            return frozenset(v for v in extra["options"] if isinstance(v, str))
+        return None
+
+    @classmethod
+    def parse(cls, object_info):
+        capabilities = {}
+        for class_type, info in object_info.items():
+            combos = {}
+            inputs = info.get("input", {}) if isinstance(info, dict) else {}
+            for group in ("required", "optional"):
+                for name, spec in (inputs.get(group) or {}).items():
+                    options = cls._options(spec)
+                    if options is not None:
+                        combos[name] = options
+            capabilities[class_type] = combos
+        return capabilities
+
+    def refresh(self, server):
+        """Fetches /object_info from server; keeps the old entry if that fails."""
+        server = HealthTracker._key(server)
+        with self._lock:
+            if server in self._refreshing:
+                return False
+            self._refreshing.add(server)
+        try:
+            object_info = self.client._get_json("/object_info", server, timeout=CAPABILITY_FETCH_TIMEOUT, retry=False)
+            capabilities = self.parse(object_info)
+            with self._lock:
+                self._servers[server] = (time.time(), capabilities)
+            logger.info(f"Cached capabilities of {server}: {len(capabilities)} node classes")
+            return True
+        except Exception as e:
+            logger.warning(f"Capability discovery failed for {server}: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._refreshing.discard(server)
+
+    def refresh_stale(self, servers):
+        """Refreshes every server whose entry is missing or older than the TTL."""
+        now = time.time()
+        with self._lock:
+            stale = [
+                server for server in map(HealthTracker._key, servers)
+                if server not in self._servers or now - self._servers[server][0] >= self.ttl
+            ]
+        if not stale:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+            return dict(zip(stale, executor.map(self.refresh, stale)))
+
+    def invalidate(self, server):
+        """Forces a refresh on the next cycle (e.g. ComfyUI rejected a model)."""
+        with self._lock:
+            entry = self._servers.get(HealthTracker._key(server))
+            if entry:
+                self._servers[HealthTracker._key(server)] = (0, entry[1])
+
+    def options(self, server, class_type, input_name):
+        with self._lock:
+            entry = self._servers.get(HealthTracker._key(server))
+        if not entry:
+            return None
+        options = entry[1].get(class_type, {}).get(input_name)
+        return sorted(options) if options is not None else None
+
+    def problems(self, server, workflow):
+        """What server lacks to run workflow; [] if it can (or is unknown)."""
+        with self._lock:
+            entry = self._servers.get(HealthTracker._key(server))
+        if not entry:
+            return []
+        capabilities = entry[1]
+        problems = []
+        for node in workflow.values():
+            if not isinstance(node, dict) or "class_type" not in node:
+                continue
+            class_type = node["class_type"]
+            combos = capabilities.get(class_type)
+            if combos is None:
+                problems.append(f"missing node {class_type}")
+                continue
+            for name, value in node.get("inputs", {}).items():
+                options = combos.get(name)
+                if options is not None and isinstance(value, str) and value not in options:
+                    problems.append(f"{class_type}.{name} {value!r} not installed")
+        return problems
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {
+                server: {
+                    'age_seconds': round(now - fetched_at, 1) if fetched_at else None,
+                    'node_classes': len(capabilities),
+                }
+                for server, (fetched_at, capabilities) in self._servers.items()
+            }
+
+
+class ServerRegistry:
+    """
+    The ComfyUI servers jobs may be sent to, loaded from a JSON config
+    ({"servers": [{"address", "weight", "public_address", "state"}]}) and
+    edited live through add/drain/activate/remove/set_weight. The config at
+    path is only read; every edit is written to state_path, which is loaded
+    instead of it from then on, and handed to the change listeners, which
+    push it into the health table and the scheduler. A draining server gets
+    no new prompts, but stays known so its in-flight prompts are still
+    watched and downloaded. public_address is what core_replace rewrites
+    the address to.
+    """
+
+    ACTIVE = "active"
+    DRAINING = "draining"
+
+    def __init__(self, path=None, defaults=(), state_path=None):
+        self.path = path
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._servers = OrderedDict()
+        self._listeners = []
+        if state_path and os.path.exists(state_path):
+            path = state_path
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+            for entry in config.get("servers", []):
+                self._put(entry["address"], entry.get("weight", 1), entry.get("public_address"),
+                          entry.get("state", self.ACTIVE))
+        else:
+            for address in defaults:
+                self._put(address)
+
+    @staticmethod
+    def _key(address):
+        return ComfyUIClient._normalize_base_url(address).replace("http://", "")
+
+    @staticmethod
+    def _weight(weight):
+        weight = float(weight)
+        if not weight > 0:
+            raise ValueError("weight must be positive")
+        return weight
+
+    def _put(self, address, weight=1, public_address=None, state=ACTIVE):
+        if state not in (self.ACTIVE, self.DRAINING):
+            raise ValueError(f"unknown server state {state!r}")
+        key = self._key(address)
+        self._servers[key] = {
+            'address': key,
+            'weight': self._weight(weight),
+            'public_address': public_address or None,
+            'state': state,
+        }
+        return key
+
+    def _save(self):
+        if not self.state_path:
+            return
+        directory = os.path.dirname(self.state_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"servers": list(self._servers.values())}, f, indent=2)
+            f.write("\n")
+        os.replace(temp_path, self.state_path)
+
+    def _edit(self, change):
+        with self._lock:
+            result = change()
+            self._save()
+        for listener in self._listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                logger.error(f"Server registry listener failed: {e}")
+        return result
+
+    def _entry(self, address):
+        key = self._key(address)
+        if key not in self._servers:
+            raise KeyError(f"Unknown ComfyUI server {key}")
+        return self._servers[key]
+
+    def add_listener(self, listener):
+        """listener(registry) runs after every edit."""
+        self._listeners.append(listener)
+
+    def add(self, address, weight=1, public_address=None):
+        def change():
+            if self._key(address) in self._servers:
+                raise ValueError(f"ComfyUI server {self._key(address)} is already registered")
+            return dict(self._servers[self._put(address, weight, public_address)])
+        return self._edit(change)
+
+    def drain(self, address):
+        return self._set(address, 'state', self.DRAINING)
+
+    def activate(self, address):
+        return self._set(address, 'state', self.ACTIVE)
+
+    def set_weight(self, address, weight):
+        return self._set(address, 'weight', self._weight(weight))
+
+    def _set(self, address, field, value):
+        def change():
+            entry = self._entry(address)
+            entry[field] = value
+            return dict(entry)
+        return self._edit(change)
+
+    def remove(self, address):
+        def change():
+            entry = self._entry(address)
+            del self._servers[entry['address']]
+            return entry
+        return self._edit(change)
+
+    def servers(self, include_draining=False):
+        with self._lock:
+            return [
+                key for key, entry in self._servers.items()
+                if include_draining or entry['state'] == self.ACTIVE
+            ]
+
+    def weights(self):
+        with self._lock:
+            return {key: entry['weight'] for key, entry in self._servers.items()}
+
+    def port_mapping(self):
+        """{address: public_address} for every server that has one."""
+        with self._lock:
+            return {key: entry['public_address'] for key, entry in self._servers.items() if entry['public_address']}
+
+    def snapshot(self):
+        with self._lock:
+            return [dict(entry) for entry in self._servers.values()]
+
 
 class ComfyUIClient:
-    def __init__(self, server_address=None):
+    def __init__(self, server_address=None, prompt_index=None, result_cache=None, servers=None):
         self.client_id = str(uuid.uuid4())
         self.server_address = None
         self.base_url = None
+        self._sessions = {}
+        self._probe_sessions = {}
+        self._http_stats = {}
+        self._sessions_lock = threading.Lock()
+        self._listeners = {}
+        self.completions = completion_utils.CompletionTracker()
+        self._status_services = {}
+        self._status_executor = None
+        self.upload_cache = UploadCache()
+        self.downloads = DownloadManager(self)
+        self.health = HealthTracker(self, SERVER_LIST if servers is None else servers)
+        self.draining = set()  # servers failover() must not move to
+        self.capabilities = CapabilityCache(self)
+        self.prompt_index = prompt_index if prompt_index is not None else PromptIndex()
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self._queue_listeners = []
         
         # If server_address is provided, try to use it
         if server_address:
@@ -47,31 +1105,166 @@ class ComfyUIClient:
         self.server_address = self.base_url.replace("http://", "").replace("https://", "")
         logger.info(f"ComfyUIClient initialized with server: {self.base_url}")
 
+    @staticmethod
+    def _normalize_base_url(server):
+        # Force HTTP as requested, removing HTTPS if present
+        if server.startswith("https://"):
+            server = server.replace("https://", "http://")
+        elif not server.startswith("http://"):
+            server = f"http://{server}"
+        return server.rstrip("/")
+
+    def _resolve_base_url(self, server_address=None):
+        return self._normalize_base_url(server_address) if server_address else self.base_url
+
+    def _session(self, base_url):
+        """
+        Returns the pooled keep-alive session for one server, creating it on first use.
+        """
+        with self._sessions_lock:
+            session = self._sessions.get(base_url)
+            if session is None:
+                stats = self._http_stats.setdefault(base_url, HTTPStats())
+                retry_strategy = Retry(
+                    total=HTTP_RETRY_TOTAL,
+                    backoff_factor=HTTP_RETRY_BACKOFF,
+                    status_forcelist=[502, 503, 504],
+                    allowed_methods=["GET", "HEAD"],  # POST /prompt must never be replayed
+                    raise_on_status=False,
+                )
+                adapter = _CountingPoolAdapter(
+                    stats,
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    max_retries=retry_strategy,
+                )
+                session = requests.Session()
+                session.headers.update(HTTP_HEADERS)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[base_url] = session
+                # Liveness probes share the same connection pools but must fail
+                # fast, so they go through a twin adapter without retries.
+                probe_adapter = HTTPAdapter(max_retries=0)
+                probe_adapter.poolmanager = adapter.poolmanager
+                probe_session = requests.Session()
+                probe_session.headers.update(HTTP_HEADERS)
+                probe_session.mount("http://", probe_adapter)
+                probe_session.mount("https://", probe_adapter)
+                self._probe_sessions[base_url] = probe_session
+            return session
+
+    def _request(self, method, path, server_address=None, timeout=None, retry=True, **kwargs):
+        """
+        Sends one request to a ComfyUI server through its pooled session.
+        timeout may be a number (read timeout) or a (connect, read) tuple;
+        retry=False skips the retry/backoff policy (used for liveness probes);
+        the latency of those requests is what HealthTracker averages.
+        """
+        base_url = self._resolve_base_url(server_address)
+        if timeout is None:
+            timeout = HTTP_READ_TIMEOUT
+        if not isinstance(timeout, tuple):
+            timeout = (min(HTTP_CONNECT_TIMEOUT, timeout), timeout)
+        session = self._session(base_url)
+        if not retry:
+            session = self._probe_sessions[base_url]
+        self._http_stats[base_url].record_request()
+        server = base_url.replace("http://", "")
+        started = time.monotonic()
+        try:
+            response = session.request(method, f"{base_url}{path}", timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self.health.record_failure(server, e)
+            raise
+        if response.status_code >= 500:
+            self.health.record_failure(server, f"HTTP {response.status_code}")
+        else:
+            self.health.record_success(server, None if retry else time.monotonic() - started)
+        return response
+
+    def _get_json(self, path, server_address=None, timeout=None, **kwargs):
+        response = self._request("GET", path, server_address, timeout=timeout, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def _ensure_listener(self, base_url):
+        """
+        Starts the WebSocket event listener for base_url once; it lives for
+        the rest of the process and reconnects on its own.
+        """
+        with self._sessions_lock:
+            listener = self._listeners.get(base_url)
+            if listener is None or not listener.is_alive():
+                listener = completion_utils.ServerEventListener(
+                    base_url, self.client_id, self.completions, on_reconnect=self.upload_cache.invalidate
+                )
+                self._listeners[base_url] = listener
+                listener.start()
+            return listener
+
+    def close_listeners(self):
+        """Stops the WebSocket listeners and status services (tests, shutdown)."""
+        with self._sessions_lock:
+            workers = list(self._listeners.values()) + list(self._status_services.values())
+            self._listeners.clear()
+            self._status_services.clear()
+        for worker in workers:
+            worker.stop()
+
+    def watch(self, prompt_id, server_address, callback, deadline=None):
+        """
+        Hands prompt_id to the status service of its server; callback runs once
+        with (prompt_id, status, result) when it finishes, fails or passes deadline.
+        """
+        server = self._resolve_base_url(server_address).replace("http://", "")
+        with self._sessions_lock:
+            if self._status_executor is None:
+                self._status_executor = ThreadPoolExecutor(
+                    max_workers=STATUS_CALLBACK_WORKERS, thread_name_prefix="comfy-status-callback"
+                )
+            if ResultCache.is_cached_prompt(prompt_id):
+                # Served from the result cache: already finished
+                status, result = self.result_cache.result(prompt_id)
+                return self._status_executor.submit(callback, prompt_id, status, result)
+            service = self._status_services.get(server)
+            if service is None or not service.is_alive():
+                service = completion_utils.StatusService(server, self, self.completions, self._status_executor)
+                self._status_services[server] = service
+                service.start()
+        return service.watch(prompt_id, callback, deadline)
+
+    def add_queue_listener(self, listener):
+        """listener(prompt_id, server, prompt) runs after each prompt ComfyUI accepts."""
+        self._queue_listeners.append(listener)
+
+    def server_of(self, prompt_id):
+        """Server that owns prompt_id (live tracker first, then the persistent index)."""
+        return self.completions.server_of(prompt_id) or self.prompt_index.get(prompt_id)
+
+    def watched_prompts(self):
+        with self._sessions_lock:
+            services = list(self._status_services.values())
+        return {service.server: service.watched() for service in services}
+
+    def connection_stats(self):
+        """Connections opened vs requests sent, per server base URL."""
+        with self._sessions_lock:
+            items = list(self._http_stats.items())
+        return {base_url: stats.snapshot() for base_url, stats in items}
+
     def find_fastest_server(self):
         """
-        Pings all servers in SERVER_LIST concurrently and sets the base_url to the first one that responds.
+        Probes every server in the health table concurrently and sets the base_url to the first one that responds.
         """
         logger.info("Attempting to find fastest server...")
-        
+        servers = [s for s in self.health.servers() if s not in self.draining] or SERVER_LIST
+
         def check_server(server):
-            try:
-                # Force HTTP
-                if server.startswith("https://"):
-                    server = server.replace("https://", "http://")
-                elif not server.startswith("http://"):
-                    server = f"http://{server}"
-                
-                url = f"{server.rstrip('/')}/object_info"
-                headers = {'User-Agent': 'Mozilla/5.0'}
-                response = requests.get(url, timeout=3, headers=headers)
-                if response.status_code == 200:
-                    return server
-            except:
-                pass
-            return None
+            return self._normalize_base_url(server) if self.health.probe(server) else None
 
-        with ThreadPoolExecutor(max_workers=len(SERVER_LIST)) as executor:
-            future_to_server = {executor.submit(check_server, server): server for server in SERVER_LIST}
+        with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+            future_to_server = {executor.submit(check_server, server): server for server in servers}
             for future in as_completed(future_to_server):
                 result = future.result()
                 if result:
@@ -80,35 +1273,39 @@ class ComfyUIClient:
                     return True
         
         logger.warning("No available server found. Defaulting to first in list.")
-        self._set_server_address(SERVER_LIST[0])
+        self._set_server_address(servers[0])
         return False
 
-    def check_connection(self, timeout=5):
+    def check_connection(self, timeout=HEALTH_PROBE_TIMEOUT):
         """
-        Checks if the server is reachable. If not, tries to switch to another server.
+        Probes the current server. Never switches servers: that only happens
+        in failover(), so code holding base_url is not redirected mid-job.
         """
         if not self.base_url:
-            self.find_fastest_server()
-            
-        try:
-            url = f"{self.base_url}/object_info"
-            # Add headers to mimic browser/standard client
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            response = requests.get(url, timeout=timeout, headers=headers)
-            return response.status_code == 200
-        except Exception as e:
-            # logger.debug(f"Connection check failed: {e}") # Reduce noise
-            # If connection fails, try to re-find server
-            logger.info("Connection failed, attempting to switch server...")
-            if self.find_fastest_server():
-                return True
+            return self.find_fastest_server()
+        return self.health.probe(self.server_address, timeout=timeout)
+
+    def failover(self):
+        """
+        Moves base_url to the fastest available server if the current one's
+        circuit is open or it is draining. Returns True if a server is
+        available afterwards.
+        """
+        if self.server_address and self.server_address not in self.draining and self.health.allows(self.server_address):
+            return True
+        available = [s for s in self.health.available() if s not in self.draining]
+        if not available:
             return False
+        logger.info(f"ComfyUI server {self.server_address} is down, failing over to {available[0]}")
+        self._set_server_address(available[0])
+        return True
 
     def ensure_connection(self):
         """
-        Ensures we have a valid connection.
+        Answers from the health table without touching the network: True if
+        the current server, or failing that another one, is usable.
         """
-        return self.check_connection(timeout=10)
+        return self.failover()
 
     def get_object_info(self, node_class=None):
         """
@@ -116,60 +1313,70 @@ class ComfyUIClient:
         If node_class is provided, returns info only for that class.
         """
         try:
-            url = f"{self.base_url}/object_info"
-            if node_class:
-                url = f"{url}/{node_class}"
-            
-            with urllib.request.urlopen(url, timeout=60) as response:
-                data = json.loads(response.read())
-                return data
+            path = f"/object_info/{node_class}" if node_class else "/object_info"
+            return self._get_json(path, timeout=60)
         except Exception as e:
             logger.error(f"Get object info failed: {e}")
             return None
 
-    def queue_prompt(self, prompt, log_callback=None):
+    def queue_prompt(self, prompt, log_callback=None, server_address=None):
         """
-        Sends the workflow to the server.
+        Sends the workflow to the server (the default one unless server_address is given).
         """
         try:
-            if log_callback: log_callback(f"Sending prompt to {self.base_url}...")
+            base_url = self._resolve_base_url(server_address)
+            server = base_url.replace("http://", "")
+            cache_key = None
+            if self.result_cache.enabled:
+                cache_key = workflow_cache_key(prompt, self.upload_cache.names(server))
+                cached_id = self.result_cache.lookup(cache_key, log_callback)
+                if cached_id:
+                    return cached_id, server
+            problems = self.capabilities.problems(server, prompt)
+            if problems:
+                # Rejected here instead of by ComfyUI, without a round trip
+                raise IncompatibleWorkflowError({server: problems})
+            if log_callback: log_callback(f"Sending prompt to {base_url}...")
             p = {"prompt": prompt, "client_id": self.client_id}
-            data = json.dumps(p).encode('utf-8')
-            
-            url = f"{self.base_url}/prompt"
-            req = urllib.request.Request(url, data=data)
-            with urllib.request.urlopen(req, timeout=60) as response:
-                response_data = json.loads(response.read())
-                if 'prompt_id' in response_data:
-                    if log_callback: log_callback(f"Prompt queued successfully. ID: {response_data['prompt_id']}")
-                    return response_data['prompt_id'], self.server_address
+            # Listener first, so it is usually connected before the first event
+            self._ensure_listener(base_url)
+            response = self._request("POST", "/prompt", server, json=p, timeout=60)
+            if response.status_code != 200:
+                raise ComfyHTTPError(response)
+            response_data = response.json()
+            if 'prompt_id' in response_data:
+                self.completions.track(response_data['prompt_id'], server)
+                self.prompt_index.record(response_data['prompt_id'], server)
+                if cache_key:
+                    self.result_cache.expect(response_data['prompt_id'], cache_key)
+                for listener in self._queue_listeners:
+                    try:
+                        listener(response_data['prompt_id'], server, prompt)
+                    except Exception as e:
+                        logger.error(f"Queue listener failed for {response_data['prompt_id']}: {e}")
+                if log_callback: log_callback(f"Prompt queued successfully. ID: {response_data['prompt_id']}")
+                return response_data['prompt_id'], server
         except Exception as e:
-            error_msg = str(e)
-            error_body = ""
-            if hasattr(e, 'read'):
+            error_body = getattr(e, 'body', None)
+            if error_body:
+                logger.warning(f"Failed to queue prompt. Response: {error_body}")
+                if log_callback: log_callback(f"Failed to queue prompt. Response: {error_body}")
+
+                # Try to parse error to give helpful hints
                 try:
-                    error_body = e.read().decode('utf-8')
-                    logger.warning(f"Failed to queue prompt. Response: {error_body}")
-                    if log_callback: log_callback(f"Failed to queue prompt. Response: {error_body}")
-                    
-                    # Try to parse error to give helpful hints
-                    try:
-                        err_json = json.loads(error_body)
-                        node_errors = err_json.get('node_errors', {})
-                        for node_id, errors in node_errors.items():
-                            class_type = errors.get('class_type')
-                            for err in errors.get('errors', []):
-                                if err.get('type') == 'value_not_in_list' and class_type == 'UNETLoader':
-                                    logger.info("Attempting to fetch available UNET models...")
-                                    info = self.get_object_info('UNETLoader')
-                                    if info:
-                                        # structure: {'UNETLoader': {'input': {'required': {'unet_name': [['model1', 'model2'], ...]}}}}
-                                        models = info.get('UNETLoader', {}).get('input', {}).get('required', {}).get('unet_name', [[]])[0]
-                                        logger.info(f"Available UNET models on server ({len(models)}): {models}")
-                                        if log_callback: log_callback(f"Available UNET models: {models}")
-                    except:
-                        pass
-                        
+                    err_json = json.loads(error_body)
+                    node_errors = err_json.get('node_errors', {})
+                    for node_id, errors in node_errors.items():
+                        class_type = errors.get('class_type')
+                        for err in errors.get('errors', []):
+                            if err.get('type') == 'value_not_in_list':
+                                # The cached model lists are out of date
+                                self.capabilities.invalidate(server)
+                            if err.get('type') == 'value_not_in_list' and class_type == 'UNETLoader':
+                                models = self.capabilities.options(server, 'UNETLoader', 'unet_name')
+                                if models is not None:
+                                    logger.info(f"Available UNET models on server ({len(models)}): {models}")
+                                    if log_callback: log_callback(f"Available UNET models: {models}")
                 except:
                     pass
             logger.warning(f"Failed to queue prompt: {e}")
@@ -183,31 +1390,72 @@ class ComfyUIClient:
         Queries history for the given prompt_id.
         """
         try:
-            base_url = f"http://{server_address}" if server_address else self.base_url
-            url = f"{base_url}/history/{prompt_id}"
-            logger.info(f"Fetching ComfyUI history: {url}")
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read())
-                return data
+            logger.info(f"Fetching ComfyUI history: {self._resolve_base_url(server_address)}/history/{prompt_id}")
+            return self._get_json(f"/history/{prompt_id}", server_address, timeout=10)
         except Exception as e:
             logger.warning(f"Failed to get history for {prompt_id} from {server_address or self.base_url}: {e}")
             pass
         return None
 
-    def upload_file(self, file_path, subfolder="", overwrite=True, log_callback=None):
+    def get_recent_history(self, max_items, server_address=None):
         """
-        Uploads a file to ComfyUI.
+        Fetches the newest max_items history entries in one call, keyed by prompt_id.
         """
         try:
-            if log_callback: log_callback(f"Uploading file to ComfyUI ({self.base_url}): {file_path}")
-            url = f"{self.base_url}/upload/image"
+            return self._get_json("/history", server_address, timeout=10, params={"max_items": max_items})
+        except Exception as e:
+            logger.warning(f"Failed to get recent history from {server_address or self.base_url}: {e}")
+        return None
+
+    def _input_exists(self, response, server_address=None):
+        """Cheap check that an uploaded input is still on the server."""
+        params = {
+            'filename': response.get('name'),
+            'subfolder': response.get('subfolder', ''),
+            'type': response.get('type', 'input'),
+        }
+        try:
+            result = self._request("HEAD", "/view", server_address, params=params, timeout=5, retry=False)
+        except requests.RequestException:
+            return None
+        return result.status_code == 200
+
+    def upload_file(self, file_path, subfolder="", overwrite=True, log_callback=None, server_address=None):
+        """
+        Uploads a file to ComfyUI (the default server unless server_address is given).
+        Identical content already uploaded to that server is not sent again;
+        the cached response with its uploaded name is returned instead.
+        """
+        base_url = self._resolve_base_url(server_address)
+        server = base_url.replace("http://", "")
+        try:
+            digest = self.upload_cache.file_hash(file_path)
+        except OSError as e:
+            logger.error(f"Upload exception: {e}")
+            if log_callback: log_callback(f"Upload exception: {e}")
+            return None
+        cached = self.upload_cache.get(server, digest, subfolder)
+        if cached is not None:
+            res, needs_verify = cached
+            exists = self._input_exists(res, server) if needs_verify else True
+            if exists is False:
+                self.upload_cache.evict(server, digest, subfolder)
+            else:
+                if needs_verify and exists:
+                    self.upload_cache.mark_verified(server, digest, subfolder)
+                if log_callback: log_callback(f"Already on {base_url} as {res.get('name')}, skipping upload")
+                return res
+
+        try:
+            if log_callback: log_callback(f"Uploading file to ComfyUI ({base_url}): {file_path}")
             with open(file_path, 'rb') as f:
                 files = {'image': f}
                 data = {'overwrite': str(overwrite).lower(), 'subfolder': subfolder}
-                response = requests.post(url, files=files, data=data, timeout=60)
+                response = self._request("POST", "/upload/image", server, files=files, data=data, timeout=60)
                 
             if response.status_code == 200:
                 res = response.json()
+                self.upload_cache.put(server, digest, subfolder, res)
                 if log_callback: log_callback(f"Upload successful: {res.get('name')}")
                 return res
             else:
@@ -221,40 +1469,20 @@ class ComfyUIClient:
     
     def download_output_file(self, filename, subfolder="", file_type="output", output_dir=".", server_address=None):
         """
-        Downloads a file from ComfyUI output.
+        Downloads a file from ComfyUI output to a unique path in output_dir.
         """
         try:
-            params = {
-                "filename": filename,
-                "subfolder": subfolder,
-                "type": file_type
-            }
-            query_string = urllib.parse.urlencode(params)
-            base_url = f"http://{server_address}" if server_address else self.base_url
-            url = f"{base_url}/view?{query_string}"
-            
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-                
-            local_path = os.path.join(output_dir, filename)
-            logger.info(f"Downloading {url} to {local_path}...")
-            
-            urllib.request.urlretrieve(url, local_path)
-            return local_path
+            return self.downloads.fetch(filename, subfolder, file_type, output_dir, server_address)
         except Exception as e:
             logger.error(f"Download failed: {e}")
             raise # Propagate exception
-        
+
     def get_queue(self, server_address=None):
         """
         Gets the current queue status.
         """
         try:
-            base_url = f"http://{server_address}" if server_address else self.base_url
-            url = f"{base_url}/queue"
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read())
-                return data
+            return self._get_json("/queue", server_address, timeout=10)
         except Exception as e:
             logger.error(f"Get queue failed from {server_address or self.base_url}: {e}")
             return None
@@ -280,44 +1508,409 @@ class ComfyUIClient:
                 
         return "NOT_FOUND"
 
-    def cancel_task(self, prompt_id):
+    def cancel_task(self, prompt_id, server_address=None):
         """
-        Cancels a task.
+        Cancels a task on the server that owns it (default server if unknown).
         """
+        server_address = server_address or self.server_of(prompt_id)
         try:
             # 1. Try to delete from queue (if pending)
-            url = f"{self.base_url}/queue"
-            data = {"delete": [prompt_id]}
-            data_json = json.dumps(data).encode('utf-8')
-            
-            req = urllib.request.Request(url, data=data_json, method='POST')
             try:
-                urllib.request.urlopen(req)
+                self._request("POST", "/queue", server_address, json={"delete": [prompt_id]}, timeout=10)
             except:
                 pass
 
             # 2. Check if running and interrupt
-            status = self.is_task_running(prompt_id)
+            status = self.is_task_running(prompt_id, server_address)
             if status == "RUNNING":
-                url = f"{self.base_url}/interrupt"
-                req = urllib.request.Request(url, data=b"", method='POST')
-                urllib.request.urlopen(req)
+                self._request("POST", "/interrupt", server_address, data=b"", timeout=10)
             
             return True
         except Exception as e:
             logger.error(f"Cancel task failed: {e}")
             return False
 
+class ServerScheduler:
+    """
+    Chooses the ComfyUI server for each prompt.
+
+    A server's expected wait is (queue depth + prompts assigned since the last
+    /queue fetch + 1) times its EWMA execution time, divided by its registry
+    weight; the lowest wins. set_servers() applies registry edits live.
+    Model affinity: every queued prompt records its workflow family as the
+    family its server will have loaded. A server holding another family is
+    charged SCHEDULER_AFFINITY_MAX_EXTRA_WAIT on top of its wait, so prompts
+    stick to a warm server until its backlog costs more than a model swap.
+    Servers whose circuit is open in the client's HealthTracker are skipped;
+    a failed /queue, upload or submit trips the circuit. submit() uploads the prompt's input
+    files to the chosen server before queueing, so inputs and prompt always
+    land on the same box.
+    """
+
+    def __init__(self, client, servers):
+        self.client = client
+        self._lock = threading.Lock()
+        self._depth = {}  # server -> (fetched_at, depth)
+        self._assigned = {}
+        self._exec_seconds = {}
+        self._family = {}  # server -> workflow family of the last prompt queued there
+        self._swaps = {}
+        self._affinity_picks = {}
+        self._weights = {}
+        self.health = client.health
+        self.set_servers(servers)
+        self._prompt_family = OrderedDict()  # prompt_id -> (family, queued_at), until the prompt finishes
+        self._latency = {}  # family -> deque of execution seconds
+        client.completions.add_finish_listener(self._on_finished)
+        client.add_queue_listener(self._on_queued)
+
+    def set_servers(self, servers, weights=None):
+        """
+        Replaces the servers new prompts may go to (live registry edits).
+        Counters of servers that stay are kept.
+        """
+        servers = [ComfyUIClient._normalize_base_url(s).replace("http://", "") for s in servers]
+        with self._lock:
+            for server in servers:
+                self._assigned.setdefault(server, 0)
+                self._swaps.setdefault(server, 0)
+                self._affinity_picks.setdefault(server, 0)
+            self._weights = dict(weights or {})
+            self.servers = servers
+        for server in servers:
+            self.health.add_server(server)
+
+    def _on_queued(self, prompt_id, server, prompt):
+        family = workflow_utils.family_of(prompt)
+        if family is None:
+            return
+        with self._lock:
+            self._track(prompt_id, family, time.time())
+            if server not in self._swaps:
+                return
+            previous = self._family.get(server)
+            if previous is not None and previous != family:
+                self._swaps[server] += 1
+            self._family[server] = family
+
+    def _on_finished(self, prompt_id, server, status, elapsed):
+        with self._lock:
+            family, _ = self._prompt_family.pop(prompt_id, (None, None))
+            if status == "SUCCEEDED" and elapsed is not None and family is not None:
+                self._latency.setdefault(family, deque(maxlen=SCHEDULER_LATENCY_SAMPLES)).append(elapsed)
+        if status != "SUCCEEDED" or elapsed is None or server not in self._assigned:
+            return
+        with self._lock:
+            previous = self._exec_seconds.get(server)
+            if previous is None:
+                self._exec_seconds[server] = elapsed
+            else:
+                self._exec_seconds[server] = SCHEDULER_EWMA_ALPHA * elapsed + (1 - SCHEDULER_EWMA_ALPHA) * previous
+
+    def latency_percentile(self, family, q):
+        """
+        Execution time (seconds) below which a fraction q of the family's
+        recent prompts finished; None until enough samples exist.
+        """
+        with self._lock:
+            samples = sorted(self._latency.get(family, ()))
+        if len(samples) < SCHEDULER_LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))]
+
+    def latency_snapshot(self):
+        with self._lock:
+            families = {family: len(samples) for family, samples in self._latency.items()}
+        return {
+            family: {
+                'samples': count,
+                'p50': self.latency_percentile(family, 0.5),
+                'p95': self.latency_percentile(family, 0.95),
+            }
+            for family, count in families.items()
+        }
+
+    def track(self, prompt_id, family, queued_at=None):
+        """
+        Counts a prompt queued before a restart toward outstanding() until
+        it finishes, as if it had just been queued through this client at
+        queued_at.
+        """
+        with self._lock:
+            self._track(prompt_id, family, time.time() if queued_at is None else queued_at)
+
+    def _track(self, prompt_id, family, queued_at):
+        self._prompt_family[prompt_id] = (family, queued_at)
+        while len(self._prompt_family) > completion_utils.COMPLETION_STATE_LIMIT:
+            self._prompt_family.popitem(last=False)
+
+    def forget(self, prompt_id):
+        """Drops a cancelled prompt from the outstanding set (no finish event will come)."""
+        with self._lock:
+            self._prompt_family.pop(prompt_id, None)
+
+    def typical_exec_seconds(self, family):
+        """Median execution time of the family, SCHEDULER_DEFAULT_EXEC_SECONDS until sampled."""
+        return self.latency_percentile(family, 0.5) or SCHEDULER_DEFAULT_EXEC_SECONDS
+
+    def capacity(self):
+        """Summed weight of the healthy servers (at least 1): roughly how many prompts run at once."""
+        with self._lock:
+            weights = dict(self._weights)
+        return max(1, sum(weights.get(s, 1) for s in self.servers if self.is_healthy(s)))
+
+    def outstanding(self):
+        """{family: prompts queued through this client and not finished yet}."""
+        cutoff = time.time() - SCHEDULER_OUTSTANDING_MAX_AGE
+        counts = {}
+        with self._lock:
+            for family, queued_at in self._prompt_family.values():
+                if queued_at >= cutoff:
+                    counts[family] = counts.get(family, 0) + 1
+        return counts
+
+    def estimate_seconds(self, family, prompts=1):
+        """Fleet seconds that prompts more of the family add to the backlog."""
+        return prompts * self.typical_exec_seconds(family) / self.capacity()
+
+    def backlog_seconds(self):
+        """
+        Estimated seconds until the fleet has worked off every outstanding
+        prompt: each costs its family's median execution time, spread over
+        capacity().
+        """
+        return sum(self.estimate_seconds(family, count) for family, count in self.outstanding().items())
+
+    def idle_servers(self, exclude=()):
+        """Healthy servers with nothing queued or running and nothing assigned since."""
+        idle = []
+        for server in self.servers:
+            if server in exclude or not self.is_healthy(server):
+                continue
+            if self._queue_depth(server) == 0 and self._assigned[server] == 0:
+                idle.append(server)
+        return idle
+
+    def mark_failure(self, server, error=None):
+        self.health.trip(server, error)
+        with self._lock:
+            self._depth.pop(server, None)
+
+    def is_healthy(self, server):
+        return self.health.allows(server)
+
+    def _queue_depth(self, server):
+        cached = self._depth.get(server)
+        if cached and time.time() - cached[0] < SCHEDULER_QUEUE_TTL:
+            return cached[1]
+        try:
+            queue_data = self.client._get_json("/queue", server, timeout=SCHEDULER_QUEUE_TIMEOUT, retry=False)
+        except Exception as e:
+            logger.warning(f"Scheduler could not read queue of {server}: {e}")
+            self.mark_failure(server, e)
+            return None
+        depth = len(queue_data.get('queue_running', [])) + len(queue_data.get('queue_pending', []))
+        with self._lock:
+            self._depth[server] = (time.time(), depth)
+            # The fresh depth already counts everything assigned before it
+            self._assigned[server] = 0
+        return depth
+
+    def pick(self, exclude=(), family=None):
+        """
+        Returns the server with the shortest expected wait for a prompt of
+        the given workflow family, or None if none is reachable.
+        """
+        candidates = [s for s in self.servers if s not in exclude and self.is_healthy(s)]
+        depths = {}
+        for server in candidates:
+            depth = self._queue_depth(server)
+            if depth is not None:
+                depths[server] = depth
+        if not depths:
+            return None
+        with self._lock:
+            def expected_wait(server):
+                exec_seconds = self._exec_seconds.get(server, SCHEDULER_DEFAULT_EXEC_SECONDS)
+                load = depths[server] + self._assigned[server]
+                weight = self._weights.get(server, 1)
+                return (load + 1) * exec_seconds / weight, load, self.servers.index(server)
+
+            def cost(server):
+                wait, load, order = expected_wait(server)
+                cold = family is not None and self._family.get(server) != family
+                if cold:
+                    wait += SCHEDULER_AFFINITY_MAX_EXTRA_WAIT
+                return wait, cold, load, order
+
+            best = min(depths, key=cost)
+            if best != min(depths, key=expected_wait):
+                # Affinity outweighed a shorter queue elsewhere
+                self._affinity_picks[best] += 1
+            self._assigned[best] += 1
+        return best
+
+    def submit(self, build_workflow, input_files=None, log_callback=None, family=None, exclude=()):
+        """
+        Picks a server for the workflow family, uploads input_files
+        ({key: local_path}) to it and queues build_workflow({key: uploaded_name}) there. Unreachable servers
+        are skipped in favour of the next best one; a prompt rejected by
+        ComfyUI itself is not retried. Servers whose cached capabilities lack
+        a node class or model the workflow uses are never picked; if none is
+        left, IncompatibleWorkflowError is raised before any upload. Servers
+        in exclude are never used (e.g. the one a retried prompt failed on).
+        Returns (prompt_id, server_address).
+        """
+        input_files = input_files or {}
+        if self.client.result_cache.enabled:
+            # Inputs are named by content hash, as queue_prompt normalizes them
+            digests = {key: self.client.upload_cache.file_hash(path) for key, path in input_files.items()}
+            placeholders = {key: f"sha256:{d}" for key, d in digests.items()}
+        else:
+            placeholders = {key: os.path.basename(path) for key, path in input_files.items()}
+        # Built once before uploading anything, for the result cache and the capability check
+        probe = build_workflow(placeholders)
+        if self.client.result_cache.enabled:
+            cached_id = self.client.result_cache.lookup(workflow_cache_key(probe), log_callback)
+            if cached_id:
+                return cached_id, None
+        incompatible = {}
+        for server in self.servers:
+            problems = self.client.capabilities.problems(server, probe)
+            if problems:
+                incompatible[server] = problems
+        if incompatible:
+            if len(incompatible) == len(self.servers):
+                raise IncompatibleWorkflowError(incompatible)
+            if log_callback: log_callback(f"Skipping servers that cannot run this workflow: {', '.join(incompatible)}")
+        tried = set()
+        last_error = None
+        while True:
+            server = self.pick(exclude=tried | set(incompatible) | set(exclude), family=family)
+            if server is None:
+                if tried:
+                    raise RuntimeError(f"No ComfyUI server accepted the prompt: {last_error}")
+                # Nothing answered /queue: fall back to the default server
+                server = self.client.server_address
+                if server in incompatible:
+                    raise IncompatibleWorkflowError(incompatible)
+                if server in exclude:
+                    raise RuntimeError(f"No ComfyUI server left besides {', '.join(exclude)}")
+            tried.add(server)
+            if log_callback: log_callback(f"Scheduler selected ComfyUI server {server}")
+
+            names = {}
+            for key, path in input_files.items():
+                res = self.client.upload_file(path, log_callback=log_callback, server_address=server)
+                if not res or 'name' not in res:
+                    last_error = f"upload of {os.path.basename(path)} to {server} failed"
+                    break
+                names[key] = res['name']
+            if len(names) != len(input_files):
+                self.mark_failure(server, last_error)
+                continue
+
+            try:
+                return self.client.queue_prompt(build_workflow(names), log_callback=log_callback, server_address=server)
+            except ComfyHTTPError:
+                raise
+            except requests.RequestException as e:
+                last_error = e
+                self.mark_failure(server, e)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                server: {
+                    'queue_depth': self._depth.get(server, (None, None))[1],
+                    'assigned_since_fetch': self._assigned[server],
+                    'exec_seconds_ewma': self._exec_seconds.get(server),
+                    'healthy': self.health.allows(server),
+                    'family': self._family.get(server),
+                    'model_swaps': self._swaps[server],
+                    'affinity_picks': self._affinity_picks[server],
+                    'weight': self._weights.get(server, 1),
+                }
+                for server in self.servers
+            }
+
+
 # Initialize client
 SERVER_ADDRESS = os.environ.get("COMFYUI_SERVER")
-if SERVER_ADDRESS:
-    client = ComfyUIClient(SERVER_ADDRESS)
-else:
-    client = ComfyUIClient()
+server_registry = ServerRegistry(SERVER_CONFIG_FILE, defaults=SERVER_LIST, state_path=SERVER_STATE_FILE)
+_result_cache = ResultCache(RESULT_CACHE_DIR, enabled=RESULT_CACHE_ENABLED)
+client = ComfyUIClient(
+    SERVER_ADDRESS,
+    prompt_index=PromptIndex(PROMPT_INDEX_FILE),
+    result_cache=_result_cache,
+    servers=server_registry.servers(include_draining=True),
+)
+# A pinned COMFYUI_SERVER disables spreading across the registry
+scheduler = ServerScheduler(client, [SERVER_ADDRESS] if SERVER_ADDRESS else server_registry.servers())
+
+
+def apply_server_registry(registry, client, scheduler, pinned=None):
+    """
+    Pushes the registry into the health table, the client's failover set and
+    the scheduler. Removed servers stop being probed; draining ones are still
+    probed (their prompts are in flight) but get no new prompts.
+    """
+    known = registry.servers(include_draining=True)
+    active = registry.servers()
+    for server in client.health.servers():
+        if server not in known and server != client.server_address:
+            client.health.remove_server(server)
+    for server in known:
+        client.health.add_server(server)
+    if pinned:
+        return
+    # Includes the default server if it was removed, so failover() leaves it
+    client.draining = set(client.health.servers()) - set(active)
+    scheduler.set_servers(active, registry.weights())
+    if client.server_address not in active:
+        client.failover()
+
+
+server_registry.add_listener(lambda registry: apply_server_registry(registry, client, scheduler, SERVER_ADDRESS))
+apply_server_registry(server_registry, client, scheduler, SERVER_ADDRESS)
 
 # Helper functions for app.py
 # These act as wrappers around the client instance
 
+def prewarm_uploads(file_paths):
+    """
+    Pushes new shared assets (character.png, tone.wav) to every healthy
+    server in the background so the next job finds them in the upload cache.
+    The files are copied first, so the caller may delete its paths at once.
+    """
+    staging_dir = tempfile.mkdtemp(prefix="comfy_prewarm_")
+    staged = []
+    for path in file_paths:
+        if path and os.path.exists(path):
+            target = os.path.join(staging_dir, os.path.basename(path))
+            shutil.copyfile(path, target)
+            staged.append(target)
+    servers = [s for s in scheduler.servers if scheduler.is_healthy(s)]
+
+    def run():
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(servers))) as executor:
+                futures = [
+                    executor.submit(client.upload_file, path, server_address=server)
+                    for server in servers for path in staged
+                ]
+                for future in as_completed(futures):
+                    future.result()
+            logger.info(f"Pre-warmed {len(staged)} file(s) on {len(servers)} server(s)")
+        except Exception as e:
+            logger.warning(f"Upload pre-warm failed: {e}")
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
 def submit_job_with_urls(character_url, video_url, log_callback=None):
     temp_dir = tempfile.mkdtemp()
     try:
@@ -361,39 +1954,24 @@ def submit_job(character_path, video_path, log_callback=None):
         if log_callback: log_callback(f"Submit job error: {e}")
         return None, None, str(e)
 
-def cancel_job(prompt_id):
-    return client.cancel_task(prompt_id)
+def cancel_job(prompt_id, server_address=None):
+    scheduler.forget(prompt_id)
+    return client.cancel_task(prompt_id, server_address)
 
 def adjust_segment_length(workflow, segment_duration):
     try:
-        if "49" in workflow and workflow.get("49", {}).get("class_type") == "WanVaceToVideo":
-            fps = 16
-            node_id_video = "68"
-            if (
-                node_id_video in workflow
-                and "inputs" in workflow[node_id_video]
-                and "fps" in workflow[node_id_video]["inputs"]
-            ):
-                fps = workflow[node_id_video]["inputs"]["fps"]
+        if workflow.get("49", {}).get("class_type") == "WanVaceToVideo":
+            fps = workflow_utils.get_input(workflow, "68", "fps", 16)
             target = int(math.ceil(segment_duration * fps))
             if target < 4:
                 target = 4
-            if "49" in workflow and "inputs" in workflow["49"]:
-                workflow["49"]["inputs"]["length"] = target
+            workflow_utils.set_input(workflow, "49", "length", target)
         else:
-            fps = 16
-            node_id_video = "232:15"
-            if (
-                node_id_video in workflow
-                and "inputs" in workflow[node_id_video]
-                and "fps" in workflow[node_id_video]["inputs"]
-            ):
-                fps = workflow[node_id_video]["inputs"]["fps"]
+            fps = workflow_utils.get_input(workflow, "232:15", "fps", 16)
             target = int(math.ceil(segment_duration * fps))
-            base_a = workflow.get("232:62", {}).get("inputs", {}).get("length")
-            base_b = workflow.get("242:90", {}).get("inputs", {}).get("length")
             max_allowed = None
-            for v in (base_a, base_b):
+            for node_id in ("232:62", "242:90"):
+                v = workflow_utils.get_input(workflow, node_id, "length")
                 if isinstance(v, int):
                     max_allowed = v if max_allowed is None else min(max_allowed, v)
             min_allowed = 4
@@ -402,72 +1980,152 @@ def adjust_segment_length(workflow, segment_duration):
             if target < min_allowed:
                 target = min_allowed
             for node_id in ["232:62", "242:90"]:
-                if node_id in workflow and "inputs" in workflow[node_id]:
-                    workflow[node_id]["inputs"]["length"] = target
+                if isinstance(workflow.get(node_id), dict) and "inputs" in workflow[node_id]:
+                    workflow_utils.set_input(workflow, node_id, "length", target)
     except Exception as e:
         logger.warning(f"Failed to adjust segment length: {e}")
     return workflow
 
-def queue_workflow_template(char_filename, video_filename, prompt_text=None, workflow_type='real', segment_duration=None, log_callback=None):
+def _workflow_template(workflow_type):
+    return workflow_utils.registry.get('vace' if workflow_type == 'anime' else 'animate')
+
+def workflow_family(workflow_type):
+    """Template family of the real/anime segment workflow (see ServerScheduler.latency_percentile)."""
+    return _workflow_template(workflow_type).family
+
+def _workflow_template_path(workflow_type):
+    return workflow_utils.registry.path('vace' if workflow_type == 'anime' else 'animate')
+
+def build_workflow_template(char_filename, video_filename, prompt_text=None, workflow_type='real', segment_duration=None):
+    """
+    Instantiates the animate (real) or VACE (anime) template and fills in the
+    uploaded input names. Returns None if the template file is missing.
+    """
     try:
-        if workflow_type == 'anime':
-            workflow_path = os.path.join(
-                os.path.dirname(__file__),
-                'comfyapi',
-                '视频换人2video_wan_vace_14B_v2v.json',
-            )
-        else:
-            workflow_path = os.path.join(
-                os.path.dirname(__file__),
-                'comfyapi',
-                '视频换人video_wan2_2_14B_animate.json',
-            )
-            
-        if not os.path.exists(workflow_path):
+        template = _workflow_template(workflow_type)
+    except FileNotFoundError:
+        return None
+
+    workflow = template.instantiate(image=char_filename, video=video_filename, text=prompt_text or None)
+    if segment_duration is not None:
+        workflow = adjust_segment_length(workflow, segment_duration)
+    if workflow_type != 'real':
+        template.bind(workflow, seed=random.randint(1, 1000000000000000))
+    return workflow
+
+def _log_template_inputs(log_callback, workflow_type, char_filename, video_filename, prompt_text):
+    if log_callback:
+        log_callback(f"Submitting workflow to ComfyUI (Type: {workflow_type})...")
+        log_callback(f"Inputs - Character: {char_filename}, Video: {video_filename}")
+        if prompt_text:
+            log_callback(f"Prompt: {prompt_text[:50]}..." if len(prompt_text) > 50 else f"Prompt: {prompt_text}")
+
+def _queue_error_message(e):
+    error_msg = str(e)
+    error_body = getattr(e, 'body', None)
+    if error_body:
+        error_msg += f" Response: {error_body}"
+    return error_msg
+
+def queue_workflow_template(char_filename, video_filename, prompt_text=None, workflow_type='real', segment_duration=None, log_callback=None, server_address=None):
+    try:
+        workflow = build_workflow_template(char_filename, video_filename, prompt_text, workflow_type, segment_duration)
+        if workflow is None:
+            workflow_path = _workflow_template_path(workflow_type)
             if log_callback: log_callback(f"Workflow file not found: {workflow_path}")
             return None, None, f"Workflow file not found: {workflow_path}"
-            
-        with open(workflow_path, 'r', encoding='utf-8') as f:
-            workflow = json.load(f)
-            
-        # Update inputs
-        for node_id in ("10", "134"):
-            if node_id in workflow and "inputs" in workflow[node_id] and "image" in workflow[node_id]["inputs"]:
-                workflow[node_id]["inputs"]["image"] = char_filename
-        if "145" in workflow and "inputs" in workflow["145"] and "file" in workflow["145"]["inputs"]:
-            workflow["145"]["inputs"]["file"] = video_filename
-        if prompt_text and "21" in workflow: workflow["21"]["inputs"]["text"] = prompt_text
-        if segment_duration is not None:
-            workflow = adjust_segment_length(workflow, segment_duration)
-        if workflow_type != 'real':
-            seed = random.randint(1, 1000000000000000)
-            for node_id in ["232:63", "242:91", "64"]:
-                if node_id in workflow and "inputs" in workflow[node_id] and "seed" in workflow[node_id]["inputs"]:
-                    workflow[node_id]["inputs"]["seed"] = seed
-            
-        if log_callback: 
-            log_callback(f"Submitting workflow to ComfyUI (Type: {workflow_type})...")
-            log_callback(f"Inputs - Character: {char_filename}, Video: {video_filename}")
-            if prompt_text:
-                log_callback(f"Prompt: {prompt_text[:50]}..." if len(prompt_text) > 50 else f"Prompt: {prompt_text}")
-        prompt_id, server_address = client.queue_prompt(workflow, log_callback=log_callback)
+
+        _log_template_inputs(log_callback, workflow_type, char_filename, video_filename, prompt_text)
+        prompt_id, server_address = client.queue_prompt(workflow, log_callback=log_callback, server_address=server_address)
         if log_callback: log_callback(f"Workflow submitted. Prompt ID: {prompt_id}, Server: {server_address}")
         return (prompt_id, server_address, None) if prompt_id else (None, None, "Failed to queue prompt")
     except Exception as e:
-        error_msg = str(e)
-        if hasattr(e, 'read'):
-            try:
-                error_body = e.read().decode('utf-8')
-                error_msg += f" Response: {error_body}"
-            except:
-                pass
+        error_msg = _queue_error_message(e)
         logger.error(f"Queue workflow template error: {error_msg}")
         if log_callback: log_callback(f"Queue workflow template error: {error_msg}")
         return None, None, error_msg
 
+def submit_workflow_template(char_path, video_path, prompt_text=None, workflow_type='real', segment_duration=None, log_callback=None, exclude=()):
+    """
+    Like queue_workflow_template, but takes local files: the scheduler picks
+    the server (never one in exclude) and uploads both inputs to it before queueing.
+    """
+    try:
+        workflow_path = _workflow_template_path(workflow_type)
+        if not os.path.exists(workflow_path):
+            if log_callback: log_callback(f"Workflow file not found: {workflow_path}")
+            return None, None, f"Workflow file not found: {workflow_path}"
+
+        def build(names):
+            return build_workflow_template(names['character'], names['video'], prompt_text, workflow_type, segment_duration)
+
+        _log_template_inputs(log_callback, workflow_type, os.path.basename(char_path), os.path.basename(video_path), prompt_text)
+
+        prompt_id, server_address = scheduler.submit(
+            build, {'character': char_path, 'video': video_path}, log_callback=log_callback,
+            family=_workflow_template(workflow_type).family, exclude=exclude,
+        )
+        if log_callback: log_callback(f"Workflow submitted. Prompt ID: {prompt_id}, Server: {server_address}")
+        return (prompt_id, server_address, None) if prompt_id else (None, None, "Failed to queue prompt")
+    except Exception as e:
+        error_msg = _queue_error_message(e)
+        logger.error(f"Submit workflow template error: {error_msg}")
+        if log_callback: log_callback(f"Submit workflow template error: {error_msg}")
+        return None, None, error_msg
+
 def check_status(prompt_id, server_address=None):
-    # If specific server is known, prioritize it. Otherwise check all.
-    servers_to_check = [server_address] if server_address else SERVER_LIST
+    """
+    Returns (status, result) for a prompt. Prompts queued through this client
+    are answered from the WebSocket event stream; HTTP history/queue polling
+    only runs for untracked prompts or to reconcile after a listener reconnect.
+    """
+    if ResultCache.is_cached_prompt(prompt_id):
+        return client.result_cache.result(prompt_id)
+    tracked = client.completions.lookup(prompt_id)
+    if tracked is not None:
+        return tracked
+    server_address = server_address or client.server_of(prompt_id)
+    status, result = _check_status_http(prompt_id, server_address)
+    client.completions.reconcile(prompt_id, status, result)
+    return status, result
+
+def watch_prompt(prompt_id, server_address, callback, deadline=None):
+    return client.watch(prompt_id, server_address or client.server_of(prompt_id), callback, deadline)
+
+def server_of(prompt_id):
+    return client.server_of(prompt_id)
+
+def wait_for_completion(prompt_ids, timeout):
+    """
+    Sleeps up to timeout seconds, waking as soon as one of prompt_ids
+    finishes. Replaces fixed-interval sleeps in the monitor loops.
+    """
+    return client.completions.wait(prompt_ids, timeout)
+
+def _history_result(prompt_id, server, history):
+    data = history[prompt_id]
+    outputs = data.get('outputs', {})
+
+    # 只记录关键信息，避免输出整个 history JSON
+    summary_items = []
+    for node_id, node_output in outputs.items():
+        for type_key in ['gifs', 'videos', 'images', 'audio']:
+            if type_key in node_output:
+                count = len(node_output[type_key])
+                summary_items.append(f"{node_id}:{type_key}={count}")
+
+    summary_str = ", ".join(summary_items) if summary_items else "no outputs"
+    logger.info(
+        f"Task {prompt_id} completed on {server}. Output summary: {summary_str}"
+    )
+    return completion_utils.select_output(outputs)
+
+def _check_status_http(prompt_id, server_address=None):
+    # Queued prompts are in the prompt index; only prompts from before the
+    # index existed fall back to checking every server.
+    if not server_address:
+        logger.info(f"Server of {prompt_id} unknown, checking all servers")
+    servers_to_check = [server_address] if server_address else server_registry.servers(include_draining=True)
     
     any_network_error = False
     
@@ -477,79 +2135,25 @@ def check_status(prompt_id, server_address=None):
             history = client.get_history(prompt_id, server)
             if history is None:
                 any_network_error = True
-                # Continue to next server or try is_task_running if single server?
-                # If single server and network error, we can't do much.
-                # If checking multiple, maybe it's on another server.
-                # Let's try is_task_running on this server just in case history endpoint is the only one broken (unlikely)
-                # But proceed to check queue.
-            
             elif prompt_id in history:
-                # Found!
-                data = history[prompt_id]
-                outputs = data.get('outputs', {})
-
-                # 只记录关键信息，避免输出整个 history JSON
-                summary_items = []
-                for node_id, node_output in outputs.items():
-                    for type_key in ['gifs', 'videos', 'images', 'audio']:
-                        if type_key in node_output:
-                            count = len(node_output[type_key])
-                            summary_items.append(f"{node_id}:{type_key}={count}")
-
-                summary_str = ", ".join(summary_items) if summary_items else "no outputs"
-                logger.info(
-                    f"Task {prompt_id} completed on {server}. Output summary: {summary_str}"
-                )
-                
-                # Collect all outputs to find the best one
-                all_files = []
-                for node_id, node_output in outputs.items():
-                    for type_key in ['gifs', 'videos', 'images', 'audio']:
-                        if type_key in node_output:
-                            for file_info in node_output[type_key]:
-                                all_files.append({
-                                    'node_id': node_id,
-                                    'type_key': type_key,
-                                    'file_info': file_info
-                                })
-                
-                if all_files:
-                    # Sort outputs to prioritize video > image > audio
-                    def sort_key(item):
-                        type_priority = {'videos': 0, 'gifs': 1, 'images': 2, 'audio': 3}
-                        node_priority = 0 if item['node_id'] == '15' else 1
-                        return (node_priority, type_priority.get(item['type_key'], 99))
-                    
-                    all_files.sort(key=sort_key)
-                    best_file = all_files[0]
-                    file_info = best_file['file_info']
-                    
-                    logger.info(f"Selected output: Node {best_file['node_id']} ({best_file['type_key']}) - {file_info.get('filename')}")
-                    
-                    return "SUCCEEDED", {
-                        "filename": file_info.get('filename'),
-                        "subfolder": file_info.get('subfolder', ''),
-                        "type": file_info.get('type', 'output')
-                    }
-                
-                return "FAILED", "No output found"
+                client.prompt_index.record(prompt_id, server)
+                return _history_result(prompt_id, server, history)
                 
             # 2. Check queue
             status = client.is_task_running(prompt_id, server)
             if status == "UNKNOWN":
                 any_network_error = True
             elif status in ["PENDING", "RUNNING"]:
+                client.prompt_index.record(prompt_id, server)
                 logger.info(f"Task {prompt_id} is {status} on {server}")
                 return status, None
             
-            # Double check history if queue said NOT_FOUND (and history was checked before)
-            # But we already checked history.
-            # Race condition: Finished between history check and queue check?
+            # Race: the prompt may have finished between the history and queue checks
             if history is not None and status == "NOT_FOUND":
-                 # Check history again
                  history_retry = client.get_history(prompt_id, server)
                  if history_retry is not None and prompt_id in history_retry:
-                      return check_status(prompt_id, server) # Recursion to handle output parsing
+                      client.prompt_index.record(prompt_id, server)
+                      return _history_result(prompt_id, server, history_retry)
                  elif history_retry is None:
                       any_network_error = True
 
@@ -564,14 +2168,54 @@ def check_status(prompt_id, server_address=None):
         
     return "FAILED", "Task not found"
 
-def download_result(file_info, output_dir, server_address=None):
-    return client.download_output_file(
+def download_result(file_info, output_dir, server_address=None, prompt_id=None):
+    """
+    Downloads a prompt's output. Outputs served from the result cache are
+    copied locally; outputs of prompts expected by the cache are stored in it.
+    """
+    if file_info.get('type') == 'cache':
+        return client.result_cache.fetch(file_info['cache_key'], output_dir)
+    local_path = client.download_output_file(
         file_info['filename'],
         file_info['subfolder'],
         file_info['type'],
         output_dir,
         server_address
     )
+    _store_result(prompt_id, local_path)
+    return local_path
+
+def download_result_async(file_info, output_dir, server_address=None, prompt_id=None):
+    """Like download_result, but runs on the download pool; returns a Future."""
+    if file_info.get('type') == 'cache':
+        future = Future()
+        try:
+            future.set_result(client.result_cache.fetch(file_info['cache_key'], output_dir))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    future = client.downloads.submit(
+        file_info['filename'],
+        file_info['subfolder'],
+        file_info['type'],
+        output_dir,
+        server_address
+    )
+    if prompt_id:
+        future.add_done_callback(lambda f: f.exception() is None and _store_result(prompt_id, f.result()))
+    return future
+
+def _store_result(prompt_id, local_path):
+    if not prompt_id or not local_path:
+        return
+    try:
+        client.result_cache.store(prompt_id, local_path)
+    except OSError as e:
+        logger.warning(f"Could not store {prompt_id} in result cache: {e}")
+
+def remember_result_url(prompt_id, url):
+    """Attaches the OBS URL of a prompt's output to its result cache entry."""
+    client.result_cache.set_url(prompt_id, url)
 
 
 def _load_switch_prompt():
@@ -597,44 +2241,37 @@ def _load_switch_prompt():
         return None
 
 
-def queue_transition_workflow(start_image_filename, end_image_filename, width=640, height=640, fps=16, prompt_text=None):
+def queue_transition_workflow(start_image_path, end_image_path, width=640, height=640, fps=16, prompt_text=None):
+    """
+    Queues the first/last-frame transition workflow. Takes the local frame
+    images; the scheduler uploads them to the server it picks.
+    """
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        workflow_path = os.path.join(base_dir, "comfyapi", "收尾帧wan2.1_flf2v_720_f16.json")
-        if not os.path.exists(workflow_path):
-            return None, None, f"Workflow file not found: {workflow_path}"
-        with open(workflow_path, "r", encoding="utf-8") as f:
-            workflow = json.load(f)
-        if "52" in workflow and "inputs" in workflow["52"] and "image" in workflow["52"]["inputs"]:
-            workflow["52"]["inputs"]["image"] = start_image_filename
-        if "72" in workflow and "inputs" in workflow["72"] and "image" in workflow["72"]["inputs"]:
-            workflow["72"]["inputs"]["image"] = end_image_filename
-        if "83" in workflow and "inputs" in workflow["83"]:
-            node_inputs = workflow["83"]["inputs"]
-            node_inputs["width"] = int(width)
-            node_inputs["height"] = int(height)
-            if "length" in node_inputs:
-                node_inputs["length"] = 16
-        for node in workflow.values():
-            if isinstance(node, dict):
-                inputs = node.get("inputs")
-                if isinstance(inputs, dict) and "fps" in inputs:
-                    inputs["fps"] = int(fps)
+        try:
+            template = workflow_utils.registry.get("transition")
+        except FileNotFoundError as e:
+            return None, None, str(e)
         if prompt_text is None:
             prompt_text = _load_switch_prompt()
-        if prompt_text and "6" in workflow and "inputs" in workflow["6"]:
-            workflow["6"]["inputs"]["text"] = prompt_text
-        prompt_id, server_address = client.queue_prompt(workflow)
+
+        def build(names):
+            return template.instantiate(
+                start_image=names["start"],
+                end_image=names["end"],
+                width=int(width),
+                height=int(height),
+                length=16,
+                fps=int(fps),
+                text=prompt_text or None,
+            )
+
+        prompt_id, server_address = scheduler.submit(
+            build, {"start": start_image_path, "end": end_image_path}, family=template.family
+        )
         if prompt_id:
             return prompt_id, server_address, None
         return None, None, "Failed to queue transition workflow"
     except Exception as e:
-        error_msg = str(e)
-        if hasattr(e, "read"):
-            try:
-                error_body = e.read().decode("utf-8")
-                error_msg += f" Response: {error_body}"
-            except Exception:
-                pass
+        error_msg = _queue_error_message(e)
         logger.error(f"Queue transition workflow error: {error_msg}")
         return None, None, error_msg
@@ -0,0 +1,477 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import websocket
+
+logger = logging.getLogger(__name__)
+
+# WebSocket listener settings (used in: ServerEventListener.run)
+WS_CONNECT_TIMEOUT = 5  # seconds to open the /ws connection
+WS_RECV_TIMEOUT = 30  # seconds a recv() may block before the stop flag is re-checked
+WS_RECONNECT_DELAY = 1  # first reconnect delay in seconds, doubled per failure
+WS_RECONNECT_MAX_DELAY = 30  # upper bound for the reconnect delay
+# Finished prompt states kept for late check_status calls (used in: CompletionTracker._trim)
+COMPLETION_STATE_LIMIT = 2048
+# Status multiplexer settings (used in: StatusService.run, StatusService._poll)
+STATUS_POLL_INTERVAL_SECONDS = 15  # max wait between cycles; WebSocket completions wake it early
+STATUS_HISTORY_BATCH = 64  # /history?max_items=N fetched once per cycle for unresolved prompts
+
+TERMINAL_STATUSES = ("SUCCEEDED", "FAILED")
+
+
+def select_output(outputs):
+    """
+    Picks the result file from a prompt's node outputs (history or
+    `executed` events share the same shape): node 15 first, then
+    video > gif > image > audio.
+    Returns ("SUCCEEDED", file_info) or ("FAILED", "No output found").
+    """
+    all_files = []
+    for node_id, node_output in outputs.items():
+        for type_key in ['gifs', 'videos', 'images', 'audio']:
+            if type_key in node_output:
+                for file_info in node_output[type_key]:
+                    all_files.append({
+                        'node_id': node_id,
+                        'type_key': type_key,
+                        'file_info': file_info
+                    })
+
+    if not all_files:
+        return "FAILED", "No output found"
+
+    def sort_key(item):
+        type_priority = {'videos': 0, 'gifs': 1, 'images': 2, 'audio': 3}
+        node_priority = 0 if item['node_id'] == '15' else 1
+        return (node_priority, type_priority.get(item['type_key'], 99))
+
+    all_files.sort(key=sort_key)
+    best_file = all_files[0]
+    file_info = best_file['file_info']
+    logger.info(f"Selected output: Node {best_file['node_id']} ({best_file['type_key']}) - {file_info.get('filename')}")
+    return "SUCCEEDED", {
+        "filename": file_info.get('filename'),
+        "subfolder": file_info.get('subfolder', ''),
+        "type": file_info.get('type', 'output')
+    }
+
+
+class _PromptState:
+    __slots__ = ("server", "status", "result", "outputs", "finished", "stale", "reported", "started_at")
+
+    def __init__(self, server, stale):
+        self.server = server
+        self.started_at = None
+        self.status = "PENDING"
+        self.result = None
+        self.outputs = {}
+        self.finished = False
+        # stale: events may have been missed, one HTTP reconciliation is needed
+        self.stale = stale
+        # reported: the terminal status has been handed to a caller
+        self.reported = False
+
+
+class CompletionTracker:
+    """
+    In-memory prompt states fed by the per-server WebSocket listeners.
+
+    check_status answers from here without any HTTP call while the server's
+    listener is connected. A state is marked stale when its listener was not
+    connected for part of the prompt's life (start-up, reconnect); stale
+    prompts fall back to one HTTP history/queue reconciliation.
+    """
+
+    def __init__(self, limit=COMPLETION_STATE_LIMIT):
+        self.limit = limit
+        self._states = OrderedDict()
+        self._live = set()
+        self._cond = threading.Condition()
+        self._finish_listeners = []
+
+    def _state(self, prompt_id, server):
+        state = self._states.get(prompt_id)
+        if state is None:
+            state = self._states[prompt_id] = _PromptState(server, server not in self._live)
+            self._trim()
+        elif server and not state.server:
+            state.server = server
+        return state
+
+    def _trim(self):
+        if len(self._states) <= self.limit:
+            return
+        for prompt_id in [pid for pid, s in self._states.items() if s.finished]:
+            del self._states[prompt_id]
+            if len(self._states) <= self.limit:
+                return
+        while len(self._states) > self.limit:
+            self._states.popitem(last=False)
+
+    def _finish(self, prompt_id, state, status, result):
+        if state.finished and not state.stale:
+            # Already finished from events or an earlier reconcile: listeners ran once
+            return
+        state.status = status
+        state.result = result
+        state.finished = True
+        state.stale = False
+        self._cond.notify_all()
+        elapsed = time.time() - state.started_at if state.started_at else None
+        for listener in self._finish_listeners:
+            try:
+                listener(prompt_id, state.server, status, elapsed)
+            except Exception as e:
+                logger.error(f"Finish listener failed for {prompt_id}: {e}")
+
+    def add_finish_listener(self, listener):
+        """
+        listener(prompt_id, server, status, elapsed) runs once per finished
+        prompt, while the tracker lock is held: it must be quick and must not
+        call back into the tracker. elapsed is the execution time in seconds
+        when the start was observed, else None.
+        """
+        self._finish_listeners.append(listener)
+
+    def track(self, prompt_id, server):
+        """Registers a prompt just queued on server."""
+        with self._cond:
+            self._state(prompt_id, server)
+
+    def server_of(self, prompt_id):
+        with self._cond:
+            state = self._states.get(prompt_id)
+            return state.server if state else None
+
+    def started_at(self, prompt_id):
+        """When the prompt was seen starting to execute, or None."""
+        with self._cond:
+            state = self._states.get(prompt_id)
+            return state.started_at if state is not None else None
+
+    def set_live(self, server, live):
+        """
+        Records whether server's listener is connected. Any change makes the
+        server's in-flight prompts stale, since events may have been missed.
+        """
+        with self._cond:
+            if live:
+                self._live.add(server)
+            else:
+                self._live.discard(server)
+            for state in self._states.values():
+                if state.server == server and not state.finished:
+                    state.stale = True
+            self._cond.notify_all()
+
+    def is_live(self, server):
+        with self._cond:
+            return server in self._live
+
+    def handle_event(self, server, message):
+        """Applies one decoded ComfyUI WebSocket message."""
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+        with self._cond:
+            state = self._state(prompt_id, server)
+            if state.finished:
+                return
+            if msg_type == "execution_start" or (msg_type == "executing" and data.get("node") is not None):
+                state.status = "RUNNING"
+                if state.started_at is None:
+                    state.started_at = time.time()
+            elif msg_type == "executed":
+                output = data.get("output")
+                if output:
+                    state.outputs[str(data.get("node"))] = output
+            elif msg_type == "execution_error":
+                self._finish(prompt_id, state, "FAILED", data.get("exception_message") or "Execution error")
+            elif msg_type == "execution_interrupted":
+                self._finish(prompt_id, state, "FAILED", "Interrupted")
+            elif msg_type == "execution_success" or (msg_type == "executing" and data.get("node") is None):
+                status, result = select_output(state.outputs)
+                if status == "SUCCEEDED":
+                    self._finish(prompt_id, state, status, result)
+                else:
+                    # Cached output nodes emit no `executed` event: read history instead
+                    state.finished = True
+                    state.stale = True
+                    self._cond.notify_all()
+
+    def lookup(self, prompt_id):
+        """
+        Returns (status, result) when the event stream is authoritative for
+        prompt_id, or None when the caller has to reconcile over HTTP.
+        """
+        with self._cond:
+            state = self._states.get(prompt_id)
+            if state is None or state.stale:
+                return None
+            if state.finished:
+                state.reported = True
+                return state.status, state.result
+            if state.server not in self._live:
+                return None
+            return state.status, None
+
+    def reconcile(self, prompt_id, status, result):
+        """Folds an HTTP check_status answer back into the tracked state."""
+        with self._cond:
+            state = self._states.get(prompt_id)
+            if state is None:
+                return
+            if status in TERMINAL_STATUSES:
+                self._finish(prompt_id, state, status, result)
+                state.reported = True
+            elif not state.finished and state.server in self._live:
+                state.status = status
+                state.stale = False
+                if status == "RUNNING" and state.started_at is None:
+                    state.started_at = time.time()
+            elif state.finished:
+                state.reported = True
+
+    def notify(self):
+        """Wakes every wait() so it re-evaluates its wake-up condition."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait(self, prompt_ids, timeout, wake=None):
+        """
+        Blocks until one of prompt_ids has finished and not yet been reported
+        by check_status, until wake() is true, or until timeout. Returns True
+        if woken before the timeout.
+        """
+        prompt_ids = list(prompt_ids)
+
+        def ready():
+            if wake is not None and wake():
+                return True
+            for prompt_id in prompt_ids:
+                state = self._states.get(prompt_id)
+                if state is not None and state.finished and not state.reported:
+                    return True
+            return False
+
+        with self._cond:
+            return self._cond.wait_for(ready, timeout)
+
+    def snapshot(self):
+        with self._cond:
+            in_flight = sum(1 for s in self._states.values() if not s.finished)
+            return {
+                'live_servers': sorted(self._live),
+                'tracked': len(self._states),
+                'in_flight': in_flight,
+            }
+
+
+class ServerEventListener(threading.Thread):
+    """
+    Long-lived /ws connection to one ComfyUI server, using the client's
+    client_id so the server routes this client's prompt events to it.
+    Reconnects with exponential backoff and reports liveness to the tracker.
+    on_reconnect(server), if given, runs on every connect after the first,
+    since the server may have restarted in between.
+    """
+
+    def __init__(self, base_url, client_id, tracker, on_reconnect=None):
+        super().__init__(daemon=True, name=f"comfy-ws-{base_url}")
+        self.server = base_url.replace("http://", "").replace("https://", "")
+        self.url = f"ws://{self.server}/ws?clientId={client_id}"
+        self.tracker = tracker
+        self.on_reconnect = on_reconnect
+        self.connects = 0
+        self._stop_event = threading.Event()
+        self._ws = None
+
+    def stop(self):
+        self._stop_event.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def run(self):
+        delay = WS_RECONNECT_DELAY
+        while not self._stop_event.is_set():
+            try:
+                self._ws = websocket.create_connection(self.url, timeout=WS_CONNECT_TIMEOUT)
+                self._ws.settimeout(WS_RECV_TIMEOUT)
+                logger.info(f"WebSocket listener connected to {self.server}")
+                self.connects += 1
+                if self.connects > 1 and self.on_reconnect is not None:
+                    self.on_reconnect(self.server)
+                self.tracker.set_live(self.server, True)
+                delay = WS_RECONNECT_DELAY
+                self._receive_loop()
+            except Exception as e:
+                if not self._stop_event.is_set():
+                    logger.warning(f"WebSocket listener for {self.server} disconnected: {e}")
+            finally:
+                self.tracker.set_live(self.server, False)
+                if self._ws is not None:
+                    try:
+                        self._ws.close()
+                    except Exception:
+                        pass
+                    self._ws = None
+            if self._stop_event.wait(delay):
+                break
+            delay = min(delay * 2, WS_RECONNECT_MAX_DELAY)
+
+    def _receive_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                frame = self._ws.recv()
+            except websocket.WebSocketTimeoutException:
+                self._ws.ping()
+                continue
+            if not frame:
+                if not self._ws.connected:
+                    raise ConnectionError("WebSocket closed")
+                continue
+            if isinstance(frame, bytes):
+                # Binary frames are latent previews
+                continue
+            try:
+                message = json.loads(frame)
+            except ValueError:
+                continue
+            self.tracker.handle_event(self.server, message)
+
+
+class StatusService(threading.Thread):
+    """
+    Status multiplexer for one ComfyUI server.
+
+    Monitors register prompt ids with a callback instead of running their own
+    polling thread. Each cycle answers what it can from the CompletionTracker
+    (no HTTP while the WebSocket listener is live); the rest is resolved with
+    one /queue call plus one /history?max_items batch, falling back to
+    /history/{id} only for ids missing from the batch. Callbacks run on the
+    shared executor as callback(prompt_id, status, result), where status is
+    SUCCEEDED, FAILED or TIMEOUT.
+    """
+
+    def __init__(self, server, client, tracker, executor, interval=STATUS_POLL_INTERVAL_SECONDS,
+                 history_batch=STATUS_HISTORY_BATCH):
+        super().__init__(daemon=True, name=f"comfy-status-{server}")
+        self.server = server
+        self.client = client
+        self.tracker = tracker
+        self.executor = executor
+        self.interval = interval
+        self.history_batch = history_batch
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+
+    def watch(self, prompt_id, callback, deadline=None):
+        """Registers callback for prompt_id; returns False if already watched."""
+        with self._lock:
+            if prompt_id in self._watches:
+                return False
+            self._watches[prompt_id] = (callback, deadline)
+        self._wakeup.set()
+        self.tracker.notify()
+        return True
+
+    def unwatch(self, prompt_id):
+        with self._lock:
+            return self._watches.pop(prompt_id, None) is not None
+
+    def watched(self):
+        with self._lock:
+            return list(self._watches)
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup.set()
+        self.tracker.notify()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._wakeup.clear()
+            try:
+                self._poll()
+            except Exception as e:
+                logger.error(f"Status cycle failed for {self.server}: {e}")
+            self.tracker.wait(self.watched(), self.interval, wake=self._wakeup.is_set)
+
+    def _dispatch(self, prompt_id, status, result):
+        with self._lock:
+            entry = self._watches.pop(prompt_id, None)
+        if entry is None:
+            return
+        if status != "TIMEOUT":
+            self.tracker.reconcile(prompt_id, status, result)
+        callback = entry[0]
+
+        def run_callback():
+            try:
+                callback(prompt_id, status, result)
+            except Exception as e:
+                logger.error(f"Status callback for {prompt_id} failed: {e}")
+
+        self.executor.submit(run_callback)
+
+    def _poll(self):
+        with self._lock:
+            watches = dict(self._watches)
+        if not watches:
+            return
+        now = time.time()
+        unresolved = []
+        for prompt_id, (callback, deadline) in watches.items():
+            tracked = self.tracker.lookup(prompt_id)
+            if tracked is not None and tracked[0] in TERMINAL_STATUSES:
+                self._dispatch(prompt_id, *tracked)
+            elif deadline is not None and now > deadline:
+                self._dispatch(prompt_id, "TIMEOUT", None)
+            elif tracked is None:
+                unresolved.append(prompt_id)
+        if unresolved:
+            self._reconcile_over_http(unresolved)
+
+    def _reconcile_over_http(self, prompt_ids):
+        queue_data = self.client.get_queue(self.server)
+        if queue_data is None:
+            # Server unreachable: keep everything pending until the next cycle
+            return
+        in_queue = {}
+        for key, status in (('queue_running', "RUNNING"), ('queue_pending', "PENDING")):
+            for task in queue_data.get(key, []):
+                if len(task) > 1:
+                    in_queue[task[1]] = status
+        missing = []
+        for prompt_id in prompt_ids:
+            if prompt_id in in_queue:
+                self.tracker.reconcile(prompt_id, in_queue[prompt_id], None)
+            else:
+                missing.append(prompt_id)
+        if not missing:
+            return
+        # History is read after the queue, so a prompt that left the queue in
+        # between is already recorded there.
+        history = self.client.get_recent_history(self.history_batch, self.server) or {}
+        for prompt_id in missing:
+            entry = history.get(prompt_id)
+            if entry is None:
+                single = self.client.get_history(prompt_id, self.server)
+                if single is None:
+                    continue
+                entry = single.get(prompt_id)
+                if entry is None:
+                    self._dispatch(prompt_id, "FAILED", "Task not found")
+                    continue
+            self._dispatch(prompt_id, *select_output(entry.get('outputs', {})))
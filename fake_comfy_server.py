@@ -0,0 +1,490 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import random
+import struct
+import threading
+import time
+import uuid
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import workflow_utils
+
+# Execution time (mean, stddev) in seconds per workflow, keyed by a node class
+# that identifies it (used in: FakeComfyServer._exec_seconds)
+EXEC_TIMES = {
+    "WanAnimateToVideo": (2.0, 0.5),
+    "WanVaceToVideo": (2.0, 0.5),
+    "WanImageToVideo": (1.5, 0.3),
+    "WanFirstLastFrameToVideo": (1.0, 0.2),
+    "HeyGemRun": (1.0, 0.2),
+    "easy indexTTSGenerateSimple": (0.5, 0.1),
+}
+DEFAULT_EXEC_TIME = (0.2, 0.05)  # workflows matching no EXEC_TIMES class
+OUTPUT_BYTES = 64 * 1024  # size of each synthetic mp4 output
+AUDIO_OUTPUT_CLASSES = ("SaveAudio", "SaveAudioMP3", "PreviewAudio")  # workflows with these return a wav
+OUTPUT_CLASSES = ("SaveVideo", "VHS_VideoCombine") + AUDIO_OUTPUT_CLASSES  # node the output is reported under
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def synthetic_mp4(size=OUTPUT_BYTES):
+    """An ftyp box followed by an mdat of zeros: right magic, not decodable."""
+    ftyp = struct.pack(">I4s4sI", 24, b"ftyp", b"isom", 512) + b"isomiso2"
+    body = max(0, size - len(ftyp) - 8)
+    return ftyp + struct.pack(">I4s", body + 8, b"mdat") + bytes(body)
+
+
+def synthetic_wav(seconds=0.1, rate=16000):
+    """A short mono 16-bit silent wav."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(bytes(int(seconds * rate) * 2))
+    return buffer.getvalue()
+
+
+def template_object_info():
+    """
+    /object_info listing every node class used by the registered workflow
+    templates, with no combo inputs: the capability check accepts them all.
+    """
+    classes = {"LoadImage", "LoadAudio", "LoadVideo"}
+    for name in workflow_utils.registry.names():
+        try:
+            workflow = workflow_utils.registry.get(name).instance()
+        except FileNotFoundError:
+            continue
+        classes.update(node["class_type"] for node in workflow.values() if isinstance(node, dict) and "class_type" in node)
+    return {class_type: {"input": {"required": {}}, "output_node": class_type in OUTPUT_CLASSES} for class_type in classes}
+
+
+class _WebSocket:
+    """Server side of one /ws connection: unmasked frames out, ping/close in."""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def send(self, payload, opcode=0x1):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        length = len(payload)
+        if length < 126:
+            header = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        with self._lock:
+            if self.closed:
+                return False
+            try:
+                self.wfile.write(header + payload)
+                self.wfile.flush()
+                return True
+            except OSError:
+                self.closed = True
+                return False
+
+    def send_json(self, message):
+        return self.send(json.dumps(message))
+
+    def _read_exact(self, n):
+        data = self.rfile.read(n)
+        if len(data) < n:
+            raise ConnectionError("WebSocket closed")
+        return data
+
+    def serve(self):
+        """Reads client frames until close; answers pings."""
+        try:
+            while not self.closed:
+                first, second = self._read_exact(2)
+                opcode = first & 0x0F
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack(">H", self._read_exact(2))[0]
+                elif length == 127:
+                    length = struct.unpack(">Q", self._read_exact(8))[0]
+                mask = self._read_exact(4) if second & 0x80 else None
+                payload = self._read_exact(length)
+                if mask:
+                    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+                if opcode == 0x8:
+                    self.send(payload[:2], opcode=0x8)
+                    break
+                if opcode == 0x9:
+                    self.send(payload, opcode=0xA)
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            self.closed = True
+
+
+class FakeComfyServer:
+    """
+    In-process stand-in for a ComfyUI server, for tests and load benchmarks.
+
+    Implements /prompt, /queue, /history[/{id}], /upload/image, /view (with
+    Range), /object_info, /interrupt, /system_stats and the /ws event
+    channel. workers prompts run at once; each "runs" for a time drawn from
+    exec_times (mean, stddev per identifying node class, scaled by
+    time_scale) and returns a small synthetic mp4, or a wav for audio
+    workflows. Failure injection: reject_rate answers /prompt with a 400
+    node error, failure_rate ends a prompt with execution_error and
+    hang_rate makes it run until interrupted.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, workers=1, exec_times=None, default_exec_time=DEFAULT_EXEC_TIME,
+                 time_scale=1.0, failure_rate=0.0, reject_rate=0.0, hang_rate=0.0, output_bytes=OUTPUT_BYTES,
+                 object_info=None, seed=None):
+        self.workers = workers
+        self.exec_times = dict(EXEC_TIMES if exec_times is None else exec_times)
+        self.default_exec_time = default_exec_time
+        self.time_scale = time_scale
+        self.failure_rate = failure_rate
+        self.reject_rate = reject_rate
+        self.hang_rate = hang_rate
+        self.output_bytes = output_bytes
+        self.object_info = object_info if object_info is not None else template_object_info()
+        self._random = random.Random(seed)
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._number = 0
+        self._pending = []  # prompt ids, oldest first
+        self._running = {}  # prompt_id -> interrupt Event
+        self._prompts = {}  # prompt_id -> (number, prompt, client_id)
+        self._history = {}  # prompt_id -> history entry, insertion ordered
+        self._files = {}  # (type, subfolder, filename) -> bytes
+        self._sockets = {}  # client_id -> [_WebSocket]
+        self.stats = {"queued": 0, "rejected": 0, "succeeded": 0, "failed": 0, "interrupted": 0, "uploads": 0, "views": 0}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._threads = []
+
+    @property
+    def address(self):
+        host, port = self._httpd.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name=f"fake-comfy-{self.address}")
+        thread.start()
+        self._threads.append(thread)
+        for n in range(self.workers):
+            worker = threading.Thread(target=self._work, daemon=True, name=f"fake-comfy-worker-{n}")
+            worker.start()
+            self._threads.append(worker)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        with self._cond:
+            for interrupt in self._running.values():
+                interrupt.set()
+            self._cond.notify_all()
+            sockets = [ws for group in self._sockets.values() for ws in group]
+        for ws in sockets:
+            ws.closed = True
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    # --- execution ---------------------------------------------------------
+
+    def _exec_seconds(self, prompt):
+        classes = {node.get("class_type") for node in prompt.values() if isinstance(node, dict)}
+        mean, stddev = next((t for c, t in self.exec_times.items() if c in classes), self.default_exec_time)
+        with self._cond:
+            return max(0.0, self._random.gauss(mean, stddev)) * self.time_scale
+
+    def _roll(self, rate):
+        with self._cond:
+            return self._random.random() < rate
+
+    def _broadcast_status(self):
+        message = {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": len(self._pending) + len(self._running)}}}}
+        for group in list(self._sockets.values()):
+            for ws in list(group):
+                ws.send_json(message)
+
+    def _emit(self, client_id, msg_type, data):
+        for ws in list(self._sockets.get(client_id, ())):
+            ws.send_json({"type": msg_type, "data": data})
+
+    def _output_for(self, prompt):
+        output_node, audio = "15", False
+        for node_id, node in prompt.items():
+            if isinstance(node, dict) and node.get("class_type") in OUTPUT_CLASSES:
+                output_node, audio = node_id, node["class_type"] in AUDIO_OUTPUT_CLASSES
+                break
+        with self._cond:
+            self._number += 1
+            counter = self._number
+        if audio:
+            filename, data, key = f"ComfyUI_{counter:05d}_.wav", synthetic_wav(), "audio"
+        else:
+            filename, data, key = f"ComfyUI_{counter:05d}_.mp4", synthetic_mp4(self.output_bytes), "videos"
+        self._files[("output", "", filename)] = data
+        return output_node, {key: [{"filename": filename, "subfolder": "", "type": "output"}]}
+
+    def _work(self):
+        while not self._stopped.is_set():
+            with self._cond:
+                while not self._pending and not self._stopped.is_set():
+                    self._cond.wait()
+                if self._stopped.is_set():
+                    return
+                prompt_id = self._pending.pop(0)
+                interrupt = self._running[prompt_id] = threading.Event()
+                number, prompt, client_id = self._prompts[prompt_id]
+            self._emit(client_id, "execution_start", {"prompt_id": prompt_id})
+            first_node = next(iter(prompt), None)
+            self._emit(client_id, "executing", {"node": first_node, "prompt_id": prompt_id})
+
+            hang = self._roll(self.hang_rate)
+            interrupted = interrupt.wait(None if hang else self._exec_seconds(prompt))
+            status = {"status_str": "success", "completed": True, "messages": []}
+            outputs = {}
+            if interrupted:
+                self.stats["interrupted"] += 1
+                status = {"status_str": "error", "completed": False, "messages": [["execution_interrupted", {}]]}
+                self._emit(client_id, "execution_interrupted", {"prompt_id": prompt_id})
+            elif self._roll(self.failure_rate):
+                self.stats["failed"] += 1
+                status = {"status_str": "error", "completed": False, "messages": [["execution_error", {}]]}
+                self._emit(client_id, "execution_error", {"prompt_id": prompt_id, "exception_message": "Injected failure"})
+            else:
+                self.stats["succeeded"] += 1
+                node_id, output = self._output_for(prompt)
+                outputs[node_id] = output
+                self._emit(client_id, "executed", {"node": node_id, "output": output, "prompt_id": prompt_id})
+                self._emit(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+                self._emit(client_id, "execution_success", {"prompt_id": prompt_id})
+            with self._cond:
+                self._running.pop(prompt_id, None)
+                self._history[prompt_id] = {
+                    "prompt": [number, prompt_id, prompt, {}, list(outputs)],
+                    "outputs": outputs,
+                    "status": status,
+                }
+                self._broadcast_status()
+
+    # --- HTTP --------------------------------------------------------------
+
+    def _queue_entry(self, prompt_id):
+        number, prompt, _ = self._prompts[prompt_id]
+        return [number, prompt_id, prompt, {}, []]
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, body, status=200, content_type="application/json", headers=None):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+
+            def _json_body(self):
+                body = self._body()
+                return json.loads(body) if body else {}
+
+            def do_HEAD(self):
+                self.do_GET()
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if url.path == "/ws":
+                    return self._websocket(query.get("clientId") or uuid.uuid4().hex)
+                if url.path == "/system_stats":
+                    return self._send({"system": {"os": "fake", "comfyui_version": "fake"}, "devices": [{"name": "fake", "type": "cpu"}]})
+                if url.path == "/object_info":
+                    return self._send(fake.object_info)
+                if url.path.startswith("/object_info/"):
+                    node_class = url.path.split("/", 2)[2]
+                    return self._send({node_class: fake.object_info[node_class]} if node_class in fake.object_info else {})
+                if url.path == "/queue":
+                    with fake._cond:
+                        return self._send({
+                            "queue_running": [fake._queue_entry(p) for p in fake._running],
+                            "queue_pending": [fake._queue_entry(p) for p in fake._pending],
+                        })
+                if url.path.startswith("/history/"):
+                    prompt_id = url.path.split("/", 2)[2]
+                    with fake._cond:
+                        entry = fake._history.get(prompt_id)
+                    return self._send({prompt_id: entry} if entry else {})
+                if url.path == "/history":
+                    with fake._cond:
+                        items = list(fake._history.items())
+                    max_items = int(query.get("max_items", len(items)) or len(items))
+                    return self._send(dict(items[-max_items:] if max_items else []))
+                if url.path == "/view":
+                    return self._view(query)
+                self._send({"error": "not found"}, status=404)
+
+            def _view(self, query):
+                key = (query.get("type", "output"), query.get("subfolder", ""), query.get("filename", ""))
+                data = fake._files.get(key)
+                if data is None:
+                    return self._send(b"", status=404, content_type="text/plain")
+                fake.stats["views"] += 1
+                content_type = "audio/wav" if key[2].endswith(".wav") else "video/mp4"
+                range_header = self.headers.get("Range", "")
+                if range_header.startswith("bytes="):
+                    start = int(range_header[6:].split("-", 1)[0] or 0)
+                    if start >= len(data):
+                        return self._send(b"", status=416, content_type=content_type,
+                                          headers={"Content-Range": f"bytes */{len(data)}"})
+                    return self._send(data[start:], status=206, content_type=content_type,
+                                      headers={"Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}"})
+                self._send(data, content_type=content_type)
+
+            def _websocket(self, client_id):
+                key = self.headers.get("Sec-WebSocket-Key", "")
+                accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+                self.send_response(101, "Switching Protocols")
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.end_headers()
+                self.wfile.flush()
+                ws = _WebSocket(self.rfile, self.wfile)
+                with fake._cond:
+                    fake._sockets.setdefault(client_id, []).append(ws)
+                    queue_remaining = len(fake._pending) + len(fake._running)
+                ws.send_json({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": queue_remaining}}, "sid": client_id}})
+                try:
+                    ws.serve()
+                finally:
+                    with fake._cond:
+                        group = fake._sockets.get(client_id, [])
+                        if ws in group:
+                            group.remove(ws)
+                    self.close_connection = True
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path == "/prompt":
+                    return self._queue_prompt(self._json_body())
+                if url.path == "/upload/image":
+                    return self._upload()
+                if url.path == "/queue":
+                    data = self._json_body()
+                    with fake._cond:
+                        if data.get("clear"):
+                            fake._pending.clear()
+                        for prompt_id in data.get("delete", []):
+                            if prompt_id in fake._pending:
+                                fake._pending.remove(prompt_id)
+                    return self._send({})
+                if url.path == "/interrupt":
+                    body = self._body()
+                    target = json.loads(body).get("prompt_id") if body.strip() else None
+                    with fake._cond:
+                        for prompt_id, interrupt in fake._running.items():
+                            if target in (None, prompt_id):
+                                interrupt.set()
+                    return self._send({})
+                self._send({"error": "not found"}, status=404)
+
+            def _queue_prompt(self, data):
+                prompt = data.get("prompt")
+                if not isinstance(prompt, dict):
+                    return self._send({"error": {"type": "invalid_prompt", "message": "No prompt"}, "node_errors": {}}, status=400)
+                if fake._roll(fake.reject_rate):
+                    fake.stats["rejected"] += 1
+                    return self._send({
+                        "error": {"type": "prompt_outputs_failed_validation", "message": "Injected rejection"},
+                        "node_errors": {"1": {"errors": [{"type": "injected", "message": "Injected rejection"}], "class_type": "Fake"}},
+                    }, status=400)
+                prompt_id = str(uuid.uuid4())
+                with fake._cond:
+                    fake._number += 1
+                    fake._prompts[prompt_id] = (fake._number, prompt, data.get("client_id"))
+                    fake._pending.append(prompt_id)
+                    fake.stats["queued"] += 1
+                    number = fake._number
+                    fake._broadcast_status()
+                    fake._cond.notify()
+                self._send({"prompt_id": prompt_id, "number": number, "node_errors": {}})
+
+            def _upload(self):
+                content_type = self.headers.get("Content-Type", "")
+                boundary = content_type.split("boundary=", 1)[-1].strip('"').encode()
+                fields, files = {}, {}
+                for part in self._body().split(b"--" + boundary):
+                    head, _, data = part.partition(b"\r\n\r\n")
+                    if not data:
+                        continue
+                    data = data[:-2] if data.endswith(b"\r\n") else data
+                    disposition = head.decode("utf-8", "replace")
+                    name = disposition.split('name="', 1)[-1].split('"', 1)[0]
+                    if 'filename="' in disposition:
+                        files[name] = (disposition.split('filename="', 1)[1].split('"', 1)[0], data)
+                    else:
+                        fields[name] = data.decode("utf-8", "replace")
+                if "image" not in files:
+                    return self._send({"error": "no image"}, status=400)
+                filename, data = files["image"]
+                filename = os.path.basename(filename) or "upload.bin"
+                subfolder = fields.get("subfolder", "")
+                with fake._cond:
+                    if fields.get("overwrite") != "true":
+                        stem, ext = os.path.splitext(filename)
+                        n = 1
+                        while ("input", subfolder, filename) in fake._files and fake._files[("input", subfolder, filename)] != data:
+                            filename = f"{stem} ({n}){ext}"
+                            n += 1
+                    fake._files[("input", subfolder, filename)] = data
+                    fake.stats["uploads"] += 1
+                self._send({"name": filename, "subfolder": subfolder, "type": "input"})
+
+        return Handler
+
+
+if __name__ == "__main__":
+    server = FakeComfyServer(
+        host=os.environ.get("FAKE_COMFY_HOST", "127.0.0.1"),
+        port=int(os.environ.get("FAKE_COMFY_PORT", "8188")),
+        workers=int(os.environ.get("FAKE_COMFY_WORKERS", "1")),
+        time_scale=float(os.environ.get("FAKE_COMFY_TIME_SCALE", "1")),
+        failure_rate=float(os.environ.get("FAKE_COMFY_FAILURE_RATE", "0")),
+    ).start()
+    print(f"Fake ComfyUI listening on http://{server.address}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
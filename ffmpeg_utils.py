@@ -104,6 +104,23 @@ def cut_video(input_path, output_path, start_time, end_time):
         ]
         run_command(cmd)
 
+def cut_and_resize_video(input_path, output_path, start_time, end_time, max_size=800, fps=20):
+    """Cut a segment and resize it (like resize_video) in one ffmpeg pass."""
+    scale_filter = f"scale='if(gt(iw,ih),{max_size},-2)':'if(gt(iw,ih),-2,{max_size})'"
+    cmd = [
+        'ffmpeg', '-y',
+        '-ss', str(start_time),
+        '-i', input_path,
+        '-t', str(end_time - start_time),
+        '-vf', scale_filter,
+        '-c:v', 'libx264',
+        '-pix_fmt', 'yuv420p',
+        '-r', str(fps),
+        '-c:a', 'aac',
+        output_path
+    ]
+    run_command(cmd)
+
 def image_to_video(image_path, output_path, duration, fps=20, width=None, height=None):
     """Create a video from a single image."""
     if width is not None and height is not None:
@@ -0,0 +1,303 @@
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Worker threads per work class (used in: JobExecutor, app.JOB_EXECUTOR)
+JOB_POOLS = {
+    "ffmpeg": max(1, (os.cpu_count() or 2) // 2),  # cutting, resizing, concatenating: bound by cores
+    "io": 8,  # downloads, uploads, OBS and ComfyUI requests
+    "llm": 4,  # prompt extraction and video analysis calls
+    "monitor": 32,  # periodic checks on running groups (see JobExecutor.schedule)
+}
+# Lower runs first; equal priorities run in submission order (used in: JobExecutor.submit)
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+# Admission control for GPU-bound submissions (used in: AdmissionQueue, app.ADMISSION)
+ADMISSION_MAX_BACKLOG_SECONDS = int(os.environ.get("ADMISSION_MAX_BACKLOG_SECONDS", 4 * 60 * 60))  # estimated fleet backlog new work may push it to
+ADMISSION_HOLD_LIMIT = int(os.environ.get("ADMISSION_HOLD_LIMIT", 50))  # jobs held locally past the limit; 0 answers 429 at once
+
+
+class _Pool:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.cond = threading.Condition()
+        self.heap = []  # (priority, seq, queued_at, future, func, args, kwargs)
+        self.threads = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+
+
+class JobExecutor:
+    """
+    Central executor for background work, one bounded pool per work class.
+
+    Each class (JOB_POOLS: {name: workers}) has a priority queue and at most
+    `workers` threads, started on first use; submit() never spawns beyond
+    that, so a burst of requests queues instead of running hundreds of
+    ffmpeg processes at once. Jobs return a concurrent.futures.Future;
+    exceptions are logged and set on it. stats() reports queue depth and
+    running count per class. Work that waits for hours is not parked on a
+    worker: schedule() re-queues a short check every interval instead.
+    """
+
+    def __init__(self, pools=None):
+        self._pools = {name: _Pool(name, workers) for name, workers in (pools or JOB_POOLS).items()}
+        self._seq = itertools.count()
+        self._local = threading.local()  # .pool: name of the pool the current worker thread serves
+        self._timer_cond = threading.Condition()
+        self._timers = []  # (due, seq, work_class, interval, func, args, priority)
+        self._timer_thread = None
+
+    def submit(self, work_class, func, *args, priority=PRIORITY_NORMAL, **kwargs):
+        """Queues func(*args, **kwargs) on work_class's pool; returns a Future."""
+        pool = self._pools.get(work_class)
+        if pool is None:
+            raise ValueError(f"Unknown work class: {work_class}")
+        future = Future()
+        with pool.cond:
+            heapq.heappush(pool.heap, (priority, next(self._seq), time.time(), future, func, args, kwargs))
+            if len(pool.threads) < pool.workers and len(pool.threads) < pool.running + len(pool.heap):
+                thread = threading.Thread(
+                    target=self._work, args=(pool,), daemon=True, name=f"job-{pool.name}-{len(pool.threads)}"
+                )
+                pool.threads.append(thread)
+                thread.start()
+            pool.cond.notify()
+        return future
+
+    def call(self, work_class, func, *args, **kwargs):
+        """
+        Runs func on work_class's pool and waits for its result, so a caller
+        on another pool holds only a slot of that class while it waits. Runs
+        inline when already on that pool: waiting there could take every
+        worker.
+        """
+        if self.on_pool(work_class):
+            return func(*args, **kwargs)
+        return self.submit(work_class, func, *args, **kwargs).result()
+
+    def on_pool(self, work_class):
+        """Whether the calling thread is a worker of work_class's pool."""
+        return getattr(self._local, "pool", None) == work_class
+
+    def schedule(self, work_class, interval, func, *args, priority=PRIORITY_NORMAL):
+        """
+        Runs func(*args) on work_class's pool every interval seconds, first
+        after one interval, until it returns a false value. Each run is a
+        short job, and a single timer thread does the waiting in between, so
+        any number of periodic checks share the pool instead of each parking
+        a worker in a sleep loop. A run that raises is logged and retried at
+        the next interval.
+        """
+        if work_class not in self._pools:
+            raise ValueError(f"Unknown work class: {work_class}")
+        self._arm((work_class, interval, func, args, priority))
+
+    def _arm(self, spec):
+        with self._timer_cond:
+            heapq.heappush(self._timers, (time.time() + spec[1], next(self._seq)) + spec)
+            if self._timer_thread is None:
+                self._timer_thread = threading.Thread(target=self._run_timers, daemon=True, name="job-timer")
+                self._timer_thread.start()
+            self._timer_cond.notify()
+
+    def _run_timers(self):
+        while True:
+            with self._timer_cond:
+                while not self._timers or self._timers[0][0] > time.time():
+                    self._timer_cond.wait(self._timers[0][0] - time.time() if self._timers else None)
+                spec = heapq.heappop(self._timers)[2:]
+            work_class, _, func, args, priority = spec
+            future = self.submit(work_class, func, *args, priority=priority)
+            future.add_done_callback(lambda f, spec=spec: self._rearm(f, spec))
+
+    def _rearm(self, future, spec):
+        # A run that raised was logged by _work; keep checking
+        if future.exception() is not None or future.result():
+            self._arm(spec)
+
+    def scheduled(self):
+        """Number of periodic checks waiting for their next run."""
+        with self._timer_cond:
+            return len(self._timers)
+
+    def _work(self, pool):
+        self._local.pool = pool.name
+        while True:
+            with pool.cond:
+                while not pool.heap:
+                    pool.cond.wait()
+                _, _, queued_at, future, func, args, kwargs = heapq.heappop(pool.heap)
+                pool.running += 1
+                pool.wait_seconds += time.time() - queued_at
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(func(*args, **kwargs))
+                ok = True
+            except Exception as e:
+                logger.exception(f"{pool.name} job {getattr(func, '__name__', func)} failed")
+                future.set_exception(e)
+                ok = False
+            with pool.cond:
+                pool.running -= 1
+                if ok:
+                    pool.completed += 1
+                else:
+                    pool.failed += 1
+
+    def queue_depth(self, work_class):
+        pool = self._pools[work_class]
+        with pool.cond:
+            return len(pool.heap)
+
+    def stats(self):
+        result = {}
+        for name, pool in self._pools.items():
+            with pool.cond:
+                started = pool.completed + pool.failed + pool.running
+                result[name] = {
+                    "workers": pool.workers,
+                    "threads": len(pool.threads),
+                    "queued": len(pool.heap),
+                    "running": pool.running,
+                    "completed": pool.completed,
+                    "failed": pool.failed,
+                    "avg_wait_seconds": round(pool.wait_seconds / started, 3) if started else 0.0,
+                }
+        return result
+
+
+class AdmissionQueue:
+    """
+    Admission control in front of a JobExecutor for work that ends in the
+    GPU queues.
+
+    backlog() estimates the seconds of GPU work already outstanding. A job
+    whose estimated cost still fits under max_backlog (or that finds the
+    fleet idle) is submitted at once. Otherwise it is held here in FIFO
+    order, up to hold_limit jobs, and poll() submits held jobs as the
+    backlog drains; past that the caller answers 429. Admitted jobs count
+    toward the backlog until their Future finishes, which covers the gap
+    before their prompts reach ComfyUI.
+    """
+
+    ADMITTED = "admitted"
+    HELD = "held"
+    REJECTED = "rejected"
+
+    def __init__(self, executor, backlog, max_backlog=ADMISSION_MAX_BACKLOG_SECONDS, hold_limit=ADMISSION_HOLD_LIMIT):
+        self.executor = executor
+        self.backlog = backlog
+        self.max_backlog = max_backlog
+        self.hold_limit = hold_limit
+        self._lock = threading.Lock()
+        self._held = OrderedDict()  # key -> (cost, work_class, func, args)
+        self._inflight = {}  # key -> cost of admitted jobs still submitting
+        self.stats = {"admitted": 0, "held": 0, "rejected": 0, "released": 0}
+
+    def _load(self):
+        # Callers hold self._lock; backlog() must not call back into this queue
+        return self.backlog() + sum(self._inflight.values())
+
+    def _fits(self, load, cost):
+        return load == 0 or load + cost <= self.max_backlog
+
+    def _submit(self, key, work_class, func, args):
+        # Called without self._lock: a job that finishes at once runs _done here
+        future = self.executor.submit(work_class, func, *args)
+        future.add_done_callback(lambda _: self._done(key))
+        return future
+
+    def _done(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+        self.poll()
+
+    def retry_after(self, cost=0):
+        """Seconds a client should wait if a job of cost would be rejected now, else None."""
+        with self._lock:
+            load = self._load()
+            if self._fits(load, cost) and not self._held:
+                return None
+            if len(self._held) < self.hold_limit:
+                return None
+            ahead = sum(entry[0] for entry in self._held.values())
+            return max(1, math.ceil(load + ahead + cost - self.max_backlog))
+
+    def offer(self, key, cost, work_class, func, *args):
+        """
+        Admits, holds or rejects func(*args). Returns (outcome, info): info is
+        the Future when admitted, {'position', 'eta_seconds'} when held and
+        {'retry_after'} when rejected.
+        """
+        with self._lock:
+            load = self._load()
+            # Nothing overtakes a held job
+            admitted = not self._held and self._fits(load, cost)
+            if admitted:
+                self.stats["admitted"] += 1
+                self._inflight[key] = cost
+            elif len(self._held) >= self.hold_limit:
+                self.stats["rejected"] += 1
+                ahead = sum(entry[0] for entry in self._held.values())
+                return self.REJECTED, {"retry_after": max(1, math.ceil(load + ahead + cost - self.max_backlog))}
+            else:
+                self._held[key] = (cost, work_class, func, args)
+                self.stats["held"] += 1
+        if admitted:
+            return self.ADMITTED, self._submit(key, work_class, func, args)
+        return self.HELD, self.position(key)
+
+    def position(self, key):
+        """
+        {'position': 1-based place in the hold queue, 'eta_seconds': estimated
+        wait before the job is submitted}, or None if key is not held.
+        """
+        with self._lock:
+            if key not in self._held:
+                return None
+            load = self._load()
+            ahead = 0
+            for position, (held_key, entry) in enumerate(self._held.items(), start=1):
+                ahead += entry[0]
+                if held_key == key:
+                    return {"position": position, "eta_seconds": max(0, math.ceil(load + ahead - self.max_backlog))}
+
+    def poll(self):
+        """Submits held jobs, oldest first, while they fit; returns their keys."""
+        released = []
+        with self._lock:
+            while self._held:
+                key, (cost, work_class, func, args) = next(iter(self._held.items()))
+                if not self._fits(self._load(), cost):
+                    break
+                del self._held[key]
+                self._inflight[key] = cost
+                self.stats["released"] += 1
+                released.append((key, work_class, func, args))
+        for key, work_class, func, args in released:
+            self._submit(key, work_class, func, args)
+        return [key for key, _, _, _ in released]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "backlog_seconds": round(self._load(), 1),
+                "max_backlog_seconds": self.max_backlog,
+                "held": len(self._held),
+                "hold_limit": self.hold_limit,
+                "inflight": len(self._inflight),
+                **self.stats,
+            }
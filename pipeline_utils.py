@@ -0,0 +1,115 @@
+import threading
+from collections import deque
+
+# Items buffered between two pipeline stages (used in: Pipeline)
+PIPELINE_QUEUE_SIZE = 4
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages so the stages overlap: item 0 can
+    be in the last stage while item 5 is still in the first. Each stage is
+    (name, func, workers, work_class); func(item) runs as a job on the
+    executor's work_class pool, at most `workers` at a time per pipeline,
+    and returns the item for the next stage, or None to drop it. No threads
+    are started per pipeline, so the pool sizes bound every pipeline
+    together; a stage on the pool run() is already on runs inline instead
+    (see JobExecutor.call). At most queue_size items wait in front of a
+    stage. The first exception stops the pipeline: waiting items are not
+    processed, outputs an earlier stage already produced are kept in
+    `dropped` as (stage name, item) for the caller to clean up, and run()
+    re-raises it once every running job has finished.
+    """
+
+    def __init__(self, stages, executor, queue_size=PIPELINE_QUEUE_SIZE):
+        self.stages = list(stages)
+        self.executor = executor
+        self.queue_size = queue_size
+        self.stopped = threading.Event()
+        self.dropped = []
+        self._error = None
+        self._cond = threading.Condition()  # reentrant: a done callback may run inside submit
+
+    def _fail(self, error):
+        with self._cond:
+            if self._error is None:
+                self._error = error
+            self.stopped.set()
+            self._cond.notify()
+
+    def _finish(self, index, output, error, waiting, running, results):
+        with self._cond:
+            running[index] -= 1
+            if error is not None:
+                self._fail(error)
+            elif output is not None:
+                if index + 1 == len(self.stages):
+                    results.append(output)
+                else:
+                    waiting[index + 1].append(output)
+            self._cond.notify()
+
+    def _on_done(self, index, future, waiting, running, results):
+        error = future.exception()
+        self._finish(index, None if error else future.result(), error, waiting, running, results)
+
+    def _ready(self, index, waiting, running):
+        _, _, workers, _ = self.stages[index]
+        last = index + 1 == len(self.stages)
+        return waiting[index] and running[index] < workers and (last or len(waiting[index + 1]) < self.queue_size)
+
+    def _dispatch(self, items, waiting, running, results):
+        """Starts every pool job that may start; returns one (index, item) to run inline, if any."""
+        while items is not None and len(waiting[0]) < max(1, self.queue_size):
+            try:
+                waiting[0].append(next(items))
+            except StopIteration:
+                items = None
+        for index, (_, func, _, work_class) in enumerate(self.stages):
+            if self.executor.on_pool(work_class):
+                continue
+            while self._ready(index, waiting, running):
+                running[index] += 1
+                future = self.executor.submit(work_class, func, waiting[index].popleft())
+                future.add_done_callback(
+                    lambda f, index=index: self._on_done(index, f, waiting, running, results)
+                )
+        # Later stages first, so finished work drains before new work starts
+        for index in reversed(range(len(self.stages))):
+            if self.executor.on_pool(self.stages[index][3]) and self._ready(index, waiting, running):
+                running[index] += 1
+                return items, (index, waiting[index].popleft())
+        return items, None
+
+    def run(self, items):
+        """Feeds items through every stage; returns the last stage's outputs."""
+        if not self.stages:
+            return list(items)
+        items = iter(items)
+        waiting = [deque() for _ in self.stages]
+        running = [0] * len(self.stages)
+        results = []
+        while True:
+            with self._cond:
+                inline = None
+                if not self.stopped.is_set():
+                    try:
+                        items, inline = self._dispatch(items, waiting, running, results)
+                    except Exception as e:
+                        self._fail(e)
+                if inline is None:
+                    idle = not any(running)
+                    if idle and (self.stopped.is_set() or (items is None and not any(waiting))):
+                        break
+                    self._cond.wait()
+                    continue
+            index, item = inline
+            try:
+                output, error = self.stages[index][1](item), None
+            except Exception as e:
+                output, error = None, e
+            self._finish(index, output, error, waiting, running, results)
+        if self._error is not None:
+            self.dropped = [(self.stages[index][0], item) for index in range(1, len(self.stages)) for item in waiting[index]]
+            raise self._error
+        return results
@@ -0,0 +1,426 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from collections.abc import MutableMapping
+
+logger = logging.getLogger(__name__)
+
+# SQLite snapshot of app.py's task dicts (used in: TaskStore, app.start_task_store)
+TASK_STORE_FILE = os.environ.get(
+    "TASK_STORE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'tasks.db')
+)
+TASK_STORE_FLUSH_SECONDS = 2  # changed records are written together at most this often
+# Bounds on in-memory task records (used in: LogRing, evict_expired, app.evict_expired_tasks)
+TASK_RECORD_TTL_SECONDS = int(os.environ.get("TASK_RECORD_TTL_SECONDS", 24 * 60 * 60))  # finished records are dropped this long after finishing
+TASK_LOG_CAPACITY = int(os.environ.get("TASK_LOG_CAPACITY", 500))  # newest log lines kept per task
+TASK_LOG_LINE_MAX_CHARS = 2000  # longer lines (full LLM prompts) are cut
+FINISHED_STATUSES = ("completed", "failed")
+
+
+class LogRing:
+    """
+    Fixed-capacity task log: keeps the newest `capacity` lines and counts
+    the ones it dropped, so `total` keeps growing like a list's length
+    would. Lines over TASK_LOG_LINE_MAX_CHARS are cut. Serializes to the
+    plain list of kept lines, so a ring rebuilt from it (after a restart)
+    numbers lines differently; it gets a new `epoch`, and a cursor is only
+    meaningful together with the epoch it was read under.
+    """
+
+    __slots__ = ("_lines", "dropped", "epoch")
+
+    def __init__(self, lines=(), capacity=TASK_LOG_CAPACITY, dropped=0):
+        self._lines = deque(maxlen=capacity)
+        self.dropped = dropped
+        self.epoch = uuid.uuid4().hex[:8]
+        self.extend(lines)
+
+    @classmethod
+    def coerce(cls, value):
+        return value if isinstance(value, cls) else cls(value or ())
+
+    def append(self, line):
+        if isinstance(line, str) and len(line) > TASK_LOG_LINE_MAX_CHARS:
+            line = line[:TASK_LOG_LINE_MAX_CHARS] + " …"
+        if len(self._lines) == self._lines.maxlen:
+            self.dropped += 1
+        self._lines.append(line)
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    @property
+    def total(self):
+        """Lines ever appended, kept or dropped."""
+        return self.dropped + len(self._lines)
+
+    def since(self, cursor):
+        """(lines appended at or after position cursor that are still kept, total)."""
+        lines = list(self._lines)
+        dropped = self.dropped
+        return lines[max(0, cursor - dropped):], dropped + len(lines)
+
+    def __iter__(self):
+        return iter(list(self._lines))
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __getitem__(self, index):
+        return list(self._lines)[index]
+
+    def __repr__(self):
+        return f"LogRing({list(self._lines)!r}, dropped={self.dropped})"
+
+    def to_json(self):
+        return list(self._lines)
+
+
+def log_since(logs, cursor):
+    """LogRing.since for a record's logs, which may also be a plain list or missing."""
+    if isinstance(logs, LogRing):
+        return logs.since(cursor)
+    logs = list(logs or ())
+    return logs[max(0, cursor):], len(logs)
+
+
+def log_epoch(logs):
+    """LogRing.epoch for a record's logs; None for a plain list or missing logs."""
+    return logs.epoch if isinstance(logs, LogRing) else None
+
+
+class Record(MutableMapping):
+    """
+    Dict-compatible task record that keeps its known FIELDS in __slots__
+    instead of a per-record hash table; other keys go to a small overflow
+    dict created on first use. An unset field reads as a missing key, so
+    code written against plain dicts (get, setdefault, pop, `in`) behaves
+    the same. COERCE maps a field to a function applied on assignment.
+    Subclasses set `__slots__ = FIELDS = (...)`.
+    """
+
+    __slots__ = ("_extra",)
+    FIELDS = ()
+    COERCE = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls.FIELDS)
+
+    def __init__(self, data=(), **kwargs):
+        self._extra = None
+        self.update(data, **kwargs)
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._field_set:
+            coerce = self.COERCE.get(key)
+            setattr(self, key, coerce(value) if coerce else value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __iter__(self):
+        for name in self.FIELDS:
+            if hasattr(self, name):
+                yield name
+        if self._extra:
+            yield from list(self._extra)
+
+    def __len__(self):
+        return sum(1 for name in self.FIELDS if hasattr(self, name)) + len(self._extra or ())
+
+    def __contains__(self, key):
+        if key in self._field_set:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def setdefault(self, key, default=None):
+        # Returns the stored (possibly coerced) value, not default itself
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def to_json(self):
+        return dict(self)
+
+
+class SegmentRecord(Record):
+    """One ComfyUI prompt of a group (an entry of GroupRecord['tasks'])."""
+
+    __slots__ = FIELDS = ("task_id", "server", "status", "segment_index", "result_path", "error", "job", "attempts", "settled", "counted")
+
+
+def _segments(tasks):
+    return [task if isinstance(task, SegmentRecord) else SegmentRecord(task) for task in tasks]
+
+
+class GroupRecord(Record):
+    """A task group in app.TASKS_STORE."""
+
+    __slots__ = FIELDS = (
+        "status", "tasks", "created_at", "finished_at", "workflow_type", "audio_path", "logs", "final_url", "error",
+        "monitor_started", "finished_task_count", "admission", "transition_videos", "switch_prompt",
+        "completed_count", "failed_count",
+    )
+    COERCE = {"logs": LogRing.coerce, "tasks": _segments}
+
+
+class SectorRecord(Record):
+    """A sector 17/19 task in app.SECTOR_TASKS."""
+
+    __slots__ = FIELDS = ("status", "type", "created_at", "finished_at", "logs", "result", "error")
+    COERCE = {"logs": LogRing.coerce}
+
+
+def json_default(obj):
+    """json.dumps default= for task records and log rings; anything else becomes str."""
+    if isinstance(obj, (Record, LogRing)):
+        return obj.to_json()
+    return str(obj)
+
+
+def _items(mapping):
+    while True:
+        try:
+            return list(mapping.items())
+        except RuntimeError:
+            # Resized by another thread mid-copy; try again
+            continue
+
+
+def evict_expired(mapping, ttl=TASK_RECORD_TTL_SECONDS, now=None, keep=()):
+    """
+    Removes records that finished (status in FINISHED_STATUSES) more than
+    ttl seconds ago, except keys in keep, and returns their keys. The finish
+    time is stamped as finished_at the first time a sweep sees a finished
+    record, and cleared again if the record went back to work.
+    """
+    now = time.time() if now is None else now
+    expired = []
+    for key, record in _items(mapping):
+        if record.get("status") not in FINISHED_STATUSES:
+            record.pop("finished_at", None)
+            continue
+        finished_at = record.get("finished_at")
+        if finished_at is None:
+            record["finished_at"] = now
+        elif now - finished_at >= ttl and key not in keep:
+            mapping.pop(key, None)
+            expired.append(key)
+    return expired
+
+
+def footprint(mapping):
+    """{'records', 'log_lines', 'bytes'} for mapping; bytes is a deep sys.getsizeof estimate."""
+    seen = set()
+    stack = [value for _, value in _items(mapping)]
+    total = log_lines = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        try:
+            if isinstance(obj, LogRing):
+                total += sys.getsizeof(obj._lines)
+                log_lines += len(obj)
+                stack.extend(obj)
+            elif isinstance(obj, Record):
+                if obj._extra is not None:
+                    total += sys.getsizeof(obj._extra)
+                stack.extend(obj.values())
+            elif isinstance(obj, dict):
+                stack.extend(list(obj.keys()) + list(obj.values()))
+            elif isinstance(obj, (list, tuple)):
+                stack.extend(list(obj))
+        except RuntimeError:
+            # Mutated while being walked; the estimate skips the rest of it
+            continue
+    return {"records": len(mapping), "log_lines": log_lines, "bytes": total}
+
+
+class TaskStore:
+    """
+    Persists in-process dicts ({key: JSON-able record}) to SQLite in WAL mode.
+
+    Callers keep mutating the plain dicts they already use; track() hands a
+    dict to the store and a background thread writes every record whose JSON
+    changed since the last flush (and deletes removed keys) in one
+    transaction every flush_seconds. A log line appended on the polling path
+    therefore costs nothing until the next flush, and a crash loses at most
+    that window. restore() fills the dicts back in on startup.
+    """
+
+    def __init__(self, path=TASK_STORE_FILE, flush_seconds=TASK_STORE_FLUSH_SECONDS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._tracked = {}  # kind -> dict
+        self._written = {}  # (kind, key) -> digest of the stored JSON
+        self._stop = threading.Event()
+        self._thread = None
+        self._closed = False
+        self.stats = {"flushes": 0, "rows_written": 0, "rows_deleted": 0, "last_flush_seconds": 0.0}
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: commits survive an app crash, only an OS crash may lose the last one
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " kind TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def _digest(data):
+        return hashlib.blake2b(data.encode("utf-8"), digest_size=16).digest()
+
+    def load(self, kind):
+        """Returns {key: record} as last flushed for kind."""
+        with self._lock:
+            rows = self._db.execute("SELECT key, data FROM records WHERE kind = ?", (kind,)).fetchall()
+        records = {}
+        for key, data in rows:
+            try:
+                records[key] = json.loads(data)
+            except ValueError:
+                logger.warning(f"Skipping unreadable {kind} record {key}")
+                continue
+            self._written[(kind, key)] = self._digest(data)
+        return records
+
+    def track(self, kind, mapping):
+        """Flushes mapping under kind from now on; returns it unchanged."""
+        with self._lock:
+            self._tracked[kind] = mapping
+        return mapping
+
+    def restore(self, kind, mapping, factory=None):
+        """
+        Loads kind's stored records into mapping (stored ones win), built with
+        factory (e.g. GroupRecord) if given, and tracks it.
+        """
+        records = self.load(kind)
+        if factory is not None:
+            records = {key: factory(record) for key, record in records.items()}
+        mapping.update(records)
+        return self.track(kind, mapping)
+
+    def _changes(self, kind, mapping):
+        items = _items(mapping)
+        upserts = []
+        for key, record in items:
+            try:
+                data = json.dumps(record, ensure_ascii=False, sort_keys=True, default=json_default)
+            except (RuntimeError, ValueError) as e:
+                # Mutated while serializing (or cyclic): picked up by the next flush
+                logger.debug(f"Deferring {kind} record {key}: {e}")
+                continue
+            digest = self._digest(data)
+            if self._written.get((kind, str(key))) != digest:
+                upserts.append((str(key), data, digest))
+        live = {str(key) for key, _ in items}
+        deletes = [key for (k, key) in self._written if k == kind and key not in live]
+        return upserts, deletes
+
+    def flush(self):
+        """Writes changed and removed records of every tracked dict in one transaction."""
+        started = time.perf_counter()
+        with self._lock:
+            now = time.time()
+            written = deleted = 0
+            with self._db:
+                for kind, mapping in self._tracked.items():
+                    upserts, deletes = self._changes(kind, mapping)
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO records (kind, key, data, updated_at) VALUES (?, ?, ?, ?)",
+                        [(kind, key, data, now) for key, data, _ in upserts],
+                    )
+                    self._db.executemany("DELETE FROM records WHERE kind = ? AND key = ?", [(kind, key) for key in deletes])
+                    for key, _, digest in upserts:
+                        self._written[(kind, key)] = digest
+                    for key in deletes:
+                        del self._written[(kind, key)]
+                    written += len(upserts)
+                    deleted += len(deletes)
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += written
+            self.stats["rows_deleted"] += deleted
+            self.stats["last_flush_seconds"] = round(time.perf_counter() - started, 4)
+        return written + deleted
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning(f"Task store flush failed: {e}")
+
+    def start(self):
+        """Starts the background flusher; a final flush runs at interpreter exit."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="task-store-flush")
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def close(self):
+        if self._closed:
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_seconds + 5)
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logger.warning(f"Final task store flush failed: {e}")
+        with self._lock:
+            self._closed = True
+            self._db.close()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "records": {kind: len(mapping) for kind, mapping in self._tracked.items()},
+                **self.stats,
+            }
@@ -0,0 +1,136 @@
+import functools
+import json
+import signal
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import comfy_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+def _object_info(unet_models):
+    return {
+        "LoadImage": {"input": {"required": {"image": [["old.png"], {"image_upload": True}]}}},
+        "UNETLoader": {"input": {"required": {"unet_name": [unet_models], "weight_dtype": [["default", "fp8"]]}}},
+        "KSampler": {"input": {"required": {"seed": ["INT", {"default": 0}], "sampler_name": ["COMBO", {"options": ["euler"]}]}}},
+    }
+
+
+def _start_fake_comfy(unet_models):
+    state = {"uploads": [], "prompts": [], "object_info_requests": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/object_info":
+                state["object_info_requests"] += 1
+                self._send_json(_object_info(unet_models))
+            else:
+                self._send_json({"queue_running": [], "queue_pending": []})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path == "/upload/image":
+                name = f"upload-{len(state['uploads'])}.png"
+                state["uploads"].append(name)
+                self._send_json({"name": name, "subfolder": "", "type": "input"})
+            elif self.path == "/prompt":
+                state["prompts"].append(json.loads(body)["prompt"])
+                self._send_json({"prompt_id": str(uuid.uuid4())})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}", state
+
+
+def _workflow(image, unet="wan2.2_animate_14B.safetensors"):
+    return {
+        "1": {"class_type": "LoadImage", "inputs": {"image": image}},
+        "2": {"class_type": "UNETLoader", "inputs": {"unet_name": unet, "weight_dtype": "fp8"}},
+        "3": {"class_type": "KSampler", "inputs": {"seed": 5, "sampler_name": "euler", "model": ["2", 0]}},
+    }
+
+
+@timeout(5)
+def test_problems_checks_nodes_and_models_but_not_uploads():
+    cache = comfy_utils.CapabilityCache(None)
+    assert cache.problems("a:1", _workflow("x.png")) == []  # never fetched: assumed compatible
+    cache._servers["a:1"] = (1.0, cache.parse(_object_info(["wan2.2_animate_14B.safetensors"])))
+
+    assert cache.problems("a:1", _workflow("fresh-upload.png")) == []
+    assert cache.problems("a:1", _workflow("x.png", unet="other.safetensors")) == [
+        "UNETLoader.unet_name 'other.safetensors' not installed"
+    ]
+    workflow = dict(_workflow("x.png"), **{"4": {"class_type": "WanVaceToVideo", "inputs": {}}})
+    assert cache.problems("a:1", workflow) == ["missing node WanVaceToVideo"]
+
+
+@timeout(20)
+def test_scheduler_routes_only_to_servers_with_the_models(tmp_path):
+    lacking_server, lacking, lacking_state = _start_fake_comfy(["wan2.1_vace_14B.safetensors"])
+    capable_server, capable, capable_state = _start_fake_comfy(["wan2.2_animate_14B.safetensors"])
+    image_path = tmp_path / "character.png"
+    image_path.write_bytes(b"png")
+    client = comfy_utils.ComfyUIClient(lacking)
+    scheduler = comfy_utils.ServerScheduler(client, [lacking, capable])
+    try:
+        assert client.capabilities.refresh_stale([lacking, capable]) == {lacking: True, capable: True}
+        assert client.capabilities.refresh_stale([lacking, capable]) == {}  # still fresh
+
+        for _ in range(3):
+            _, server = scheduler.submit(lambda names: _workflow(names["image"]), {"image": str(image_path)})
+            assert server == capable
+        assert lacking_state["uploads"] == [] and lacking_state["prompts"] == []
+
+        # No server has the model: rejected before any upload or prompt
+        try:
+            scheduler.submit(lambda names: _workflow(names["image"], unet="missing.safetensors"), {"image": str(image_path)})
+            assert False, "expected IncompatibleWorkflowError"
+        except comfy_utils.IncompatibleWorkflowError as e:
+            assert set(e.problems) == {lacking, capable}
+        assert len(capable_state["uploads"]) == 1 and len(capable_state["prompts"]) == 3
+
+        # A direct queue_prompt to the lacking server never reaches it
+        try:
+            client.queue_prompt(_workflow("upload-0.png"), server_address=lacking)
+            assert False, "expected IncompatibleWorkflowError"
+        except comfy_utils.IncompatibleWorkflowError:
+            pass
+        assert lacking_state["prompts"] == []
+    finally:
+        client.close_listeners()
+        for s in (lacking_server, capable_server):
+            s.shutdown()
+            s.server_close()
@@ -0,0 +1,196 @@
+import functools
+import os
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import comfy_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+PAYLOAD = bytes(range(256)) * 4096  # 1 MiB
+
+
+def _start_fake_view(drop_first_after=None, delay=0.0):
+    """/view serving PAYLOAD with Range support; optionally cuts the first response short."""
+    state = {"requests": [], "active": 0, "max_active": 0, "lock": threading.Lock()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            range_header = self.headers.get("Range")
+            with state["lock"]:
+                state["requests"].append((query.get("filename", [""])[0], range_header))
+                first = len(state["requests"]) == 1
+                state["active"] += 1
+                state["max_active"] = max(state["max_active"], state["active"])
+            try:
+                time.sleep(delay)
+                start = int(range_header.split("=")[1].rstrip("-")) if range_header else 0
+                body = PAYLOAD[start:]
+                if range_header:
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if first and drop_first_after is not None:
+                    self.wfile.write(body[:drop_first_after])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+            finally:
+                with state["lock"]:
+                    state["active"] -= 1
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}", state
+
+
+@timeout(10)
+def test_download_resumes_with_range_after_drop(tmp_path):
+    server, address, state = _start_fake_view(drop_first_after=300_000)
+    try:
+        client = comfy_utils.ComfyUIClient(address)
+        local_path = client.download_output_file("clip.mp4", "", "output", str(tmp_path))
+        with open(local_path, "rb") as f:
+            assert f.read() == PAYLOAD
+        # Resumed from the last whole chunk written before the drop
+        resumed_at = 300_000 // comfy_utils.DOWNLOAD_CHUNK * comfy_utils.DOWNLOAD_CHUNK
+        assert state["requests"] == [("clip.mp4", None), ("clip.mp4", f"bytes={resumed_at}-")]
+        assert client.downloads.snapshot()["resumed"] == 1
+        assert os.listdir(tmp_path) == [os.path.basename(local_path)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@timeout(10)
+def test_same_output_name_gets_unique_paths(tmp_path):
+    server, address, state = _start_fake_view()
+    try:
+        client = comfy_utils.ComfyUIClient(address)
+        first = client.download_output_file("ComfyUI_00001_.mp4", "", "output", str(tmp_path))
+        second = client.download_output_file("ComfyUI_00001_.mp4", "", "output", str(tmp_path))
+        assert first != second
+        assert os.path.basename(first).startswith("ComfyUI_00001_") and first.endswith(".mp4")
+        assert os.path.getsize(first) == os.path.getsize(second) == len(PAYLOAD)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@timeout(10)
+def test_downloads_run_concurrently_on_bounded_pool(tmp_path):
+    server, address, state = _start_fake_view(delay=0.3)
+    try:
+        client = comfy_utils.ComfyUIClient(address)
+        client.downloads = comfy_utils.DownloadManager(client, workers=3)
+        futures = [
+            client.downloads.submit(f"seg_{i}.mp4", "", "output", str(tmp_path))
+            for i in range(6)
+        ]
+        paths = [f.result() for f in futures]
+        assert len(set(paths)) == 6
+        assert state["max_active"] == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _start_unsized_view():
+    """/view with no Content-Length: the first body breaks off mid-chunk and a Range request gets 416."""
+    state = {"ranges": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            range_header = self.headers.get("Range")
+            state["ranges"].append(range_header)
+            if range_header:
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            if len(state["ranges"]) == 1:
+                # One whole chunk, then a chunk header promising more than is sent
+                self.wfile.write(b"%x\r\n" % 100_000 + PAYLOAD[:100_000] + b"\r\n")
+                self.wfile.write(b"%x\r\n" % 100_000 + PAYLOAD[100_000:150_000])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(b"%x\r\n" % len(PAYLOAD) + PAYLOAD + b"\r\n0\r\n\r\n")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}", state
+
+
+@timeout(10)
+def test_download_without_length_restarts_after_416(tmp_path):
+    server, address, state = _start_unsized_view()
+    try:
+        client = comfy_utils.ComfyUIClient(address)
+        local_path = client.download_output_file("clip.mp4", "", "output", str(tmp_path))
+        with open(local_path, "rb") as f:
+            assert f.read() == PAYLOAD
+        # Resume refused with 416 and no known length: the part is dropped and fetched again from byte 0
+        assert state["ranges"][0] is None and state["ranges"][1].startswith("bytes=") and state["ranges"][2] is None
+        assert os.listdir(tmp_path) == [os.path.basename(local_path)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@timeout(10)
+def test_download_deadline_is_checked_while_streaming(tmp_path, monkeypatch):
+    server, address, state = _start_fake_view()
+    try:
+        monkeypatch.setattr(comfy_utils, "DOWNLOAD_DEADLINE_SECONDS", -1)
+        client = comfy_utils.ComfyUIClient(address)
+        try:
+            client.download_output_file("clip.mp4", "", "output", str(tmp_path))
+        except IOError as e:
+            assert "exceeded" in str(e)
+        else:
+            raise AssertionError("download should have hit the deadline")
+        assert os.listdir(tmp_path) == []
+    finally:
+        server.shutdown()
+        server.server_close()
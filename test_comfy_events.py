@@ -0,0 +1,311 @@
+import base64
+import functools
+import hashlib
+import json
+import signal
+import socket
+import threading
+import time
+
+import comfy_utils
+import completion_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+SERVER = "127.0.0.1:7860"
+VIDEO_OUTPUT = {"videos": [{"filename": "out.mp4", "subfolder": "", "type": "output"}]}
+
+
+def _events(prompt_id):
+    return [
+        {"type": "execution_start", "data": {"prompt_id": prompt_id}},
+        {"type": "executing", "data": {"node": "3", "prompt_id": prompt_id}},
+        {"type": "executed", "data": {"node": "15", "output": VIDEO_OUTPUT, "prompt_id": prompt_id}},
+        {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}},
+    ]
+
+
+def _client(tmp_path, monkeypatch, tracker):
+    # Own client and prompt index: the module-level one journals into the repo's tmp/
+    client = comfy_utils.ComfyUIClient(SERVER, prompt_index=comfy_utils.PromptIndex(str(tmp_path / "index.jsonl")))
+    client.completions = tracker
+    monkeypatch.setattr(comfy_utils, "client", client)
+    return client
+
+
+@timeout(5)
+def test_tracker_resolves_from_events_without_http(tmp_path, monkeypatch):
+    tracker = completion_utils.CompletionTracker()
+    client = _client(tmp_path, monkeypatch, tracker)
+    monkeypatch.setattr(client, "get_history", lambda *a: (_ for _ in ()).throw(AssertionError("HTTP used")))
+
+    tracker.set_live(SERVER, True)
+    tracker.track("p1", SERVER)
+    assert comfy_utils.check_status("p1") == ("PENDING", None)
+
+    events = _events("p1")
+    tracker.handle_event(SERVER, events[0])
+    assert comfy_utils.check_status("p1") == ("RUNNING", None)
+
+    def finish():
+        time.sleep(0.2)
+        for message in events[1:]:
+            tracker.handle_event(SERVER, message)
+
+    threading.Thread(target=finish).start()
+    start = time.time()
+    assert comfy_utils.wait_for_completion(["p1"], 10)
+    assert time.time() - start < 5
+
+    status, result = comfy_utils.check_status("p1")
+    assert status == "SUCCEEDED"
+    assert result["filename"] == "out.mp4"
+    # Already reported: the monitor loop does not spin on it
+    assert not comfy_utils.wait_for_completion(["p1"], 0.1)
+
+
+@timeout(5)
+def test_tracker_reports_execution_errors():
+    tracker = completion_utils.CompletionTracker()
+    tracker.set_live(SERVER, True)
+    tracker.track("p2", SERVER)
+    tracker.handle_event(SERVER, {"type": "execution_error", "data": {"prompt_id": "p2", "exception_message": "OOM"}})
+    assert tracker.lookup("p2") == ("FAILED", "OOM")
+
+
+@timeout(5)
+def test_finish_listeners_run_once_per_prompt():
+    tracker = completion_utils.CompletionTracker()
+    finished = []
+    tracker.add_finish_listener(lambda prompt_id, server, status, elapsed: finished.append((prompt_id, status)))
+    tracker.set_live(SERVER, True)
+    tracker.track("p4", SERVER)
+    for message in _events("p4"):
+        tracker.handle_event(SERVER, message)
+    # The status service reconciles prompts the events already finished
+    tracker.reconcile("p4", "SUCCEEDED", {"filename": "out.mp4"})
+    tracker.reconcile("p4", "FAILED", "late")
+    assert finished == [("p4", "SUCCEEDED")]
+    assert tracker.lookup("p4")[0] == "SUCCEEDED"
+
+    # A prompt whose outputs were not in the events finishes once, on reconcile
+    tracker.track("p5", SERVER)
+    tracker.handle_event(SERVER, {"type": "executing", "data": {"node": None, "prompt_id": "p5"}})
+    tracker.reconcile("p5", "SUCCEEDED", {"filename": "cached.mp4"})
+    tracker.reconcile("p5", "SUCCEEDED", {"filename": "cached.mp4"})
+    assert finished[1:] == [("p5", "SUCCEEDED")]
+
+
+@timeout(5)
+def test_reconnect_falls_back_to_http_reconciliation(tmp_path, monkeypatch):
+    tracker = completion_utils.CompletionTracker()
+    client = _client(tmp_path, monkeypatch, tracker)
+    calls = []
+
+    def fake_history(prompt_id, server):
+        calls.append(server)
+        return {prompt_id: {"outputs": {"15": VIDEO_OUTPUT}}}
+
+    monkeypatch.setattr(client, "get_history", fake_history)
+
+    tracker.set_live(SERVER, True)
+    tracker.track("p3", SERVER)
+    assert tracker.lookup("p3") == ("PENDING", None)
+
+    # Events may have been missed while disconnected
+    tracker.set_live(SERVER, False)
+    tracker.set_live(SERVER, True)
+    assert tracker.lookup("p3") is None
+
+    status, result = comfy_utils.check_status("p3")
+    assert status == "SUCCEEDED"
+    assert calls == [SERVER]
+    # Reconciled result is now served from memory
+    assert comfy_utils.check_status("p3") == (status, result)
+    assert calls == [SERVER]
+
+
+def _serve_websocket(listener_socket, messages, ready):
+    conn, _ = listener_socket.accept()
+    request = b""
+    while b"\r\n\r\n" not in request:
+        request += conn.recv(4096)
+    key = ""
+    for line in request.decode().split("\r\n"):
+        if line.lower().startswith("sec-websocket-key:"):
+            key = line.split(":", 1)[1].strip()
+    accept = base64.b64encode(hashlib.sha1((key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest()).decode()
+    conn.sendall(
+        "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode()
+    )
+    ready.wait(5)
+    for message in messages:
+        payload = json.dumps(message).encode()
+        conn.sendall(bytes([0x81, len(payload)]) + payload if len(payload) < 126
+                     else bytes([0x81, 126]) + len(payload).to_bytes(2, "big") + payload)
+    time.sleep(1)
+    conn.close()
+
+
+@timeout(10)
+def test_listener_feeds_tracker_from_websocket():
+    listener_socket = socket.socket()
+    listener_socket.bind(("127.0.0.1", 0))
+    listener_socket.listen(1)
+    server = f"127.0.0.1:{listener_socket.getsockname()[1]}"
+    ready = threading.Event()
+    threading.Thread(target=_serve_websocket, args=(listener_socket, _events("p4"), ready), daemon=True).start()
+
+    tracker = completion_utils.CompletionTracker()
+    listener = completion_utils.ServerEventListener(f"http://{server}", "client-1", tracker)
+    listener.start()
+    try:
+        deadline = time.time() + 5
+        while not tracker.is_live(server) and time.time() < deadline:
+            time.sleep(0.05)
+        tracker.track("p4", server)
+        ready.set()
+        assert tracker.wait(["p4"], 5)
+        status, result = tracker.lookup("p4")
+        assert status == "SUCCEEDED"
+        assert result["filename"] == "out.mp4"
+    finally:
+        listener.stop()
+        listener_socket.close()
+
+
+class _FakeStatusClient:
+    def __init__(self, running, finished):
+        self.running = running
+        self.finished = finished
+        self.calls = []
+
+    def get_queue(self, server):
+        self.calls.append("queue")
+        return {"queue_running": [[0, pid] for pid in self.running], "queue_pending": []}
+
+    def get_recent_history(self, max_items, server):
+        self.calls.append("history_batch")
+        return {pid: {"outputs": {"15": VIDEO_OUTPUT}} for pid in self.finished}
+
+    def get_history(self, prompt_id, server):
+        self.calls.append("history_single")
+        return {}
+
+
+@timeout(10)
+def test_status_service_batches_http_per_cycle():
+    from concurrent.futures import ThreadPoolExecutor
+
+    running = [f"run{i}" for i in range(25)]
+    finished = [f"done{i}" for i in range(25)]
+    fake = _FakeStatusClient(running, finished)
+    tracker = completion_utils.CompletionTracker()
+    results = {}
+    done = threading.Event()
+
+    def callback(prompt_id, status, result):
+        results[prompt_id] = status
+        if len(results) == len(finished) + 1:
+            done.set()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        service = completion_utils.StatusService(SERVER, fake, tracker, executor, interval=0.2)
+        for prompt_id in running + finished + ["lost"]:
+            service.watch(prompt_id, callback)
+        service._poll()
+        assert done.wait(5)
+    # 50 outstanding prompts: one queue + one history batch, one lookup for the unknown id
+    assert fake.calls == ["queue", "history_batch", "history_single"]
+    assert all(results[pid] == "SUCCEEDED" for pid in finished)
+    assert results["lost"] == "FAILED"
+    assert sorted(service.watched()) == sorted(running)
+
+
+@timeout(10)
+def test_status_service_dispatches_websocket_results_without_http():
+    from concurrent.futures import ThreadPoolExecutor
+
+    fake = _FakeStatusClient([], [])
+    tracker = completion_utils.CompletionTracker()
+    tracker.set_live(SERVER, True)
+    tracker.track("p5", SERVER)
+    got = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        service = completion_utils.StatusService(SERVER, fake, tracker, executor, interval=30)
+        service.start()
+        try:
+            service.watch("p5", lambda pid, status, result: got.set() if status == "SUCCEEDED" else None)
+            for message in _events("p5"):
+                tracker.handle_event(SERVER, message)
+            assert got.wait(5)
+        finally:
+            service.stop()
+    assert fake.calls == []
+
+
+@timeout(10)
+def test_group_is_finished_once_when_all_tasks_done(monkeypatch):
+    import app as app_module
+
+    callbacks = {}
+    monkeypatch.setattr(comfy_utils, "watch_prompt",
+                        lambda prompt_id, server, callback, deadline=None: callbacks.setdefault(prompt_id, callback))
+    finished = []
+    done = threading.Event()
+
+    def on_all_done(gid):
+        finished.append((gid, threading.current_thread().name))
+        done.set()
+
+    group_id = "group-test"
+    app_module.TASKS_STORE[group_id] = {
+        "status": "processing",
+        "created_at": time.time(),
+        "tasks": [
+            {"task_id": "a", "server": SERVER, "status": "pending", "segment_index": 0, "result_path": None},
+            {"task_id": "b", "server": SERVER, "status": "pending", "segment_index": 1, "result_path": None},
+        ],
+    }
+
+    def on_task_done(gid, task, status, result):
+        task["status"] = "completed" if status == "SUCCEEDED" else "failed"
+
+    try:
+        app_module._watch_group_tasks(group_id, on_task_done, on_all_done, 60)
+        assert sorted(callbacks) == ["a", "b"]
+        callbacks["a"]("a", "SUCCEEDED", {})
+        assert finished == []
+        callbacks["b"]("b", "FAILED", "boom")
+        callbacks["b"]("b", "FAILED", "boom")
+        assert done.wait(5)
+        # Concatenation runs on the bounded ffmpeg pool, not the settling thread
+        assert len(finished) == 1 and finished[0][0] == group_id
+        assert finished[0][1].startswith("job-ffmpeg")
+        # Progress comes from counters kept as tasks settle, each task counted once
+        group = app_module.TASKS_STORE[group_id]
+        assert group["completed_count"] == 1 and group["failed_count"] == 1
+        assert app_module.app.test_client().get(f"/check_group_status/{group_id}").get_json()["progress"] == "1/2"
+    finally:
+        app_module.TASKS_STORE.pop(group_id, None)
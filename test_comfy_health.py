@@ -0,0 +1,128 @@
+import functools
+import json
+import signal
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import comfy_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+def _start_fake_comfy(status=200):
+    state = {"paths": [], "status": status}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            state["paths"].append(self.path)
+            body = json.dumps({"system": {}, "devices": []}).encode()
+            self.send_response(state["status"])
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}", state
+
+
+def _dead_address():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"127.0.0.1:{port}"
+
+
+@timeout(5)
+def test_circuit_opens_after_repeated_errors_and_half_opens(monkeypatch):
+    client = comfy_utils.ComfyUIClient("127.0.0.1:1")
+    health = comfy_utils.HealthTracker(client, ["a:1"])
+    now = [1000.0]
+    monkeypatch.setattr(comfy_utils.time, "time", lambda: now[0])
+
+    for _ in range(comfy_utils.HEALTH_FAILURE_THRESHOLD - 1):
+        health.record_failure("a:1", "HTTP 503")
+    assert health.state("a:1") == health.CLOSED
+    health.record_failure("a:1", "HTTP 503")
+    assert health.state("a:1") == health.OPEN
+    assert health.available() == []
+
+    now[0] += comfy_utils.HEALTH_OPEN_SECONDS
+    assert health.state("a:1") == health.HALF_OPEN
+    # A failed trial re-opens at once; a successful one closes
+    health.record_failure("a:1", "HTTP 503")
+    assert health.state("a:1") == health.OPEN
+    now[0] += comfy_utils.HEALTH_OPEN_SECONDS
+    health.record_success("a:1", 0.05)
+    assert health.state("a:1") == health.CLOSED
+    snapshot = health.snapshot()["a:1"]
+    assert snapshot["latency_ewma"] == 0.05
+    assert 0 < snapshot["error_rate"] < 1
+
+
+@timeout(10)
+def test_probe_uses_light_endpoint_and_refused_connection_opens_circuit():
+    server, address, state = _start_fake_comfy()
+    dead = _dead_address()
+    try:
+        client = comfy_utils.ComfyUIClient(address)
+        health = comfy_utils.HealthTracker(client, [address, dead])
+        client.health = health
+
+        assert health.probe_all() == {address: True, dead: False}
+        assert state["paths"] == [comfy_utils.HEALTH_PROBE_PATH]
+        assert health.state(dead) == health.OPEN
+        assert health.snapshot()[address]["latency_ewma"] is not None
+        # One request, counted once
+        assert health.snapshot()[address]["requests"] == 1
+        assert health.available() == [address]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@timeout(10)
+def test_check_connection_never_switches_server():
+    server, address, state = _start_fake_comfy(status=503)
+    other, other_address, _ = _start_fake_comfy()
+    try:
+        client = comfy_utils.ComfyUIClient(address)
+        client.health = comfy_utils.HealthTracker(client, [address, other_address])
+        for _ in range(comfy_utils.HEALTH_FAILURE_THRESHOLD):
+            assert not client.check_connection()
+        assert client.server_address == address
+
+        # Only failover() moves base_url, and only once the circuit is open
+        assert client.health.probe(other_address)
+        assert client.ensure_connection()
+        assert client.server_address == other_address
+    finally:
+        for s in (server, other):
+            s.shutdown()
+            s.server_close()
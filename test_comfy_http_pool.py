@@ -0,0 +1,99 @@
+import functools
+import json
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import comfy_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    posts = 0
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/queue":
+            self._send_json(200, {"queue_running": [], "queue_pending": []})
+        else:
+            self._send_json(200, {})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        type(self).posts += 1
+        self._send_json(503, {"error": "busy"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@timeout(10)
+def test_client_reuses_one_connection_per_server():
+    server = _start_server()
+    try:
+        address = f"127.0.0.1:{server.server_address[1]}"
+        client = comfy_utils.ComfyUIClient(address)
+        for _ in range(5):
+            assert client.get_queue() == {"queue_running": [], "queue_pending": []}
+        assert client.check_connection()
+
+        stats = client.connection_stats()[f"http://{address}"]
+        assert stats["requests_sent"] == 6
+        assert stats["connections_opened"] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@timeout(10)
+def test_queue_prompt_is_not_retried():
+    _KeepAliveHandler.posts = 0
+    server = _start_server()
+    try:
+        client = comfy_utils.ComfyUIClient(f"127.0.0.1:{server.server_address[1]}")
+        try:
+            client.queue_prompt({"1": {}})
+            raised = False
+        except comfy_utils.ComfyHTTPError as e:
+            raised = True
+            assert "busy" in e.body
+        assert raised
+        assert _KeepAliveHandler.posts == 1
+        client.close_listeners()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,125 @@
+import functools
+import json
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import comfy_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+def _start_fake_comfy():
+    state = {"requests": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            state["requests"].append(("GET", self.path))
+            if self.path.startswith("/history/"):
+                prompt_id = self.path.rsplit("/", 1)[-1]
+                outputs = {"9": {"videos": [{"filename": "out.mp4", "subfolder": "", "type": "output"}]}}
+                self._send_json({prompt_id: {"outputs": outputs}})
+            elif self.path.startswith("/queue"):
+                self._send_json({"queue_running": [], "queue_pending": []})
+            else:
+                self._send_json({})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            state["requests"].append(("POST", self.path))
+            if self.path == "/prompt":
+                self._send_json({"prompt_id": "prompt-1"})
+            else:
+                self._send_json({})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}", state
+
+
+@timeout(5)
+def test_index_survives_restart_and_compacts(tmp_path):
+    path = str(tmp_path / "prompt_index.jsonl")
+    index = comfy_utils.PromptIndex(path, max_entries=3)
+    index.record("p1", "a:1")
+    index.record("p2", "b:1")
+    index.record("p2", "b:1")  # unchanged mapping is not journaled again
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"prompt_id": "p3", "ser')
+
+    reloaded = comfy_utils.PromptIndex(path, max_entries=3)
+    assert reloaded.get("p1") == "a:1" and reloaded.get("p2") == "b:1"
+    assert reloaded.get("p3") is None
+    # An entry written after the torn line survives the next reload
+    reloaded.record("p3", "c:1")
+    assert comfy_utils.PromptIndex(path, max_entries=3).get("p3") == "c:1"
+
+    for i in range(3, 8):
+        reloaded.record(f"p{i}", "c:1")
+    # Only the newest entries are kept, and the journal was rewritten
+    assert len(reloaded) == 3 and reloaded.get("p1") is None
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert len(lines) < 6
+    assert comfy_utils.PromptIndex(path, max_entries=3).get("p7") == "c:1"
+
+
+@timeout(10)
+def test_status_and_cancel_target_the_owning_server(tmp_path, monkeypatch):
+    owner, owner_address, owner_state = _start_fake_comfy()
+    default, default_address, default_state = _start_fake_comfy()
+    try:
+        index = comfy_utils.PromptIndex(str(tmp_path / "prompt_index.jsonl"))
+        client = comfy_utils.ComfyUIClient(owner_address, prompt_index=index)
+        prompt_id, server = client.queue_prompt({"1": {}})
+        assert index.get(prompt_id) == owner_address
+        client.close_listeners()
+
+        # A restarted process knows nothing but the index, and its default server is another box
+        restarted = comfy_utils.ComfyUIClient(default_address, prompt_index=comfy_utils.PromptIndex(index.path))
+        monkeypatch.setattr(comfy_utils, "client", restarted)
+        owner_state["requests"].clear()
+
+        status, result = comfy_utils.check_status(prompt_id)
+        assert status == "SUCCEEDED" and result["filename"] == "out.mp4"
+        assert owner_state["requests"] == [("GET", f"/history/{prompt_id}")]
+
+        assert restarted.cancel_task(prompt_id)
+        assert ("POST", "/queue") in owner_state["requests"]
+        assert default_state["requests"] == []
+        restarted.close_listeners()
+    finally:
+        for s in (owner, default):
+            s.shutdown()
+            s.server_close()
@@ -0,0 +1,155 @@
+import functools
+import json
+import os
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import comfy_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+OUTPUT = b"rendered video bytes"
+
+
+def _start_fake_comfy():
+    state = {"prompts": [], "uploads": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, body, content_type="application/json"):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith("/view"):
+                self._send(OUTPUT, "video/mp4")
+            else:
+                self._send(json.dumps({"queue_running": [], "queue_pending": []}).encode())
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path == "/upload/image":
+                name = f"upload-{len(state['uploads'])}.png"
+                state["uploads"].append(name)
+                self._send(json.dumps({"name": name, "subfolder": "", "type": "input"}).encode())
+            else:
+                state["prompts"].append(json.loads(body)["prompt"])
+                self._send(json.dumps({"prompt_id": f"prompt-{len(state['prompts'])}"}).encode())
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}", state
+
+
+def _workflow(image, seed):
+    return {
+        "1": {"class_type": "LoadImage", "inputs": {"image": image}},
+        "2": {"class_type": "KSampler", "inputs": {"seed": seed, "steps": 4}},
+    }
+
+
+@timeout(5)
+def test_cache_key_ignores_seeds_and_server_specific_names():
+    a = comfy_utils.workflow_cache_key(_workflow("upload-0.png", 1), {"upload-0.png": "abc"})
+    b = comfy_utils.workflow_cache_key(_workflow("character_7.png", 99), {"character_7.png": "abc"})
+    c = comfy_utils.workflow_cache_key(_workflow("sha256:abc", 5))
+    d = comfy_utils.workflow_cache_key(_workflow("upload-0.png", 1), {"upload-0.png": "other"})
+    assert a == b == c
+    assert a != d
+
+
+@timeout(10)
+def test_identical_workflow_is_served_from_cache(tmp_path, monkeypatch):
+    server, address, state = _start_fake_comfy()
+    try:
+        cache = comfy_utils.ResultCache(str(tmp_path / "cache"), enabled=True)
+        client = comfy_utils.ComfyUIClient(address, result_cache=cache)
+        scheduler = comfy_utils.ServerScheduler(client, [address])
+        monkeypatch.setattr(comfy_utils, "client", client)
+        image = tmp_path / "character.png"
+        image.write_bytes(b"png")
+
+        prompt_id, _ = scheduler.submit(lambda names: _workflow(names["image"], 1), {"image": str(image)})
+        assert not comfy_utils.ResultCache.is_cached_prompt(prompt_id)
+        file_info = {"filename": "out.mp4", "subfolder": "", "type": "output"}
+        first = comfy_utils.download_result(file_info, str(tmp_path / "out"), address, prompt_id)
+        comfy_utils.remember_result_url(prompt_id, "http://obs/out.mp4")
+
+        # Same inputs, new seed: answered before any upload or prompt
+        logs = []
+        cached_id, _ = scheduler.submit(lambda names: _workflow(names["image"], 2), {"image": str(image)}, log_callback=logs.append)
+        assert comfy_utils.ResultCache.is_cached_prompt(cached_id)
+        assert len(state["prompts"]) == 1 and len(state["uploads"]) == 1
+        assert any("Result cache hit" in line for line in logs)
+
+        status, result = comfy_utils.check_status(cached_id)
+        assert status == "SUCCEEDED" and result["obs_url"] == "http://obs/out.mp4"
+        second = comfy_utils.download_result_async(result, str(tmp_path / "out")).result()
+        assert second != first
+        with open(second, "rb") as f:
+            assert f.read() == OUTPUT
+
+        # queue_prompt with the server-side upload name hits the same entry
+        again, _ = client.queue_prompt(_workflow("upload-0.png", 3))
+        assert again == cached_id
+
+        done = threading.Event()
+        client.watch(cached_id, None, lambda pid, status, result: done.set())
+        assert done.wait(2)
+
+        # The index survives a restart
+        reloaded = comfy_utils.ResultCache(str(tmp_path / "cache"), enabled=True)
+        assert reloaded.result(cached_id)[0] == "SUCCEEDED"
+        client.close_listeners()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@timeout(5)
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = comfy_utils.ResultCache(str(tmp_path / "cache"), max_bytes=10, enabled=True)
+    for i, key in enumerate(["k1", "k2", "k3"]):
+        path = tmp_path / f"out{i}.mp4"
+        path.write_bytes(b"12345")
+        cache.expect(f"p{i}", key)
+        cache.store(f"p{i}", str(path))
+        if key == "k2":
+            assert cache.lookup("k1")  # k1 becomes most recently used
+    assert cache.lookup("k2") is None
+    assert cache.lookup("k1") and cache.lookup("k3")
+    assert sorted(os.listdir(tmp_path / "cache")) == ["index.json", "k1.mp4", "k3.mp4"]
+
+
+@timeout(5)
+def test_cache_is_off_unless_enabled():
+    client = comfy_utils.ComfyUIClient("127.0.0.1:1")
+    assert not client.result_cache.enabled
+    assert client.result_cache.lookup("anything") is None
@@ -0,0 +1,173 @@
+import functools
+import json
+import signal
+import socket
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import comfy_utils
+import workflow_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+def _start_fake_comfy(queue_depth):
+    state = {"queue_depth": queue_depth, "uploads": [], "prompts": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith("/queue"):
+                pending = [[i, f"busy-{i}"] for i in range(state["queue_depth"])]
+                self._send_json({"queue_running": [], "queue_pending": pending})
+            else:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path == "/upload/image":
+                name = f"upload-{len(state['uploads'])}.png"
+                state["uploads"].append(name)
+                self._send_json({"name": name, "subfolder": "", "type": "input"})
+            elif self.path == "/prompt":
+                state["prompts"].append(json.loads(body)["prompt"])
+                self._send_json({"prompt_id": str(uuid.uuid4())})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}", state
+
+
+def _dead_address():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"127.0.0.1:{port}"
+
+
+@timeout(20)
+def test_scheduler_spreads_prompts_and_uploads_inputs_to_the_same_server(tmp_path):
+    busy_server, busy, busy_state = _start_fake_comfy(queue_depth=2)
+    idle_server, idle, idle_state = _start_fake_comfy(queue_depth=0)
+    dead = _dead_address()
+    image_path = tmp_path / "character.png"
+    image_path.write_bytes(b"png")
+
+    client = comfy_utils.ComfyUIClient(busy)
+    scheduler = comfy_utils.ServerScheduler(client, [busy, idle, dead])
+    try:
+        servers = []
+        for _ in range(4):
+            prompt_id, server = scheduler.submit(
+                lambda names: {"1": {"inputs": {"image": names["image"]}}},
+                {"image": str(image_path)},
+            )
+            assert prompt_id
+            servers.append(server)
+
+        # Idle box takes the first prompts, then the load evens out
+        assert servers[:2] == [idle, idle]
+        assert servers.count(busy) == 1
+        assert dead not in servers
+        assert not scheduler.snapshot()[dead]["healthy"]
+
+        # Every prompt references an image uploaded to its own server, once per server
+        for state in (busy_state, idle_state):
+            assert len(state["uploads"]) == 1
+            for prompt in state["prompts"]:
+                assert prompt["1"]["inputs"]["image"] in state["uploads"]
+    finally:
+        client.close_listeners()
+        for server in (busy_server, idle_server):
+            server.shutdown()
+            server.server_close()
+
+
+@timeout(5)
+def test_scheduler_prefers_faster_server_from_execution_times():
+    client = comfy_utils.ComfyUIClient("127.0.0.1:1")
+    scheduler = comfy_utils.ServerScheduler(client, ["a:1", "b:1"])
+    scheduler._queue_depth = lambda server: 1
+    scheduler._on_finished("p1", "a:1", "SUCCEEDED", 300.0)
+    scheduler._on_finished("p2", "b:1", "SUCCEEDED", 30.0)
+    assert scheduler.pick() == "b:1"
+
+
+@timeout(5)
+def test_scheduler_keeps_families_on_warm_servers_within_cap():
+    client = comfy_utils.ComfyUIClient("127.0.0.1:1")
+    scheduler = comfy_utils.ServerScheduler(client, ["a:1", "b:1"])
+    depths = {"a:1": 0, "b:1": 0}
+    scheduler._queue_depth = lambda server: depths[server]
+    animate = workflow_utils.WorkflowInstance({}, "wan2.2_animate")
+    audio = workflow_utils.WorkflowInstance({}, "index_tts")
+    for server in ("a:1", "b:1"):
+        scheduler._on_finished("p0", server, "SUCCEEDED", 50.0)
+    scheduler._on_queued("p1", "a:1", animate)
+    scheduler._on_queued("p2", "b:1", audio)
+
+    # a:1 is one prompt deeper, but it already has the animate models loaded
+    depths["a:1"] = 1
+    assert scheduler.pick(family="wan2.2_animate") == "a:1"
+    assert scheduler.pick(family="index_tts") == "b:1"
+
+    # Past the cap the shorter queue wins and the swap is counted
+    depths["a:1"] = 4
+    assert scheduler.pick(family="wan2.2_animate") == "b:1"
+    scheduler._on_queued("p3", "b:1", animate)
+
+    snapshot = scheduler.snapshot()
+    assert snapshot["a:1"]["affinity_picks"] == 1
+    assert snapshot["b:1"]["model_swaps"] == 1
+    assert snapshot["b:1"]["family"] == "wan2.2_animate"
+
+
+@timeout(5)
+def test_backlog_counts_unfinished_prompts_per_family():
+    client = comfy_utils.ComfyUIClient("127.0.0.1:1")
+    scheduler = comfy_utils.ServerScheduler(client, ["a:1", "b:1"])
+    animate = workflow_utils.WorkflowInstance({}, "wan2.2_animate")
+    for n in range(3):
+        scheduler._on_queued(f"p{n}", "a:1", animate)
+    assert scheduler.outstanding() == {"wan2.2_animate": 3}
+    # No samples yet: the default execution time, spread over two servers
+    assert scheduler.backlog_seconds() == 3 * comfy_utils.SCHEDULER_DEFAULT_EXEC_SECONDS / 2
+
+    scheduler._on_finished("p0", "a:1", "SUCCEEDED", 60.0)
+    scheduler.forget("p1")  # cancelled: no finish event will arrive
+    assert scheduler.outstanding() == {"wan2.2_animate": 1}
+    assert scheduler.estimate_seconds("wan2.2_animate", 4) == 4 * comfy_utils.SCHEDULER_DEFAULT_EXEC_SECONDS / 2
@@ -0,0 +1,121 @@
+import functools
+import json
+import signal
+
+import comfy_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+@timeout(5)
+def test_registry_persists_edits_and_validates(tmp_path):
+    path = str(tmp_path / "servers.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"servers": [{"address": "a:1"}, {"address": "b:1"}]}, f)
+    with open(path, encoding="utf-8") as f:
+        checked_in = f.read()
+    state_path = str(tmp_path / "state" / "servers.json")
+    registry = comfy_utils.ServerRegistry(path, defaults=["ignored:1"], state_path=state_path)
+    assert registry.servers() == ["a:1", "b:1"]
+
+    registry.add("http://c:1", weight=2, public_address="c:2")
+    registry.drain("a:1")
+    registry.set_weight("b:1", 0.5)
+    registry.remove("b:1")
+    for bad in (lambda: registry.add("c:1"), lambda: registry.set_weight("c:1", 0)):
+        try:
+            bad()
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+    try:
+        registry.drain("missing:1")
+        assert False, "expected KeyError"
+    except KeyError:
+        pass
+
+    reloaded = comfy_utils.ServerRegistry(path, defaults=["ignored:1"], state_path=state_path)
+    assert reloaded.servers() == ["c:1"]
+    assert reloaded.servers(include_draining=True) == ["a:1", "c:1"]
+    assert reloaded.weights() == {"a:1": 1.0, "c:1": 2.0}
+    assert reloaded.port_mapping() == {"c:1": "c:2"}
+    with open(state_path, encoding="utf-8") as f:
+        assert [s["address"] for s in json.load(f)["servers"]] == ["a:1", "c:1"]
+    # The checked-in config stays as it was
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == checked_in
+
+
+@timeout(5)
+def test_edits_reach_scheduler_and_health_live(tmp_path):
+    registry = comfy_utils.ServerRegistry(str(tmp_path / "servers.json"), defaults=["a:1", "b:1"])
+    client = comfy_utils.ComfyUIClient("a:1", servers=registry.servers(include_draining=True))
+    scheduler = comfy_utils.ServerScheduler(client, registry.servers())
+    registry.add_listener(lambda r: comfy_utils.apply_server_registry(r, client, scheduler))
+    scheduler._queue_depth = lambda server: 2 if server == "c:1" else 1
+
+    registry.add("c:1", weight=4)
+    assert scheduler.servers == ["a:1", "b:1", "c:1"]
+    # Four times the capacity outweighs one extra queued prompt
+    assert scheduler.pick() == "c:1"
+
+    # Draining: no new prompts, but still probed and still known to status lookups
+    registry.drain("a:1")
+    assert "a:1" not in scheduler.servers
+    assert "a:1" in client.health.servers()
+    assert client.server_address != "a:1"
+
+    registry.remove("c:1")
+    assert scheduler.servers == ["b:1"]
+    assert "c:1" not in client.health.servers()
+
+
+@timeout(10)
+def test_admin_api_edits_registry_and_port_mapping(tmp_path, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(comfy_utils.server_registry, "state_path", str(tmp_path / "servers.json"))
+    test_client = app_module.app.test_client()
+    try:
+        resp = test_client.post("/admin/servers", json={"address": "127.0.0.1:9", "weight": 2, "public_address": "example.test:9"})
+        assert resp.status_code == 200
+        assert "127.0.0.1:9" in comfy_utils.scheduler.servers
+        assert app_module.core_replace("at 127.0.0.1:9 now") == "at example.test:9 now"
+
+        assert test_client.post("/admin/servers/127.0.0.1:9/weight", json={"weight": -1}).status_code == 400
+        assert test_client.post("/admin/servers/127.0.0.1:9/drain").get_json()["server"]["state"] == "draining"
+        assert "127.0.0.1:9" not in comfy_utils.scheduler.servers
+
+        # Without a token only this machine may edit the registry
+        remote = {"REMOTE_ADDR": "192.168.1.20"}
+        assert test_client.post("/admin/servers", json={"address": "10.0.0.1:1"}, environ_base=remote).status_code == 403
+        assert test_client.get("/admin/servers", environ_base=remote).status_code == 403
+
+        monkeypatch.setattr(app_module, "ADMIN_TOKEN", "secret")
+        assert test_client.delete("/admin/servers/127.0.0.1:9").status_code == 403
+        resp = test_client.delete("/admin/servers/127.0.0.1:9", headers={"X-Admin-Token": "secret"}, environ_base=remote)
+        assert resp.status_code == 200
+        assert "127.0.0.1:9" not in [s["address"] for s in resp.get_json()["servers"]]
+        assert app_module.core_replace("at 127.0.0.1:9 now") == "at 127.0.0.1:9 now"
+        assert test_client.delete("/admin/servers/127.0.0.1:9", headers={"X-Admin-Token": "secret"}).status_code == 404
+    finally:
+        if "127.0.0.1:9" in comfy_utils.server_registry.servers(include_draining=True):
+            comfy_utils.server_registry.remove("127.0.0.1:9")
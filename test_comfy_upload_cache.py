@@ -0,0 +1,119 @@
+import functools
+import json
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import comfy_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+def _start_fake_comfy():
+    state = {"uploads": [], "stored": set()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_HEAD(self):
+            query = parse_qs(urlparse(self.path).query)
+            found = query.get("filename", [""])[0] in state["stored"]
+            self.send_response(200 if found else 404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            name = "character.png" if b'filename="character.png"' in body else f"file-{len(state['uploads'])}.png"
+            state["uploads"].append(name)
+            state["stored"].add(name)
+            payload = json.dumps({"name": name, "subfolder": "", "type": "input"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_address[1]}", state
+
+
+@timeout(10)
+def test_identical_content_is_uploaded_once_per_server(tmp_path):
+    server, address, state = _start_fake_comfy()
+    try:
+        client = comfy_utils.ComfyUIClient(address)
+        first = tmp_path / "character_for_a.png"
+        second = tmp_path / "character_for_b.png"
+        first.write_bytes(b"same bytes")
+        second.write_bytes(b"same bytes")
+
+        res_a = client.upload_file(str(first))
+        res_b = client.upload_file(str(second))
+        assert res_a["name"] == res_b["name"]
+        assert len(state["uploads"]) == 1
+
+        second.write_bytes(b"changed bytes")
+        assert client.upload_file(str(second))["name"] != res_a["name"]
+        assert len(state["uploads"]) == 2
+
+        # A reconnect (possible restart) forgets what the server holds
+        client.upload_cache.invalidate(address)
+        client.upload_file(str(first))
+        assert len(state["uploads"]) == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@timeout(10)
+def test_overwritten_name_and_missing_file_are_reuploaded(tmp_path, monkeypatch):
+    server, address, state = _start_fake_comfy()
+    try:
+        client = comfy_utils.ComfyUIClient(address)
+        old_dir = tmp_path / "old"
+        new_dir = tmp_path / "new"
+        old_dir.mkdir()
+        new_dir.mkdir()
+        (old_dir / "character.png").write_bytes(b"old character")
+        (new_dir / "character.png").write_bytes(b"new character")
+
+        client.upload_file(str(old_dir / "character.png"))
+        client.upload_file(str(new_dir / "character.png"))
+        # character.png now holds the new bytes, so the old hash must not map to it
+        client.upload_file(str(old_dir / "character.png"))
+        assert len(state["uploads"]) == 3
+
+        # Entries past the verify window are probed; a vanished file is re-sent
+        monkeypatch.setattr(comfy_utils, "UPLOAD_CACHE_VERIFY_SECONDS", 0)
+        state["stored"].clear()
+        client.upload_file(str(new_dir / "character.png"))
+        assert len(state["uploads"]) == 4
+        client.upload_file(str(new_dir / "character.png"))
+        assert len(state["uploads"]) == 4
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,87 @@
+import functools
+import signal
+import threading
+import time
+
+import comfy_utils
+import workflow_utils
+from fake_comfy_server import FakeComfyServer
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+def _watch(client, prompt_id, server):
+    done = threading.Event()
+    results = {}
+
+    def callback(pid, status, result):
+        results.update(status=status, result=result)
+        done.set()
+
+    client.watch(prompt_id, server, callback)
+    assert done.wait(10)
+    return results["status"], results["result"]
+
+
+@timeout(20)
+def test_template_round_trip_through_fake_server(tmp_path, monkeypatch):
+    with FakeComfyServer(default_exec_time=(0.05, 0), exec_times={}, seed=1) as fake:
+        client = comfy_utils.ComfyUIClient(fake.address, prompt_index=comfy_utils.PromptIndex(str(tmp_path / "index.jsonl")))
+        monkeypatch.setattr(comfy_utils, "client", client)
+        scheduler = comfy_utils.ServerScheduler(client, [fake.address])
+        image = tmp_path / "character.png"
+        image.write_bytes(b"png")
+        video = tmp_path / "clip.mp4"
+        video.write_bytes(b"mp4")
+
+        template = workflow_utils.registry.get("animate")
+        prompt_id, server = scheduler.submit(
+            lambda names: template.instantiate(image=names["image"], video=names["video"], text="hi"),
+            {"image": str(image), "video": str(video)}, family=template.family,
+        )
+        assert server == fake.address and fake.stats["uploads"] == 2
+
+        status, result = _watch(client, prompt_id, server)
+        assert status == "SUCCEEDED" and result["filename"].endswith(".mp4")
+        path = comfy_utils.download_result_async(result, str(tmp_path / "out"), server, prompt_id).result()
+        with open(path, "rb") as f:
+            assert f.read(8)[4:] == b"ftyp"
+        client.close_listeners()
+
+
+@timeout(20)
+def test_injected_failures_and_interrupts(tmp_path):
+    with FakeComfyServer(default_exec_time=(0.05, 0), exec_times={}, failure_rate=1.0) as failing, \
+            FakeComfyServer(exec_times={}, hang_rate=1.0) as hanging:
+        client = comfy_utils.ComfyUIClient(failing.address, prompt_index=comfy_utils.PromptIndex(str(tmp_path / "index.jsonl")))
+        prompt = {"1": {"class_type": "SaveAudio", "inputs": {}}}
+
+        prompt_id, server = client.queue_prompt(prompt)
+        status, _ = _watch(client, prompt_id, server)
+        assert status == "FAILED" and failing.stats["failed"] == 1
+
+        prompt_id, server = client.queue_prompt(prompt, server_address=hanging.address)
+        while client.is_task_running(prompt_id, server) != "RUNNING":
+            time.sleep(0.01)
+        assert client.cancel_task(prompt_id)
+        status, _ = _watch(client, prompt_id, server)
+        assert status == "FAILED" and hanging.stats["interrupted"] == 1
+        client.close_listeners()
@@ -0,0 +1,179 @@
+import functools
+import signal
+import threading
+
+import pytest
+
+import job_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+@timeout(10)
+def test_pool_caps_concurrency_and_reports_queue_depth():
+    executor = job_utils.JobExecutor({"ffmpeg": 2, "io": 1})
+    release = threading.Event()
+    lock = threading.Lock()
+    active = [0, 0]  # current, peak
+
+    def job(n):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        release.wait()
+        with lock:
+            active[0] -= 1
+        return n
+
+    futures = [executor.submit("ffmpeg", job, n) for n in range(10)]
+    while executor.stats()["ffmpeg"]["running"] < 2:
+        pass
+    stats = executor.stats()["ffmpeg"]
+    assert stats["threads"] == 2 and stats["queued"] == 8
+    assert executor.stats()["io"]["threads"] == 0
+
+    release.set()
+    assert [f.result(timeout=5) for f in futures] == list(range(10))
+    assert active[1] == 2
+    assert executor.stats()["ffmpeg"]["completed"] == 10
+
+
+@timeout(10)
+def test_priority_order_and_failures():
+    executor = job_utils.JobExecutor({"llm": 1})
+    gate = threading.Event()
+    order = []
+    executor.submit("llm", gate.wait)
+    executor.submit("llm", order.append, "low", priority=job_utils.PRIORITY_LOW)
+    executor.submit("llm", order.append, "normal-1")
+    executor.submit("llm", order.append, "high", priority=job_utils.PRIORITY_HIGH)
+    executor.submit("llm", order.append, "normal-2")
+
+    def boom():
+        raise RuntimeError("boom")
+
+    failed = executor.submit("llm", boom, priority=job_utils.PRIORITY_LOW)
+    gate.set()
+    with pytest.raises(RuntimeError):
+        failed.result(timeout=5)
+    assert order == ["high", "normal-1", "normal-2", "low"]
+    assert executor.stats()["llm"]["failed"] == 1
+    with pytest.raises(ValueError):
+        executor.submit("gpu", print)
+
+
+@timeout(10)
+def test_admission_admits_holds_and_rejects_by_backlog():
+    executor = job_utils.JobExecutor({"io": 2})
+    backlog = [0.0]
+    admission = job_utils.AdmissionQueue(executor, lambda: backlog[0], max_backlog=100, hold_limit=2)
+    ran = []
+
+    outcome, future = admission.offer("g1", 60, "io", ran.append, "g1")
+    assert outcome == admission.ADMITTED
+    future.result(timeout=5)
+
+    # The fleet now holds 90s of work: a 60s job no longer fits
+    backlog[0] = 90.0
+    assert admission.offer("g2", 60, "io", ran.append, "g2") == (admission.HELD, {"position": 1, "eta_seconds": 50})
+    # Even a job that would fit waits behind the held one
+    outcome, info = admission.offer("g3", 5, "io", ran.append, "g3")
+    assert outcome == admission.HELD and info["position"] == 2
+    assert admission.retry_after() == 55
+
+    outcome, info = admission.offer("g4", 10, "io", ran.append, "g4")
+    assert outcome == admission.REJECTED and info == {"retry_after": 65}
+
+    backlog[0] = 30.0
+    assert admission.poll() == ["g2", "g3"]
+    assert admission.position("g2") is None
+    while len(ran) < 3:
+        pass
+    assert ran == ["g1", "g2", "g3"]
+    assert admission.snapshot()["rejected"] == 1
+
+
+@timeout(10)
+def test_group_endpoint_queues_then_answers_429(monkeypatch):
+    import app as app_module
+
+    admission = job_utils.AdmissionQueue(job_utils.JobExecutor({"io": 1}), lambda: 500.0, max_backlog=100, hold_limit=1)
+    monkeypatch.setattr(app_module, "ADMISSION", admission)
+    monkeypatch.setattr(app_module, "TASKS_STORE", {})
+    monkeypatch.setattr(app_module, "GLOBAL_STATE", {})
+    monkeypatch.setattr(app_module, "ensure_comfy_connection", lambda: None)
+    test_client = app_module.app.test_client()
+    texts = ["a", "b", "c", "d"]
+
+    resp = test_client.post("/generate_i2v_group", json={"texts": texts, "group_id": "held"})
+    assert resp.status_code == 202
+    assert resp.get_json()["queue_position"] == 1
+    status = test_client.get("/check_group_status/held").get_json()
+    assert status["status"] == "queued" and status["queue_position"] == 1
+
+    resp = test_client.post("/generate_i2v_group", json={"texts": texts, "group_id": "late"})
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) == resp.get_json()["retry_after"] > 0
+    assert "late" not in app_module.TASKS_STORE
+
+
+@timeout(10)
+def test_scheduled_checks_share_one_worker_until_done():
+    executor = job_utils.JobExecutor({"monitor": 1})
+    runs = {name: 0 for name in "abc"}
+    done = threading.Event()
+
+    def check(name, limit):
+        runs[name] += 1
+        if name == "b" and runs[name] == 1:
+            raise RuntimeError("transient")  # logged and retried at the next interval
+        if all(runs[n] >= 3 for n in runs):
+            done.set()
+        return runs[name] < limit
+
+    for name in runs:
+        executor.schedule("monitor", 0.01, check, name, 3)
+    assert done.wait(5)
+    while executor.scheduled():
+        pass
+    # Three checks progressed on one worker, and each stopped once it returned False
+    assert runs == {"a": 3, "b": 3, "c": 3}
+    assert executor.stats()["monitor"]["threads"] == 1
+    with pytest.raises(ValueError):
+        executor.schedule("gpu", 1, print)
+
+
+@timeout(10)
+def test_call_runs_inline_on_its_own_pool():
+    executor = job_utils.JobExecutor({"ffmpeg": 1, "io": 1})
+
+    def cut(n):
+        return threading.current_thread().name, n
+
+    def upload():
+        # Waits for an ffmpeg slot from io; nested calls on ffmpeg run inline
+        outer = executor.call("ffmpeg", cut, 1)
+        inner = executor.call("ffmpeg", lambda: executor.call("ffmpeg", cut, 2))
+        return outer, inner
+
+    outer, inner = executor.submit("io", upload).result(timeout=5)
+    assert outer[0].startswith("job-ffmpeg") and inner[0] == outer[0]
+    assert (outer[1], inner[1]) == (1, 2)
@@ -0,0 +1,235 @@
+import functools
+import os
+import signal
+import threading
+import time
+
+import job_utils
+import pipeline_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+class _Gauge:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.active -= 1
+
+
+@timeout(10)
+def test_stages_overlap_with_bounded_concurrency():
+    cut_gauge, submit_gauge = _Gauge(), _Gauge()
+    events = []
+
+    def cut(i):
+        with cut_gauge:
+            time.sleep(0.05)
+        events.append(("cut", i))
+        return i
+
+    def submit(i):
+        with submit_gauge:
+            time.sleep(0.05)
+        events.append(("submit", i))
+        return i * 10
+
+    executor = job_utils.JobExecutor({"ffmpeg": 4, "io": 4})
+    pipeline = pipeline_utils.Pipeline([("cut", cut, 2, "ffmpeg"), ("submit", submit, 3, "io")], executor)
+    results = pipeline.run(range(12))
+
+    assert sorted(results) == [i * 10 for i in range(12)]
+    assert cut_gauge.peak == 2
+    assert submit_gauge.peak <= 3
+    # The first item is submitted long before the last one is cut
+    assert events.index(("submit", 0)) < events.index(("cut", 11))
+
+
+@timeout(10)
+def test_first_error_stops_pipeline_and_is_raised():
+    submitted = []
+
+    def cut(i):
+        if i == 3:
+            raise RuntimeError("cut 3 failed")
+        return i
+
+    def submit(i):
+        time.sleep(0.1)
+        submitted.append(i)
+
+    executor = job_utils.JobExecutor({"ffmpeg": 1, "io": 1})
+    pipeline = pipeline_utils.Pipeline([("cut", cut, 1, "ffmpeg"), ("submit", submit, 1, "io")], executor, queue_size=2)
+    try:
+        pipeline.run(range(50))
+        assert False, "expected RuntimeError"
+    except RuntimeError as e:
+        assert str(e) == "cut 3 failed"
+    assert pipeline.stopped.is_set()
+    assert 3 not in submitted and len(submitted) < 50
+    # Cut but never submitted, so the caller can clean up after them
+    assert all(name == "submit" for name, _ in pipeline.dropped)
+    assert sorted(submitted + [item for _, item in pipeline.dropped]) == list(range(3))
+
+
+@timeout(10)
+def test_pipelines_share_the_pool_bound_and_run_inline_on_their_own_pool():
+    executor = job_utils.JobExecutor({"ffmpeg": 2, "io": 2})
+    cut_gauge = _Gauge()
+    submit_threads = set()
+
+    def cut(i):
+        with cut_gauge:
+            time.sleep(0.02)
+        return i
+
+    def submit(i):
+        submit_threads.add(threading.current_thread().name)
+        return i
+
+    def run():
+        pipeline = pipeline_utils.Pipeline([("cut", cut, 2, "ffmpeg"), ("submit", submit, 3, "io")], executor)
+        return pipeline.run(range(6)), threading.current_thread().name
+
+    # Two groups at 2 cuts each still run at most the ffmpeg pool's 2 cuts
+    runs = [executor.submit("io", run) for _ in range(2)]
+    outcomes = [f.result(timeout=5) for f in runs]
+    assert [sorted(results) for results, _ in outcomes] == [list(range(6))] * 2
+    assert cut_gauge.peak == 2
+    # Submitting ran on the io workers driving each pipeline, not on extra ones
+    assert submit_threads == {name for _, name in outcomes}
+    assert executor.stats()["io"]["threads"] == 2
+
+
+@timeout(10)
+def test_upload_submission_queues_segments_through_pipeline(tmp_path, monkeypatch):
+    import app as app_module
+
+    queued = []
+    cut_done = threading.Event()
+
+    def fake_cut(input_path, output_path, start_time, end_time):
+        if start_time > 0:
+            # Later cuts wait until segment 0 has been queued
+            assert cut_done.wait(5)
+        with open(output_path, "wb") as f:
+            f.write(b"segment")
+
+    def fake_submit(char_path, video_path, workflow_type='real', segment_duration=None, log_callback=None, **kw):
+        queued.append(segment_duration)
+        cut_done.set()
+        return f"prompt-{len(queued)}", "server-a", None
+
+    class FakeResponse:
+        status_code = 200
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def iter_content(self, chunk_size):
+            return [b"png"]
+
+    video_path = tmp_path / "clip.mp4"
+    video_path.write_bytes(b"video")
+    monkeypatch.setattr(app_module, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setattr(app_module.ffmpeg_utils, "get_video_info", lambda path: {"duration": 10, "has_audio": False})
+    monkeypatch.setattr(app_module.ffmpeg_utils, "cut_video", fake_cut)
+    monkeypatch.setattr(app_module.comfy_utils, "submit_workflow_template", fake_submit)
+    monkeypatch.setattr(app_module.requests, "get", lambda *a, **kw: FakeResponse())
+    monkeypatch.setattr(app_module, "monitor_group_task", lambda group_id: None)
+
+    group_id = "pipeline-test"
+    app_module.TASKS_STORE[group_id] = {"status": "processing", "tasks": [], "created_at": time.time()}
+    try:
+        app_module.process_i2v_upload_submission(group_id, str(video_path), "real")
+        tasks = app_module.TASKS_STORE[group_id]["tasks"]
+        assert sorted(t["segment_index"] for t in tasks) == [0, 1, 2]
+        assert sorted(queued) == [2, 4, 4]
+        # Segment files are kept for hedging/retries, one per queued job
+        kept = sorted(p.name for p in tmp_path.iterdir() if p.name.startswith("segment_"))
+        assert kept == sorted(os.path.basename(t["job"]["video"]) for t in tasks)
+    finally:
+        app_module.TASKS_STORE.pop(group_id, None)
+
+
+@timeout(10)
+def test_failed_upload_submission_cancels_queued_segments_and_removes_cuts(tmp_path, monkeypatch):
+    import app as app_module
+
+    queued, cancelled = [], []
+
+    def fake_cut(input_path, output_path, start_time, end_time):
+        with open(output_path, "wb") as f:
+            f.write(b"segment")
+
+    def fake_submit(char_path, video_path, workflow_type='real', segment_duration=None, log_callback=None, **kw):
+        if video_path.endswith("_3.mp4"):
+            return None, None, "server rejected the prompt"
+        queued.append(f"prompt-{os.path.basename(video_path)}")
+        return queued[-1], "server-a", None
+
+    class FakeResponse:
+        status_code = 200
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def iter_content(self, chunk_size):
+            return [b"png"]
+
+    video_path = tmp_path / "clip.mp4"
+    video_path.write_bytes(b"video")
+    monkeypatch.setattr(app_module, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setattr(app_module.ffmpeg_utils, "get_video_info", lambda path: {"duration": 24, "has_audio": False})
+    monkeypatch.setattr(app_module.ffmpeg_utils, "cut_video", fake_cut)
+    monkeypatch.setattr(app_module.comfy_utils, "submit_workflow_template", fake_submit)
+    monkeypatch.setattr(app_module.comfy_utils, "cancel_job", lambda prompt_id, server=None: cancelled.append(prompt_id))
+    monkeypatch.setattr(app_module.requests, "get", lambda *a, **kw: FakeResponse())
+    monitored = []
+    monkeypatch.setattr(app_module, "monitor_group_task", monitored.append)
+
+    group_id = "pipeline-failure-test"
+    app_module.TASKS_STORE[group_id] = {"status": "processing", "tasks": [], "created_at": time.time()}
+    try:
+        app_module.process_i2v_upload_submission(group_id, str(video_path), "real")
+        group = app_module.TASKS_STORE[group_id]
+        assert group["status"] == "failed" and "server rejected" in group["error"]
+        assert queued and sorted(cancelled) == sorted(queued)
+        assert all(t["status"] == "failed" for t in group["tasks"])
+        assert [p.name for p in tmp_path.iterdir() if p.name.startswith("segment_")] == []
+        assert monitored == []
+    finally:
+        app_module.TASKS_STORE.pop(group_id, None)
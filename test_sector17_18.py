@@ -4,6 +4,7 @@ from unittest.mock import patch, MagicMock
 import sys
 import os
 import json
+import time
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
@@ -28,6 +29,11 @@ class TestSector1718(unittest.TestCase):
         self.assertIn(task_id, SECTOR_TASKS)
         self.assertEqual(SECTOR_TASKS[task_id]["status"], "processing")
 
+        # The task runs on the job executor's llm pool, shortly after the response
+        for _ in range(200):
+            if mock_run_task.called:
+                break
+            time.sleep(0.01)
         mock_run_task.assert_called_once()
 
     def test_sector17_submit_missing_text(self):
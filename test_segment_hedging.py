@@ -0,0 +1,130 @@
+import functools
+import signal
+import time
+
+import comfy_utils
+import workflow_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+class _FakeComfy:
+    """Stands in for the comfy_utils calls the group monitor makes."""
+
+    def __init__(self, monkeypatch, app_module):
+        self.watched = {}
+        self.submitted = []
+        self.cancelled = []
+        monkeypatch.setattr(app_module.comfy_utils, "watch_prompt", self.watch_prompt)
+        monkeypatch.setattr(app_module.comfy_utils, "submit_workflow_template", self.submit)
+        monkeypatch.setattr(app_module.comfy_utils, "cancel_job", lambda pid, server=None: self.cancelled.append((pid, server)))
+
+    def watch_prompt(self, prompt_id, server, callback, deadline=None):
+        self.watched[prompt_id] = callback
+
+    def submit(self, char_path, video_path, workflow_type='real', segment_duration=None, log_callback=None, exclude=()):
+        server = next(s for s in ("a:1", "b:1", "c:1") if s not in exclude)
+        prompt_id = f"retry-{len(self.submitted)}"
+        self.submitted.append((prompt_id, server, list(exclude)))
+        return prompt_id, server, None
+
+    def finish(self, prompt_id, status, result=None):
+        self.watched[prompt_id](prompt_id, status, result)
+
+
+def _group(app_module, tmp_path, group_id):
+    segment = tmp_path / "segment_0.mp4"
+    segment.write_bytes(b"segment")
+    task = {
+        'task_id': 'first', 'server': 'a:1', 'status': 'pending', 'segment_index': 0, 'result_path': None,
+        'job': {'character': str(tmp_path / "character.png"), 'video': str(segment), 'workflow_type': 'real',
+                'segment_duration': 4, 'family': 'wan2.2_animate'},
+        'attempts': [{'task_id': 'first', 'server': 'a:1', 'status': 'running', 'queued_at': time.time() - 100, 'hedge': False}],
+    }
+    app_module.TASKS_STORE[group_id] = {'status': 'processing', 'tasks': [task], 'created_at': time.time()}
+    return task, segment
+
+
+@timeout(5)
+def test_latency_percentiles_per_family():
+    client = comfy_utils.ComfyUIClient("127.0.0.1:1")
+    scheduler = comfy_utils.ServerScheduler(client, ["a:1"])
+    workflow = workflow_utils.WorkflowInstance({}, "wan2.2_animate")
+    for i in range(comfy_utils.SCHEDULER_LATENCY_MIN_SAMPLES * 2):
+        scheduler._on_queued(f"p{i}", "a:1", workflow)
+        if i == 0:
+            assert scheduler.latency_percentile("wan2.2_animate", 0.95) is None
+        scheduler._on_finished(f"p{i}", "a:1", "SUCCEEDED", float(i + 1))
+    assert scheduler.latency_percentile("wan2.2_animate", 0.95) == 19.0
+    assert scheduler.latency_percentile("wan2.2_animate", 0.5) == 10.0
+    assert scheduler.latency_snapshot()["wan2.2_animate"]["samples"] == 20
+
+
+@timeout(5)
+def test_failed_segment_is_retried_on_another_server(tmp_path, monkeypatch):
+    import app as app_module
+
+    fake = _FakeComfy(monkeypatch, app_module)
+    done = []
+    group_id = "retry-test"
+    task, segment = _group(app_module, tmp_path, group_id)
+    try:
+        app_module._watch_group_tasks(group_id, lambda g, t, status, result: done.append((t['task_id'], status)), lambda g: None, 60)
+        fake.finish("first", "FAILED", "CUDA error")
+        assert done == [] and fake.submitted == [("retry-0", "b:1", ["a:1"])]
+        assert segment.exists()
+
+        fake.finish("retry-0", "SUCCEEDED", {"filename": "out.mp4"})
+        assert done == [("retry-0", "SUCCEEDED")]
+        assert task['server'] == "b:1" and not segment.exists()
+    finally:
+        app_module.TASKS_STORE.pop(group_id, None)
+
+
+@timeout(5)
+def test_straggler_is_hedged_and_the_loser_cancelled(tmp_path, monkeypatch):
+    import app as app_module
+
+    fake = _FakeComfy(monkeypatch, app_module)
+    monkeypatch.setattr(app_module.comfy_utils.scheduler, "latency_percentile", lambda family, q: 30.0)
+    monkeypatch.setattr(app_module.comfy_utils.scheduler, "idle_servers", lambda exclude=(): ["c:1"])
+    monkeypatch.setattr(app_module.comfy_utils.scheduler, "servers", ["a:1", "b:1", "c:1"])
+    done = []
+    group_id = "hedge-test"
+    task, _ = _group(app_module, tmp_path, group_id)
+    on_done = lambda g, t, status, result: done.append((t['task_id'], status))
+    try:
+        app_module._watch_group_tasks(group_id, on_done, lambda g: None, 60)
+        assert app_module._hedge_stragglers(group_id, on_done, lambda g: None, None)
+        assert fake.submitted == [("retry-0", "c:1", ["a:1", "b:1"])]
+        # Already hedged: no second duplicate
+        app_module._hedge_stragglers(group_id, on_done, lambda g: None, None)
+        assert len(fake.submitted) == 1
+
+        fake.finish("retry-0", "SUCCEEDED", {"filename": "out.mp4"})
+        assert done == [("retry-0", "SUCCEEDED")]
+        assert fake.cancelled == [("first", "a:1")]
+        # The cancelled original reports later and is ignored
+        fake.finish("first", "FAILED", "Interrupted")
+        assert done == [("retry-0", "SUCCEEDED")]
+        assert not app_module._hedge_stragglers(group_id, on_done, lambda g: None, None)
+    finally:
+        app_module.TASKS_STORE.pop(group_id, None)
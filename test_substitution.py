@@ -0,0 +1,235 @@
+import functools
+import json
+import os
+import signal
+import time
+
+import substitution_utils
+from bench_substitution import (
+    HARD_ENCODED_PATTERNS,
+    PORT_MAPPING,
+    legacy_core_replace,
+    make_input,
+)
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+def _write(path, content):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+@timeout(5)
+def test_engine_matches_legacy_core_replace(tmp_path):
+    rules_path = str(tmp_path / "substitution.txt")
+    _write(rules_path, "的了是")
+    engine = substitution_utils.SubstitutionEngine(rules_path, PORT_MAPPING, HARD_ENCODED_PATTERNS)
+
+    samples = [
+        make_input(4),
+        "访问 192.168.50.210:7860 和 192.168.0.210:7860",
+        "第一行\n登录领番茄小说\n第三行的内容",
+        "原进度 12:34 从本页听 more",
+        "",
+    ]
+    for text in samples:
+        assert engine.apply(text) == legacy_core_replace(text, rules_path)
+
+
+@timeout(5)
+def test_engine_reads_rules_from_memory_until_invalidated(tmp_path):
+    rules_path = str(tmp_path / "substitution.txt")
+    _write(rules_path, "a")
+    engine = substitution_utils.SubstitutionEngine(rules_path)
+    assert engine.apply("abc") == "bc"
+
+    # Hand edits are not picked up on the hot path...
+    _write(rules_path, "ab")
+    assert engine.apply("abc") == "bc"
+    # ...only after an explicit invalidate()
+    engine.invalidate()
+    assert engine.apply("abc") == "c"
+
+
+@timeout(5)
+def test_engine_invalidate_forces_reload(tmp_path):
+    rules_path = str(tmp_path / "substitution.txt")
+    engine = substitution_utils.SubstitutionEngine(rules_path)
+    assert engine.apply("xyz") == "xyz"
+
+    _write(rules_path, "y")
+    engine.invalidate()
+    assert engine.apply("xyz") == "xz"
+
+
+@timeout(10)
+def test_replace_route_applies_port_and_pattern_rules():
+    from app import app
+
+    test_client = app.test_client()
+    resp = test_client.post("/replace", json={"text": "第一行\n继续播放下一章\n正文 12/3456 页"})
+    assert resp.status_code == 200
+    assert resp.get_data(as_text=True) == "第一行\n\n正文 "
+
+
+@timeout(10)
+def test_replace_route_batch_form():
+    from app import app
+
+    test_client = app.test_client()
+    resp = test_client.post("/replace", json={"texts": ["第一页\n继续播放", "第二页 12/3456"]})
+    assert resp.status_code == 200
+    assert resp.get_json() == {"texts": ["第一页\n", "第二页 "]}
+
+    resp = test_client.post("/replace", json={"texts": "not a list"})
+    assert resp.status_code == 400
+
+    # A bare array is the batch too, answered in the same shape
+    resp = test_client.post("/replace", json=["第一页\n继续播放", "第二页 12/3456"])
+    assert resp.status_code == 200
+    assert resp.get_json() == ["第一页\n", "第二页 "]
+    for body in ([1, 2], "just a string"):
+        resp = test_client.post("/replace", json=body)
+        assert resp.status_code == 400 and "error" in resp.get_json()
+
+
+@timeout(10)
+def test_replace_route_ndjson_stream():
+    from app import app
+
+    test_client = app.test_client()
+    body = '{"text": "继续播放下一章"}\n"正文 12/3456"\n\nnot json\n{"text": "尾"}\n'
+    resp = test_client.post(
+        "/replace",
+        data=body.encode("utf-8"),
+        content_type="application/x-ndjson",
+    )
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert lines[0] == {"text": ""}
+    assert lines[1] == {"text": "正文 "}
+    assert "error" in lines[2]
+    assert lines[3] == {"text": "尾"}
+
+
+@timeout(5)
+def test_rule_matcher_prefers_longest_rule_and_updates_incrementally():
+    matcher = substitution_utils.RuleMatcher(["广告", "广告词", "水印"])
+    assert matcher.sub("", "正文广告词结束，水印，广告") == "正文结束，，"
+
+    assert matcher.remove("广告词")
+    assert matcher.sub("", "广告词") == "词"
+    assert not matcher.remove("广告词")
+
+    assert matcher.add("a.b")
+    assert not matcher.add("a.b")
+    assert matcher.sub("", "a.b axb") == " axb"
+
+
+@timeout(5)
+def test_parse_rules_reads_lines_and_legacy_char_sets():
+    assert substitution_utils.parse_rules("abca") == ["a", "b", "c"]
+    assert substitution_utils.parse_rules("广告词\n水印\r\n\n广告词\n") == ["广告词", "水印"]
+    assert substitution_utils.parse_rules("") == []
+    # The header marks a line file even when its only rule has no trailing newline
+    header = substitution_utils.RULES_FILE_HEADER
+    assert substitution_utils.parse_rules(f"{header}\n广告词") == ["广告词"]
+    rules = ["a", "广告词"]
+    assert substitution_utils.parse_rules(substitution_utils.format_rules(rules)) == rules
+
+
+@timeout(10)
+def test_long_rule_compiles_without_recursion(tmp_path):
+    engine = substitution_utils.SubstitutionEngine(str(tmp_path / "substitution.txt"))
+    long_rule = "长" * 5000
+    assert engine.add_rule(long_rule)
+    assert engine.add_rule("长" * 10)
+    assert engine.apply("前" + long_rule + "后") == "前后"
+    assert engine.apply("前" + "长" * 12 + "后") == "前长长后"
+
+
+@timeout(5)
+def test_engine_add_and_remove_rules_are_journaled(tmp_path):
+    rules_path = str(tmp_path / "substitution.txt")
+    _write(rules_path, "xy")
+    engine = substitution_utils.SubstitutionEngine(rules_path)
+
+    assert engine.add_rule("登录领番茄")
+    assert not engine.add_rule("x")
+    assert engine.apply("x登录领番茄yz") == "z"
+    assert engine.remove_rule("y")
+    assert engine.rules == ["x", "登录领番茄"]
+    assert engine.apply("xyz") == "yz"
+
+    # Snapshot untouched, edits appended to the journal
+    with open(rules_path, encoding="utf-8") as f:
+        assert f.read() == "xy"
+    with open(engine.journal_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert records == [{"op": "add", "rule": "登录领番茄"}, {"op": "remove", "rule": "y"}]
+
+    # A fresh engine replays snapshot + journal, skipping a torn last line
+    with open(engine.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "ru')
+    reloaded = substitution_utils.SubstitutionEngine(rules_path)
+    assert reloaded.rules == ["x", "登录领番茄"]
+    # An edit after the torn line survives the next reload
+    assert reloaded.add_rule("z")
+    assert substitution_utils.SubstitutionEngine(rules_path).rules == ["x", "登录领番茄", "z"]
+
+
+@timeout(5)
+def test_engine_compacts_journal_into_snapshot(tmp_path):
+    rules_path = str(tmp_path / "substitution.txt")
+    engine = substitution_utils.SubstitutionEngine(rules_path, compact_every=3)
+
+    engine.add_rule("甲")
+    engine.add_rule("乙乙")
+    assert engine.remove_rule("甲")
+    with open(rules_path, encoding="utf-8") as f:
+        assert f.read() == substitution_utils.RULES_FILE_HEADER + "\n乙乙\n"
+    assert os.path.getsize(engine.journal_path) == 0
+
+    engine.add_rule("丙")
+    reloaded = substitution_utils.SubstitutionEngine(rules_path, compact_every=3)
+    assert reloaded.rules == ["乙乙", "丙"]
+
+
+@timeout(10)
+def test_index_add_action_stores_whole_text_as_rule(tmp_path, monkeypatch):
+    import app as app_module
+
+    engine = substitution_utils.SubstitutionEngine(str(tmp_path / "substitution.txt"))
+    monkeypatch.setattr(app_module, "SUBSTITUTION_ENGINE", engine)
+    test_client = app_module.app.test_client()
+
+    resp = test_client.post("/", data={"text": "本章完", "action": "add"})
+    assert resp.status_code == 200
+    assert engine.rules == ["本章完"]
+    assert resp.get_data(as_text=True) == ""
+
+    resp = test_client.get("/")
+    assert "本章完" in resp.get_data(as_text=True)
+
+    test_client.post("/", data={"text": "本章完", "action": "remove"})
+    assert engine.rules == []
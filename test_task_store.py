@@ -0,0 +1,255 @@
+import functools
+import signal
+import threading
+import time
+
+import comfy_utils
+import task_store
+from fake_comfy_server import FakeComfyServer
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+@timeout(5)
+def test_flush_writes_only_changed_records_and_survives_reopen(tmp_path):
+    path = str(tmp_path / "tasks.db")
+    store = task_store.TaskStore(path)
+    groups = store.restore("groups", {})
+    groups["1"] = {"status": "processing", "logs": []}
+    groups["2"] = {"status": "completed", "logs": []}
+    assert store.flush() == 2
+
+    # Log lines are batched: nothing is written until the next flush, then one row
+    for n in range(50):
+        groups["1"]["logs"].append(f"line {n}")
+    assert store.flush() == 1
+    assert store.flush() == 0
+
+    del groups["2"]
+    assert store.flush() == 1
+    store.close()
+
+    reopened = task_store.TaskStore(path)
+    restored = reopened.restore("groups", {})
+    assert list(restored) == ["1"] and len(restored["1"]["logs"]) == 50
+    assert reopened.flush() == 0
+    reopened.close()
+
+
+@timeout(20)
+def test_restart_reattaches_groups_and_fails_interrupted_submissions(tmp_path, monkeypatch):
+    import app as app_module
+
+    with FakeComfyServer(default_exec_time=(0.05, 0), exec_times={}) as fake:
+        client = comfy_utils.ComfyUIClient(fake.address, prompt_index=comfy_utils.PromptIndex(str(tmp_path / "index.jsonl")))
+        monkeypatch.setattr(comfy_utils, "client", client)
+        # Finishes on ComfyUI while the app is down
+        prompt_id, server = client.queue_prompt({"1": {"class_type": "SaveVideo", "inputs": {}}})
+        orphan_id, _ = client.queue_prompt({"1": {"class_type": "SaveVideo", "inputs": {}}})
+
+        path = str(tmp_path / "tasks.db")
+        before = task_store.TaskStore(path)
+        before.track("groups", {
+            "running": {
+                "status": "processing", "created_at": None, "workflow_type": "real", "monitor_started": True,
+                "finished_task_count": 1,
+                "tasks": [{"task_id": prompt_id, "server": server, "status": "pending", "segment_index": 0, "result_path": None}],
+            },
+            "submitting": {
+                "status": "processing", "created_at": None, "workflow_type": "real",
+                "tasks": [{"task_id": orphan_id, "server": server, "status": "pending", "segment_index": 0, "result_path": None}],
+            },
+        })
+        before.track("sector_tasks", {"s1": {"status": "processing", "logs": []}})
+        before.close()
+
+        finished = threading.Event()
+        for name in ["TASKS_STORE", "SECTOR_TASKS", "AUDIO_TASKS"]:
+            monkeypatch.setattr(app_module, name, {})
+        monkeypatch.setattr(app_module, "CHANNEL_TRANSITION_GROUPS", dict(app_module.CHANNEL_TRANSITION_GROUPS))
+        monkeypatch.setattr(app_module, "GLOBAL_STATE", {"sector7": {"text": ""}})
+        monkeypatch.setattr(app_module, "UPLOAD_FOLDER", str(tmp_path))
+        monkeypatch.setattr(app_module, "_finish_group", lambda group_id: finished.set())
+
+        store = app_module.start_task_store(path)
+        try:
+            assert finished.wait(10)
+            task = app_module.TASKS_STORE["running"]["tasks"][0]
+            assert task["status"] == "completed" and task["result_path"].startswith(str(tmp_path))
+            submitting = app_module.TASKS_STORE["submitting"]
+            assert submitting["status"] == "failed" and "submission" in submitting["error"]
+            assert app_module.SECTOR_TASKS["s1"]["status"] == "failed"
+        finally:
+            store.close()
+            client.close_listeners()
+        # The recovered state is what the store holds now
+        assert task_store.TaskStore(path).load("groups")["running"]["tasks"][0]["status"] == "completed"
+
+
+@timeout(10)
+def test_recovered_prompts_count_toward_the_backlog(tmp_path, monkeypatch):
+    import app as app_module
+    import workflow_utils
+
+    client = comfy_utils.ComfyUIClient("127.0.0.1:1", prompt_index=comfy_utils.PromptIndex(str(tmp_path / "index.jsonl")))
+    scheduler = comfy_utils.ServerScheduler(client, ["127.0.0.1:1"])
+    monkeypatch.setattr(comfy_utils, "scheduler", scheduler)
+    for name in ["monitor_group_task", "monitor_i2v_group", "monitor_audio_task"]:
+        monkeypatch.setattr(app_module, name, lambda task_id: None)
+    now = time.time()
+    monkeypatch.setattr(app_module, "TASKS_STORE", {
+        "seg": task_store.GroupRecord({
+            "status": "processing", "created_at": now, "workflow_type": "anime", "monitor_started": True, "tasks": [
+                {"task_id": "p1", "status": "pending", "job": {"family": "vace"}, "attempts": [
+                    {"task_id": "p1", "status": "running", "queued_at": now},
+                    {"task_id": "p1b", "status": "running", "queued_at": now},
+                ]},
+                {"task_id": "p2", "status": "completed", "job": {"family": "vace"}, "attempts": []},
+            ],
+        }),
+        "i2v": task_store.GroupRecord({
+            "status": "processing", "created_at": now, "workflow_type": "i2v", "monitor_started": True,
+            "tasks": [{"task_id": "p3", "status": "pending"}],
+        }),
+    })
+    monkeypatch.setattr(app_module, "AUDIO_TASKS", {"p4": {"status": "pending", "created_at": now}})
+    monkeypatch.setattr(app_module, "SECTOR_TASKS", {})
+    try:
+        assert scheduler.backlog_seconds() == 0
+        app_module.recover_tasks()
+        registry = workflow_utils.registry
+        assert scheduler.outstanding() == {"vace": 2, registry.family("i2v"): 1, registry.family("audio"): 1}
+        assert scheduler.backlog_seconds() > 0
+    finally:
+        client.close_listeners()
+
+
+def test_records_keep_dict_behaviour_with_bounded_logs(tmp_path, monkeypatch):
+    monkeypatch.setattr(task_store, "TASK_LOG_LINE_MAX_CHARS", 10)
+    group = task_store.GroupRecord({"status": "processing", "tasks": [{"task_id": "p1", "status": "pending"}]})
+    group["logs"] = task_store.LogRing(capacity=3)
+    group["custom"] = 1
+    assert isinstance(group["tasks"][0], task_store.SegmentRecord)
+    assert "error" not in group and group.get("error") is None
+    assert group.setdefault("logs", []) is group["logs"]
+    for n in range(5):
+        group["logs"].append(f"line {n}")
+    group["logs"].append("x" * 50)
+    assert list(group["logs"]) == ["line 3", "line 4", "x" * 10 + " …"]
+    assert group["logs"].since(4) == (["line 4", "x" * 10 + " …"], 6)
+    assert list(group) == ["status", "tasks", "logs", "custom"]
+    assert group["tasks"] == [{"task_id": "p1", "status": "pending"}]
+
+    store = task_store.TaskStore(str(tmp_path / "tasks.db"))
+    groups = store.track("groups", {"g": group})
+    assert store.flush() == 1
+    restored = store.restore("groups", groups, task_store.GroupRecord)["g"]
+    assert isinstance(restored["logs"], task_store.LogRing) and restored["tasks"][0]["task_id"] == "p1"
+    assert store.flush() == 0
+
+    # Finished records expire a TTL after a sweep first sees them finished
+    groups["g"]["status"] = "completed"
+    assert task_store.evict_expired(groups, ttl=60, now=1000) == []
+    assert task_store.evict_expired(groups, ttl=60, now=1059) == []
+    assert task_store.evict_expired(groups, ttl=60, now=1060, keep={"g"}) == []
+    assert task_store.evict_expired(groups, ttl=60, now=1060) == ["g"]
+    assert store.flush() == 1 and store.load("groups") == {}
+    store.close()
+
+
+def test_memory_stats_reports_records_and_evictions(monkeypatch):
+    import app as app_module
+
+    sector = task_store.SectorRecord({"status": "completed", "logs": ["done"], "created_at": 0})
+    monkeypatch.setattr(app_module, "SECTOR_TASKS", {"old": sector})
+    monkeypatch.setattr(app_module, "TASKS_STORE", {})
+    monkeypatch.setattr(app_module, "AUDIO_TASKS", {})
+    monkeypatch.setattr(app_module, "GLOBAL_STATE", {})
+    monkeypatch.setattr(app_module, "EVICTED_RECORDS", {"groups": 0, "sector_tasks": 0, "audio_tasks": 0})
+    test_client = app_module.app.test_client()
+
+    assert test_client.get("/check_sector_task/old").get_json()["logs"] == ["done"]
+    stats = test_client.get("/memory_stats").get_json()
+    assert stats["rss_bytes"] > 0
+    assert stats["records"]["sector_tasks"]["records"] == 1 and stats["records"]["sector_tasks"]["log_lines"] == 1
+
+    app_module._evict_expired_tasks(now=0)
+    app_module._evict_expired_tasks(now=task_store.TASK_RECORD_TTL_SECONDS)
+    assert app_module.SECTOR_TASKS == {}
+    assert test_client.get("/memory_stats").get_json()["evicted"]["sector_tasks"] == 1
+
+
+def test_status_polls_send_new_log_lines_and_304_when_unchanged(monkeypatch):
+    import app as app_module
+
+    group = task_store.GroupRecord({"status": "processing", "tasks": [{"task_id": "p1", "status": "pending"}], "logs": ["a", "b"]})
+    monkeypatch.setattr(app_module, "TASKS_STORE", {"g": group})
+    test_client = app_module.app.test_client()
+
+    full = test_client.get("/check_group_status/g").get_json()
+    assert full["logs"] == ["a", "b"] and full["log_cursor"] == 2 and full["final_url"] is None
+    epoch = full["log_epoch"]
+
+    resp = test_client.get(f"/check_group_status/g?since=2&epoch={epoch}")
+    assert resp.get_json() == {"status": "processing", "progress": "0/1", "logs": [], "log_cursor": 2, "log_epoch": epoch}
+    etag = resp.headers["ETag"]
+    assert test_client.get(f"/check_group_status/g?since=2&epoch={epoch}", headers={"If-None-Match": etag}).status_code == 304
+
+    group["logs"].append("c")
+    resp = test_client.get(f"/check_group_status/g?since=2&epoch={epoch}", headers={"If-None-Match": etag})
+    assert resp.status_code == 200 and resp.get_json()["logs"] == ["c"] and resp.get_json()["log_cursor"] == 3
+
+    # A cursor from before a restart gets the whole log again
+    reset = test_client.get("/check_group_status/g?since=40").get_json()
+    assert reset["logs_reset"] is True and reset["logs"] == ["a", "b", "c"]
+
+    sector = task_store.SectorRecord({"status": "processing", "logs": ["x"], "type": "sector17"})
+    monkeypatch.setattr(app_module, "SECTOR_TASKS", {"s": sector})
+    assert test_client.get("/check_sector_task/s?since=1").get_json() == {
+        "status": "processing", "type": "sector17", "logs": [], "log_cursor": 1, "log_epoch": sector["logs"].epoch,
+    }
+
+
+def test_status_poll_resets_a_cursor_from_before_a_restart(tmp_path, monkeypatch):
+    import app as app_module
+
+    store = task_store.TaskStore(str(tmp_path / "tasks.db"))
+    groups = store.restore("groups", {}, task_store.GroupRecord)
+    groups["g"] = task_store.GroupRecord({"status": "processing", "tasks": [], "logs": []})
+    groups["g"]["logs"] = task_store.LogRing(capacity=3)
+    groups["g"]["logs"].extend(["a", "b", "c", "d", "e"])
+    store.flush()
+    monkeypatch.setattr(app_module, "TASKS_STORE", groups)
+    test_client = app_module.app.test_client()
+    before = test_client.get("/check_group_status/g").get_json()
+    assert before["logs"] == ["c", "d", "e"] and before["log_cursor"] == 5
+    store.close()
+
+    # The restored ring numbers its lines from 0; once it has grown past the
+    # old cursor, that cursor must not skip "f" and "g"
+    reopened = task_store.TaskStore(str(tmp_path / "tasks.db"))
+    restored = reopened.restore("groups", {}, task_store.GroupRecord)
+    restored["g"]["logs"].extend(["f", "g", "h"])
+    monkeypatch.setattr(app_module, "TASKS_STORE", restored)
+    after = test_client.get(f"/check_group_status/g?since=5&epoch={before['log_epoch']}").get_json()
+    assert after["logs_reset"] is True and after["logs"] == ["c", "d", "e", "f", "g", "h"]
+    assert after["log_epoch"] != before["log_epoch"]
+    reopened.close()
@@ -0,0 +1,128 @@
+import functools
+import json
+import os
+import signal
+
+import comfy_utils
+import workflow_utils
+
+
+def timeout(seconds):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def handler(signum, frame):
+                raise TimeoutError("Test timed out")
+
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.alarm(seconds)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                signal.alarm(0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+        return wrapper
+
+    return decorator
+
+
+def _write_workflow(path, workflow, mtime=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(workflow, f)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def _sample_workflow(text="default"):
+    return {
+        "1": {"class_type": "LoadImage", "inputs": {"image": "a.png"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": text, "clip": ["3", 0]}},
+        "3": {"class_type": "CLIPLoader", "inputs": {"clip_name": "x"}},
+        "4": {"class_type": "CreateVideo", "inputs": {"fps": 16}},
+        "5": {"class_type": "SaveVideo", "inputs": {"fps": 16}},
+    }
+
+
+@timeout(5)
+def test_instances_do_not_mutate_template(tmp_path):
+    _write_workflow(str(tmp_path / "wf.json"), _sample_workflow())
+    registry = workflow_utils.TemplateRegistry(str(tmp_path))
+    template = registry.register("wf", "wf.json", {
+        "image": [("1", "image")],
+        "text": [("2", "text")],
+        "fps": [("*", "fps")],
+        "missing": [("99", "image")],
+    })
+
+    first = template.instantiate(image="b.png", fps=25)
+    second = template.instantiate(text="other")
+
+    assert first["1"]["inputs"]["image"] == "b.png"
+    assert first["4"]["inputs"]["fps"] == 25 and first["5"]["inputs"]["fps"] == 25
+    assert first["2"]["inputs"]["text"] == "default"
+    assert second["1"]["inputs"]["image"] == "a.png"
+    assert second["2"]["inputs"]["text"] == "other"
+    # Untouched nodes are shared, written ones are private copies
+    assert first["3"] is second["3"]
+    assert first["1"] is not second["1"]
+    assert template.default("image") == "a.png"
+    assert template.slots["missing"] == []
+
+    # Repeated writes to an owned node stay in that instance
+    workflow_utils.set_input(first, "1", "image", "c.png")
+    assert template.instance()["1"]["inputs"]["image"] == "a.png"
+
+
+@timeout(5)
+def test_template_reloads_when_file_changes(tmp_path):
+    path = str(tmp_path / "wf.json")
+    _write_workflow(path, _sample_workflow("v1"), mtime=1_000_000)
+    registry = workflow_utils.TemplateRegistry(str(tmp_path))
+    template = registry.register("wf", "wf.json", {"text": [("2", "text")]})
+    assert template.instance()["2"]["inputs"]["text"] == "v1"
+
+    _write_workflow(path, _sample_workflow("v2"), mtime=2_000_000)
+    assert template.instance()["2"]["inputs"]["text"] == "v2"
+
+
+@timeout(5)
+def test_missing_template_and_unknown_slot(tmp_path):
+    registry = workflow_utils.TemplateRegistry(str(tmp_path))
+    registry.register("gone", "gone.json", {})
+    try:
+        registry.get("gone")
+        assert False, "expected FileNotFoundError"
+    except FileNotFoundError:
+        pass
+
+    _write_workflow(str(tmp_path / "wf.json"), _sample_workflow())
+    template = registry.register("wf", "wf.json", {"text": [("2", "text")]})
+    try:
+        template.instantiate(image="x.png")
+        assert False, "expected KeyError"
+    except KeyError:
+        pass
+
+
+@timeout(10)
+def test_shipped_templates_match_legacy_modify_functions():
+    import app
+
+    path = os.path.join(workflow_utils.TEMPLATE_DIR, "图生视频video_wan2_2_14B_i2v.json")
+    with open(path, 'r', encoding='utf-8') as f:
+        legacy = json.load(f)
+    legacy["97"]["inputs"]["image"] = "char.png"
+    legacy["93"]["inputs"]["text"] = "a prompt"
+    assert app.modify_i2v_workflow(
+        workflow_utils.registry.get("i2v").instance(), "char.png", "a prompt"
+    ) == legacy
+
+    workflow = comfy_utils.build_workflow_template("char.png", "clip.mp4", "hi", "real", segment_duration=1.0)
+    fps = workflow["232:15"]["inputs"]["fps"]
+    assert workflow["10"]["inputs"]["image"] == "char.png"
+    assert workflow["145"]["inputs"]["file"] == "clip.mp4"
+    assert workflow["232:62"]["inputs"]["length"] == max(4, fps)
+    pristine = workflow_utils.registry.get("animate").instance()
+    assert pristine["145"]["inputs"]["file"] != "clip.mp4"
+    assert pristine["232:62"]["inputs"]["length"] != workflow["232:62"]["inputs"]["length"]
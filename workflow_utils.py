@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+
+# Directory holding the ComfyUI API-format workflows (used in: TemplateRegistry.register)
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "comfyapi")
+
+# Emotion inputs of the IndexTTS emotion vector node (used in: audio template slots, modify_audio_workflow)
+AUDIO_EMOTIONS = ["Happy", "Angry", "Sad", "Fear", "Hate", "Low", "Surprise", "Neutral"]
+
+
+class WorkflowInstance(dict):
+    """
+    A workflow produced from a template. The top-level dict is new, but
+    untouched nodes are shared with the parsed template; set_input copies a
+    node (and its inputs) the first time it is written. family names the
+    template family, so the scheduler can tell which models it will load.
+    """
+
+    __slots__ = ("_owned", "family")
+
+    def __init__(self, nodes, family=None):
+        super().__init__(nodes)
+        self._owned = set()
+        self.family = family
+
+
+def set_input(workflow, node_id, key, value):
+    """Writes one node input; copy-on-write for WorkflowInstance, in place otherwise."""
+    node = workflow.get(node_id)
+    if not isinstance(node, dict):
+        return False
+    if isinstance(workflow, WorkflowInstance) and node_id not in workflow._owned:
+        node = dict(node)
+        node["inputs"] = dict(node.get("inputs", {}))
+        workflow[node_id] = node
+        workflow._owned.add(node_id)
+    node.setdefault("inputs", {})[key] = value
+    return True
+
+
+def family_of(workflow):
+    """Template family of a workflow, or None for a plain dict."""
+    return getattr(workflow, "family", None)
+
+
+def get_input(workflow, node_id, key, default=None):
+    node = workflow.get(node_id)
+    if not isinstance(node, dict):
+        return default
+    return node.get("inputs", {}).get(key, default)
+
+
+class WorkflowTemplate:
+    """
+    One parsed workflow file plus its named parameter slots.
+
+    slots maps a slot name to a list of (node_id, input_key) targets; a node
+    id of "*" targets every node that has that input (e.g. all fps inputs).
+    Targets whose node is missing from the file are ignored. The file is
+    parsed once and re-parsed only when its mtime changes.
+    """
+
+    def __init__(self, name, path, slots, family=None):
+        self.name = name
+        self.path = path
+        self.family = family or name
+        self._slot_spec = {slot: list(targets) for slot, targets in slots.items()}
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._nodes = None
+        self._slots = {}
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                nodes = json.load(f)
+            resolved = {}
+            for slot, targets in self._slot_spec.items():
+                resolved[slot] = []
+                for node_id, key in targets:
+                    if node_id == "*":
+                        resolved[slot].extend(
+                            (nid, key) for nid, node in nodes.items()
+                            if isinstance(node, dict) and key in node.get("inputs", {})
+                        )
+                    elif isinstance(nodes.get(node_id), dict) and "inputs" in nodes[node_id]:
+                        resolved[slot].append((node_id, key))
+            self._nodes = nodes
+            self._slots = resolved
+            self._mtime = mtime
+
+    @property
+    def slots(self):
+        self._load()
+        return {slot: list(targets) for slot, targets in self._slots.items()}
+
+    def default(self, slot, fallback=None):
+        """Value of the slot's first target in the template file."""
+        self._load()
+        targets = self._slots.get(slot)
+        if not targets:
+            return fallback
+        node_id, key = targets[0]
+        return get_input(self._nodes, node_id, key, fallback)
+
+    def instance(self):
+        """Cheap structural copy: a new top-level dict sharing every node."""
+        self._load()
+        return WorkflowInstance(self._nodes, self.family)
+
+    def bind(self, workflow, **values):
+        """Writes each non-None slot value into workflow; returns workflow."""
+        self._load()
+        for slot, value in values.items():
+            if value is None:
+                continue
+            if slot not in self._slots:
+                raise KeyError(f"Template {self.name} has no slot {slot!r}")
+            for node_id, key in self._slots[slot]:
+                set_input(workflow, node_id, key, value)
+        return workflow
+
+    def instantiate(self, **values):
+        return self.bind(self.instance(), **values)
+
+
+class TemplateRegistry:
+    """Named workflow templates, parsed on first use."""
+
+    def __init__(self, template_dir=TEMPLATE_DIR):
+        self.template_dir = template_dir
+        self._templates = {}
+
+    def register(self, name, filename, slots, family=None):
+        template = WorkflowTemplate(name, os.path.join(self.template_dir, filename), slots, family)
+        self._templates[name] = template
+        return template
+
+    def path(self, name):
+        return self._templates[name].path
+
+    def family(self, name):
+        return self._templates[name].family
+
+    def get(self, name):
+        """Returns the template; raises FileNotFoundError if its file is missing."""
+        template = self._templates[name]
+        if not os.path.exists(template.path):
+            raise FileNotFoundError(f"Workflow file not found: {template.path}")
+        return template
+
+    def instantiate(self, name, **values):
+        return self.get(name).instantiate(**values)
+
+    def names(self):
+        return list(self._templates)
+
+
+registry = TemplateRegistry()
+
+registry.register("i2v", "图生视频video_wan2_2_14B_i2v.json", {
+    "image": [("97", "image")],
+    "text": [("93", "text")],
+}, family="wan2.2_i2v")
+
+registry.register("audio", "audio_workflow.json", {
+    "text": [("27", "text")],
+    "seed": [("27", "seed")],
+    "audio": [("29", "audio")],
+    **{emotion: [("47", emotion)] for emotion in AUDIO_EMOTIONS},
+}, family="index_tts")
+
+registry.register("extend_video", "扩展视频到音频长度.json", {
+    "video": [("14", "video")],
+    "audio": [("66", "audio")],
+}, family="heygem")
+
+registry.register("animate", "视频换人video_wan2_2_14B_animate.json", {
+    "image": [("10", "image"), ("134", "image")],
+    "video": [("145", "file")],
+    "text": [("21", "text")],
+    "length": [("232:62", "length"), ("242:90", "length")],
+    "fps": [("232:15", "fps")],
+    "seed": [("232:63", "seed"), ("242:91", "seed"), ("64", "seed")],
+}, family="wan2.2_animate")
+
+registry.register("vace", "视频换人2video_wan_vace_14B_v2v.json", {
+    "image": [("10", "image"), ("134", "image")],
+    "video": [("145", "file")],
+    "text": [("21", "text")],
+    "length": [("49", "length")],
+    "fps": [("68", "fps")],
+    "seed": [("232:63", "seed"), ("242:91", "seed"), ("64", "seed")],
+}, family="wan2.1_vace")
+
+registry.register("transition", "收尾帧wan2.1_flf2v_720_f16.json", {
+    "start_image": [("52", "image")],
+    "end_image": [("72", "image")],
+    "width": [("83", "width")],
+    "height": [("83", "height")],
+    "length": [("83", "length")],
+    "fps": [("*", "fps")],
+    "text": [("6", "text")],
+}, family="wan2.1_flf2v")